@@ -0,0 +1,154 @@
+"""Compare the token-aware markdown chunker with the character splitter it replaced.
+
+Pages are the synthetic fixtures run through the data processing extractor,
+plus generated rules pages with nested headings. For each splitter the
+report gives the number of chunks (one embedding call each), their token
+sizes and the median time to split the whole corpus. The character
+splitter needs ``langchain-text-splitters`` and is skipped without it.
+
+Splitting is slower than the character splitter, as it has to tokenize
+every page; ``tokenize_only`` is the time to encode the corpus once, the
+floor for any token-sized chunker. The gain is in embedding calls. Before
+timing, pages with titles and headings longer than a chunk are split at
+small and default sizes, and must give chunks within budget.
+
+Token counts use cl100k_base when it can be loaded (online, or from
+TIKTOKEN_CACHE_DIR) and the offline encoding from ``fakes.py`` otherwise.
+
+Usage:
+    python benchmarks/chunking.py --synthetic 200
+"""
+import argparse
+import json
+import random
+import statistics
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common import fixture_pages, load_lambda, summarize, timed
+
+Page = Tuple[str, Optional[str]]
+
+_WORDS = (
+    'action attack bonus creature damage effect level range save spell strike '
+    'target trait turn until weapon reaction fortitude reflex will persistent'
+).split()
+
+
+def legacy_splitter() -> Optional[Callable[[str, Optional[str]], List[str]]]:
+    """The RecursiveCharacterTextSplitter configuration the Lambda used"""
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        return None
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=100,
+        length_function=len,
+        separators=["\n## ", "\n# ", "\n### ", "\n\n", "\n", " ", ""]
+    )
+
+    def split(text: str, title: Optional[str]) -> List[str]:
+        if len(text) < 1000:
+            return [text]
+        if title:
+            text = f"# {title}\n\n{text}"
+        return splitter.split_text(text)
+    return split
+
+
+def synthetic_page(rng: random.Random) -> Page:
+    def sentence() -> str:
+        return ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(6, 20))).capitalize() + '.'
+
+    title = sentence()[:30].rstrip('.')
+    parts = [f"# {title}"]
+    for section in range(rng.randint(2, 6)):
+        parts.append(f"## Section {section + 1}")
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.3:
+                parts.append(f"### {sentence()[:24]}")
+            if rng.random() < 0.2:
+                parts.append('\n'.join(f"- {sentence()}" for _ in range(rng.randint(2, 6))))
+            else:
+                parts.append(' '.join(sentence() for _ in range(rng.randint(2, 12))))
+    return '\n\n'.join(parts), title
+
+
+def corpus(n_synthetic: int, seed: int = 0) -> List[Page]:
+    processing = load_lambda('data_processing')
+    pages = [
+        (extracted.markdown, extracted.title)
+        for content_type, html in fixture_pages().items()
+        for extracted in [processing.process_html_content(html, f"https://2e.aonprd.com/{content_type}.aspx?ID=1")]
+        if extracted.markdown
+    ]
+    rng = random.Random(seed)
+    return pages + [synthetic_page(rng) for _ in range(n_synthetic)]
+
+
+def check_long_headings(chunker_class: type) -> None:
+    """Raise if a title or heading path filling the budget breaks chunking"""
+    words = ' '.join(_WORDS)
+    text = '\n\n'.join([f"## {words * 40}", f"### {words * 5}", ' '.join([f"{words}."] * 80), 'x' * 5000])
+    for max_tokens in (64, 512):
+        chunker = chunker_class(max_tokens=max_tokens, overlap_tokens=max_tokens // 8)
+        chunks = chunker.split(text, title=words * 40)
+        over = [chunk for chunk in chunks if chunker.count_tokens(chunk.text) > max_tokens]
+        if not chunks or over:
+            raise AssertionError(f"{len(over)} of {len(chunks)} chunks over {max_tokens} tokens")
+
+
+def measure(
+    split: Callable[[str, Optional[str]], List[str]],
+    pages: List[Page],
+    count_tokens: Callable[[str], int],
+    max_tokens: int,
+    repeat: int
+) -> Dict[str, float]:
+    chunks = [chunk for text, title in pages for chunk in split(text, title)]
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    return {
+        'chunks': len(chunks),
+        'mean_tokens': round(statistics.mean(tokens), 1),
+        'max_tokens': max(tokens),
+        'over_budget': sum(1 for t in tokens if t > max_tokens),
+        **summarize(timed(lambda: [split(text, title) for text, title in pages], repeat), len(pages)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--synthetic', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    vectorization = load_lambda('vectorization_lambda')
+    from chunker import MarkdownChunker
+    from fakes import install_encoding
+    encoding = install_encoding()
+    chunker = MarkdownChunker()
+    pages = corpus(args.synthetic)
+    check_long_headings(MarkdownChunker)
+
+    report = {'pages': len(pages), 'encoding': encoding, 'chunk_tokens': chunker.max_tokens}
+    report['tokenize_only'] = summarize(
+        timed(lambda: [chunker.count_tokens(text) for text, _ in pages], args.repeat), len(pages)
+    )
+    report['markdown_chunker'] = measure(
+        lambda text, title: [chunk.text for chunk in vectorization.create_text_chunks(text, title)],
+        pages, chunker.count_tokens, chunker.max_tokens, args.repeat
+    )
+    legacy = legacy_splitter()
+    if legacy is not None:
+        report['character_splitter'] = measure(
+            legacy, pages, chunker.count_tokens, chunker.max_tokens, args.repeat
+        )
+        report['embedding_calls_saved'] = (
+            report['character_splitter']['chunks'] - report['markdown_chunker']['chunks']
+        )
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
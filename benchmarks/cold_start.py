@@ -0,0 +1,124 @@
+"""Measure Lambda module import and first-use times in fresh interpreters.
+
+Each run starts a new Python process, imports a handler module and then
+exercises the work every first invocation pays for: chunking a page for
+the vectorization Lambda, extracting one for data processing, and
+creating the AWS clients. Reports p50/p99 over ``--runs`` per stage.
+
+With ``--baseline-ref`` the same measurements are taken for the Lambda
+sources at that git ref, so before/after numbers come from one command.
+
+Usage:
+    python benchmarks/cold_start.py --runs 20 --baseline-ref HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List
+
+from common import FIXTURES_DIR, LAMBDA_DIR, ROOT
+
+# Runs inside the child process; {lambda_dir} and {shared_dir} are filled in
+_PROBE = '''
+import json, os, sys, time
+sys.path[:0] = [p for p in ({lambda_dir!r}, {shared_dir!r}) if os.path.isdir(p)]
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+{first_use}
+used = time.perf_counter()
+import boto3
+for service in {services!r}:
+    boto3.client(service)
+clients = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'first_use_ms': (used - imported) * 1000,
+    'client_setup_ms': (clients - used) * 1000,
+}}))
+'''
+
+_TARGETS = {
+    'vectorization_lambda': {
+        'first_use': "index.create_text_chunks('Some rules text. ' * 400, 'Title')",
+        'services': ['s3', 'secretsmanager', 'bedrock-runtime'],
+    },
+    'data_processing': {
+        'first_use': (
+            "index.process_html_content(open({fixture!r}).read(), 'https://2e.aonprd.com/Spells.aspx?ID=1')"
+        ),
+        'services': ['s3'],
+    },
+}
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def measure(lambda_root: Path, runs: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    env = {**os.environ, 'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')}
+    fixture = str(FIXTURES_DIR / 'Spells.html')
+    report = {}
+    for name, target in _TARGETS.items():
+        probe = _PROBE.format(
+            lambda_dir=str(lambda_root / name),
+            shared_dir=str(lambda_root / 'shared' / 'python'),
+            first_use=target['first_use'].format(fixture=fixture),
+            services=target['services'],
+        )
+        samples: Dict[str, List[float]] = {}
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', probe],
+                cwd=lambda_root / name, env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            for stage, value in json.loads(output).items():
+                samples.setdefault(stage, []).append(value)
+        samples['total_ms'] = [sum(values) for values in zip(*samples.values())]
+        report[name] = {
+            stage: {
+                'p50': round(statistics.median(values), 1),
+                'p99': round(_percentile(values, 99), 1),
+            }
+            for stage, values in samples.items()
+        }
+    return report
+
+
+def export_ref(ref: str, destination: Path) -> Path:
+    """Extract the ``lambda`` tree at a git ref into ``destination``"""
+    archive = subprocess.run(
+        ['git', 'archive', '--format=tar', ref, 'lambda'],
+        cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(destination)
+    return destination / 'lambda'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--baseline-ref', help='git ref to measure for comparison')
+    args = parser.parse_args()
+
+    report = {'runs': args.runs, 'current': measure(LAMBDA_DIR, args.runs)}
+    if args.baseline_ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline_root = export_ref(args.baseline_ref, Path(tmp))
+            report['baseline'] = {'ref': args.baseline_ref, **measure(baseline_root, args.runs)}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
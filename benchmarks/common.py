@@ -0,0 +1,90 @@
+"""Shared helpers for the offline pipeline benchmarks.
+
+The Lambda handlers live in sibling directories that each expose an
+``index`` module, so they are loaded under distinct names here.
+"""
+import importlib.util
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Dict, Iterator, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+LAMBDA_DIR = ROOT / 'lambda'
+# Modules deployed to both functions as a Lambda layer
+SHARED_DIR = LAMBDA_DIR / 'shared' / 'python'
+# Short synthetic pages in the aonprd span layout, not captures of the live site
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures' / 'aonprd'
+
+_loaded: Dict[str, ModuleType] = {}
+
+
+def load_lambda(name: str) -> ModuleType:
+    """Import ``lambda/<name>/index.py`` as ``<name>_index``"""
+    if name in _loaded:
+        return _loaded[name]
+
+    lambda_dir = LAMBDA_DIR / name
+    for path in (SHARED_DIR, lambda_dir):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+
+    module_name = f"{name}_index"
+    spec = importlib.util.spec_from_file_location(module_name, lambda_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    _loaded[name] = module
+    return module
+
+
+def fixture_pages() -> Dict[str, str]:
+    """Return the hand-written pages in the aonprd layout, keyed by content type"""
+    return {
+        path.stem: path.read_text(encoding='utf-8')
+        for path in sorted(FIXTURES_DIR.glob('*.html'))
+    }
+
+
+def iter_crawl_lines(n_items: int) -> Iterator[str]:
+    """Yield crawler-style JSONL lines by cycling through the fixture pages"""
+    pages = list(fixture_pages().items())
+    for i in range(n_items):
+        content_type, html = pages[i % len(pages)]
+        yield json.dumps({
+            'url': f"https://2e.aonprd.com/{content_type}.aspx?ID={i}",
+            'content': html
+        })
+
+
+def timed(fn: Callable[[], object], repeat: int = 3) -> List[float]:
+    """Run ``fn`` ``repeat`` times and return the wall-clock durations"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations: List[float], units: int) -> Dict[str, float]:
+    """Median duration and throughput for a set of timed runs"""
+    median = statistics.median(durations)
+    return {
+        'median_seconds': round(median, 4),
+        'units_per_second': round(units / median, 1) if median else 0.0,
+    }
+
+
+def percentiles(values: List[float], points: Tuple[int, ...] = (50, 90, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles of durations in seconds, reported in milliseconds"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f"p{pct}": round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000, 2)
+        for pct in points
+    }
@@ -0,0 +1,48 @@
+"""Compare serial and process-pool HTML extraction throughput.
+
+Workers only pay off with spare CPUs: on one CPU they share the core with
+the parent and run at about serial speed, less the pipe round trips. The
+report gives the CPUs available, so runs on different machines compare.
+
+Usage:
+    python benchmarks/extraction_throughput.py --items 2000 --workers 1 2 4
+"""
+import argparse
+import json
+import os
+
+from common import iter_crawl_lines, load_lambda, summarize, timed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument('--chunk-size', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    index = load_lambda('data_processing')
+    lines = list(iter_crawl_lines(args.items))
+
+    def run(workers: int) -> None:
+        results = index.iter_process_items(lines, workers=workers, chunk_size=args.chunk_size)
+        failures = sum(1 for _, failure in results if failure)
+        if failures:
+            raise RuntimeError(f"{failures} items failed to extract")
+
+    report = {'items': args.items, 'cpus': len(os.sched_getaffinity(0)), 'chunk_size': args.chunk_size, 'runs': {}}
+    for workers in sorted(set(args.workers)):
+        label = 'serial' if workers == 1 else f"{workers}_workers"
+        report['runs'][label] = summarize(timed(lambda: run(workers), args.repeat), args.items)
+
+    serial = report['runs'].get('serial')
+    if serial:
+        for stats in report['runs'].values():
+            stats['speedup'] = round(serial['median_seconds'] / stats['median_seconds'], 2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Check the template extractor against trafilatura on the fixture pages.
+
+For every page the word-level recall of trafilatura's output within the
+template output is reported, along with the precision of the template
+output against trafilatura's (so navigation or sidebar chrome leaking
+into the template output shows up), their F1 and per-page extraction
+time for both paths. Exits non-zero when any page falls below
+``--min-recall`` or ``--min-precision``.
+
+The Lambda calls trafilatura with ``deduplicate=True``, which drops text
+segments already seen in the process. Timing the same page repeatedly
+would then measure a mostly empty page, so its cache is cleared before
+every call and each one costs what a first sighting does.
+
+Usage:
+    python benchmarks/extractor_parity.py --min-recall 0.95 --min-precision 0.9
+"""
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from typing import List, Pattern
+
+from common import fixture_pages, load_lambda, summarize, timed
+
+# Splits on case changes too, since trafilatura glues adjacent trait links together
+_WORDS = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+')
+
+# Noise trafilatura keeps but the template extractor drops on purpose:
+# version superscripts, raw inline tags, the "display options" nav line
+# and pipe-separated rows of navigation links
+_NOISE = [
+    re.compile(r'<sup>.*?</sup>'),
+    re.compile(r'</?\w+>'),
+    re.compile(r'Quick display options:.*?entry\.'),
+    re.compile(r'^[^|\n]+(?: \| [^|\n]+)+$', re.MULTILINE),
+]
+
+# Output the template extractor adds on purpose: the label of the trait
+# line and tables, which trafilatura drops at the end of a content span
+_ADDED = [
+    re.compile(r'\*\*Traits\*\*'),
+    re.compile(r'^\|.*\|$', re.MULTILINE),
+]
+
+
+def _words(text: str, patterns: List[Pattern]) -> Counter:
+    for pattern in patterns:
+        text = pattern.sub(' ', text)
+    return Counter(w.lower() for w in _WORDS.findall(text))
+
+
+def _overlap(expected: Counter, found: Counter) -> float:
+    total = sum(expected.values())
+    if not total:
+        return 1.0
+    return sum(min(count, found[word]) for word, count in expected.items()) / total
+
+
+def word_recall(reference: str, candidate: str) -> float:
+    """Fraction of reference words (with multiplicity) present in the candidate"""
+    return _overlap(_words(reference, _NOISE), _words(candidate, []))
+
+
+def word_precision(reference: str, candidate: str) -> float:
+    """Fraction of candidate words (with multiplicity) present in the reference"""
+    return _overlap(_words(candidate, _ADDED), _words(reference, _NOISE))
+
+
+def f1(precision: float, recall: float) -> float:
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    parser.add_argument('--min-precision', type=float, default=0.9)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    index = load_lambda('data_processing')
+    from trafilatura.deduplication import LRU_TEST
+
+    def extract(html: str, url: str):
+        LRU_TEST.clear()
+        return index.process_html_content(html, url)
+
+    report = {}
+
+    for content_type, html in fixture_pages().items():
+        url = f"https://2e.aonprd.com/{content_type}.aspx?ID=1"
+
+        index.FAST_EXTRACTOR_ENABLED = False
+        reference = extract(html, url).markdown
+        slow = timed(lambda: extract(html, url), args.repeat)
+
+        index.FAST_EXTRACTOR_ENABLED = True
+        candidate = extract(html, url).markdown
+        fast = timed(lambda: extract(html, url), args.repeat)
+
+        recall = word_recall(reference, candidate)
+        precision = word_precision(reference, candidate)
+        report[content_type] = {
+            'word_recall': round(recall, 4),
+            'word_precision': round(precision, 4),
+            'word_f1': round(f1(precision, recall), 4),
+            'trafilatura_pages_per_second': summarize(slow, 1)['units_per_second'],
+            'template_pages_per_second': summarize(fast, 1)['units_per_second'],
+        }
+
+    print(json.dumps(report, indent=2))
+
+    failed = False
+    for metric, minimum in (('word_recall', args.min_recall), ('word_precision', args.min_precision)):
+        below = [ct for ct, stats in report.items() if stats[metric] < minimum]
+        if below:
+            print(f"{metric} below {minimum} for: {', '.join(below)}", file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""In-process stand-ins for Bedrock, Upstash and S3 so the pipeline runs offline.
+
+Both fakes sleep for a configurable latency and fail a configurable share
+of calls, the way the real services do under load: Bedrock with
+``ThrottlingException`` (and, above ``max_concurrency`` calls at once,
+always), Upstash with ``UpstashError``. Embeddings are derived from a hash
+of the input text, so the same chunk always gets the same vector;
+``LexicalBedrock`` derives them from the text's words instead, for
+benchmarks that measure retrieval quality. ``FakeS3`` keeps objects in
+memory and neither sleeps nor fails.
+"""
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from botocore.exceptions import ClientError
+from upstash_vector.errors import UpstashError
+from upstash_vector.types import DeleteResult, FetchResult, RangeResult
+
+from common import fixture_pages
+
+# Pre-tokenization pattern of cl100k_base
+_CL100K_PATTERN = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|"""
+    r"""\s*[\r\n]|\s+(?!\S)|\s+"""
+)
+
+
+class ServiceStats:
+    """Call counts and service-side latencies recorded by a fake"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures: Counter = Counter()
+        self.latencies: List[float] = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'failures': dict(self.failures),
+            'peak_concurrency': self.peak_in_flight,
+        }
+
+
+class _FakeService(ABC):
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stats = ServiceStats()
+        self._random = random.Random(seed)
+
+    def _call(self, cost_ms: float = 0.0) -> Optional[str]:
+        """Sleep for one call and return the failure to raise, if any"""
+        with self.stats.lock:
+            self.stats.calls += 1
+            self.stats.in_flight += 1
+            self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.stats.in_flight)
+            in_flight = self.stats.in_flight
+            roll = self._random.random()
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        start = time.perf_counter()
+        try:
+            failure = self._failure(roll, in_flight)
+            time.sleep(max(0.0, self.latency_ms + jitter + cost_ms) / 1000 / (10 if failure else 1))
+            return failure
+        finally:
+            with self.stats.lock:
+                self.stats.in_flight -= 1
+                self.stats.latencies.append(time.perf_counter() - start)
+                if failure:
+                    self.stats.failures[failure] += 1
+
+    @abstractmethod
+    def _failure(self, roll: float, in_flight: int) -> Optional[str]:
+        """The error code a call fails with, given its random roll and concurrency"""
+
+
+class FakeBedrock(_FakeService):
+    """``bedrock-runtime`` client answering ``invoke_model`` for Titan embeddings"""
+
+    def __init__(
+        self,
+        latency_ms: float = 80.0,
+        jitter_ms: float = 20.0,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        max_concurrency: Optional[int] = None,
+        seed: int = 0
+    ):
+        super().__init__(latency_ms, jitter_ms, error_rate, seed)
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+
+    def _failure(self, roll: float, in_flight: int) -> Optional[str]:
+        if self.max_concurrency is not None and in_flight > self.max_concurrency:
+            return 'ThrottlingException'
+        if roll < self.throttle_rate:
+            return 'ThrottlingException'
+        if roll < self.throttle_rate + self.error_rate:
+            return 'ServiceUnavailableException'
+        return None
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        request = json.loads(body)
+        failure = self._call()
+        if failure:
+            raise ClientError({'Error': {'Code': failure, 'Message': 'injected'}}, 'InvokeModel')
+
+        embedding = self.embedding(request['inputText'], request.get('dimensions', 1024))
+        return {'body': io.BytesIO(json.dumps({'embedding': embedding.tolist()}).encode('utf-8'))}
+
+    def embedding(self, text: str, dimensions: int) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        embedding = np.random.default_rng(seed).normal(0, 1, dimensions)
+        return embedding / np.linalg.norm(embedding)
+
+
+class LexicalBedrock(FakeBedrock):
+    """``FakeBedrock`` whose embeddings reflect the words a text shares.
+
+    Each word and word pair gets a fixed random direction in 1024
+    dimensions; a text embeds to the sum of its features' directions,
+    truncated to the requested dimensions. Cosine similarity then tracks
+    vocabulary overlap, and truncation loses fidelity the way shorter Titan
+    embeddings do, so retrieval quality can be compared offline. It is a
+    lexical model: paraphrases with no words in common do not match.
+    """
+    _STOPWORDS = frozenset(
+        'a an and are as at be by can do does for from how i if in is it its of on or that the '
+        'this to what when which with you your'.split()
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._directions: Dict[str, np.ndarray] = {}
+
+    def _direction(self, feature: str) -> np.ndarray:
+        direction = self._directions.get(feature)
+        if direction is None:
+            seed = int.from_bytes(hashlib.sha256(feature.encode('utf-8')).digest()[:8], 'little')
+            direction = np.random.default_rng(seed).normal(0, 1, 1024)
+            self._directions[feature] = direction
+        return direction
+
+    def embedding(self, text: str, dimensions: int) -> np.ndarray:
+        words = [
+            word[:-1] if len(word) > 3 and word.endswith('s') else word
+            for word in re.findall(r'[a-z0-9]+', text.lower())
+            if word not in self._STOPWORDS
+        ]
+        features = Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+        embedding = np.zeros(1024)
+        for feature, count in features.items():
+            embedding += (1 + np.log(count)) * self._direction(feature)
+        embedding = embedding[:dimensions]
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+
+class FakeIndex(_FakeService):
+    """Upstash ``Index`` holding vectors in memory.
+
+    Upserts cost ``latency_ms`` plus ``per_vector_ms`` for each vector, so
+    batch size matters as it does against the real index. A ``poison_rate``
+    share of vector IDs, picked by hash, is always rejected, failing every
+    upsert request that contains one.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 40.0,
+        jitter_ms: float = 10.0,
+        per_vector_ms: float = 0.2,
+        error_rate: float = 0.0,
+        poison_rate: float = 0.0,
+        seed: int = 0
+    ):
+        super().__init__(latency_ms, jitter_ms, error_rate, seed)
+        self.per_vector_ms = per_vector_ms
+        self.poison_rate = poison_rate
+        self.vectors: Dict[str, Any] = {}
+
+    def _failure(self, roll: float, in_flight: int) -> Optional[str]:
+        return 'UpstashError' if roll < self.error_rate else None
+
+    def _poisoned(self, vector_id: str) -> bool:
+        digest = hashlib.sha256(vector_id.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'little') / 2 ** 64 < self.poison_rate
+
+    def upsert(self, vectors: List[Any], namespace: str = '') -> str:
+        if self._call(self.per_vector_ms * len(vectors)):
+            raise UpstashError('injected upsert failure')
+        poisoned = [vector.id for vector in vectors if self._poisoned(vector.id)]
+        if poisoned:
+            raise UpstashError(f'invalid vector {poisoned[0]}')
+        with self.stats.lock:
+            for vector in vectors:
+                self.vectors[vector.id] = vector
+        return 'Success'
+
+    def range(
+        self,
+        cursor: str = '',
+        limit: int = 1,
+        prefix: str = '',
+        include_metadata: bool = False,
+        **kwargs
+    ) -> RangeResult:
+        if self._call():
+            raise UpstashError('injected range failure')
+        with self.stats.lock:
+            ids = sorted(i for i in self.vectors if i.startswith(prefix) and i > cursor)
+            page = [
+                FetchResult(id=i, metadata=dict(self.vectors[i].metadata or {}) if include_metadata else None)
+                for i in ids[:limit]
+            ]
+        next_cursor = page[-1].id if len(ids) > limit else ''
+        return RangeResult(next_cursor=next_cursor, vectors=page)
+
+    def fetch(self, ids: List[str], include_metadata: bool = False, **kwargs) -> List[Optional[FetchResult]]:
+        if self._call():
+            raise UpstashError('injected fetch failure')
+        with self.stats.lock:
+            vectors = [self.vectors.get(i) for i in ids]
+        return [
+            FetchResult(id=vector.id, metadata=dict(vector.metadata or {}) if include_metadata else None)
+            if vector is not None else None
+            for vector in vectors
+        ]
+
+    def update(self, id: str, metadata: Optional[Dict[str, Any]] = None, **kwargs) -> bool:
+        if self._call():
+            raise UpstashError('injected update failure')
+        with self.stats.lock:
+            vector = self.vectors.get(id)
+            if vector is None:
+                return False
+            # Patch semantics: fields given replace, everything else stays
+            vector.metadata = {**(vector.metadata or {}), **(metadata or {})}
+        return True
+
+    def delete(self, ids: List[str], **kwargs) -> DeleteResult:
+        if self._call():
+            raise UpstashError('injected delete failure')
+        with self.stats.lock:
+            deleted = sum(1 for i in ids if self.vectors.pop(i, None) is not None)
+        return DeleteResult(deleted=deleted)
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def iter_chunks(self, chunk_size: int = 1024) -> Any:
+        return iter(lambda: self._stream.read(chunk_size), b'')
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class _Paginator:
+    def __init__(self, s3: 'FakeS3'):
+        self.s3 = s3
+
+    def paginate(self, Bucket: str, Prefix: str = '', **kwargs) -> Any:
+        with self.s3.lock:
+            keys = sorted(key for bucket, key in self.s3.objects if bucket == Bucket and key.startswith(Prefix))
+        yield {'Contents': [{'Key': key} for key in keys]} if keys else {}
+
+
+class FakeS3:
+    """The S3 client calls the Lambdas make, against objects held in memory"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects: Dict[Any, bytes] = {}
+        self._uploads: Dict[str, Any] = {}
+
+    @staticmethod
+    def _missing(operation: str) -> ClientError:
+        return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'missing'}}, operation)
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def put_object(self, Bucket: str, Key: str, Body: Any = b'', **kwargs) -> Dict[str, Any]:
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.objects[(Bucket, Key)] = data
+        return {'ETag': self._etag(data)}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = '', IfMatch: str = '', **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise self._missing('GetObject')
+        if IfMatch and IfMatch != self._etag(data):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'etag'}}, 'GetObject')
+        etag = self._etag(data)
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': _Body(data), 'ContentLength': len(data), 'ETag': etag}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': len(data), 'ETag': self._etag(data)}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: Dict[str, str], **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            data = self.objects.get((CopySource['Bucket'], CopySource['Key']))
+            if data is None:
+                raise self._missing('CopyObject')
+            self.objects[(Bucket, Key)] = data
+        return {'CopyObjectResult': {'ETag': self._etag(data)}}
+
+    def get_paginator(self, operation: str) -> _Paginator:
+        return _Paginator(self)
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict[str, str]:
+        upload_id = f"{Bucket}/{Key}/{len(self._uploads)}"
+        self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes, **kwargs) -> Dict[str, str]:
+        self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': self._etag(bytes(Body))}
+
+    def complete_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        MultipartUpload: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        parts = self._uploads.pop(UploadId)
+        return self.put_object(Bucket, Key, b''.join(
+            parts[part['PartNumber']] for part in MultipartUpload['Parts']
+        ))
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict[str, Any]:
+        self._uploads.pop(UploadId, None)
+        return {}
+
+
+def offline_encoding(vocabulary_size: int = 4000) -> Any:
+    """A tiktoken encoding that needs no download.
+
+    Byte-level BPE over cl100k's split pattern, with whole-word merges for
+    the most frequent words of the fixture pages, so token counts land
+    close to cl100k_base on this content.
+    """
+    import tiktoken
+
+    words = Counter(
+        word
+        for html in fixture_pages().values()
+        for word in re.findall(r' ?[A-Za-z]+', re.sub(r'<[^>]+>', ' ', html))
+    )
+    ranks = {bytes([i]): i for i in range(256)}
+    for word, _ in words.most_common(vocabulary_size):
+        encoded = word.encode('utf-8')
+        for end in range(2, len(encoded) + 1):
+            ranks.setdefault(encoded[:end], len(ranks))
+    return tiktoken.Encoding('offline', pat_str=_CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={})
+
+
+def install_encoding() -> str:
+    """Point the chunker at cl100k_base, or the offline encoding without it.
+
+    Returns the name of the encoding in use, for the benchmark report.
+    """
+    import chunker
+    try:
+        return chunker.get_encoding().name
+    except Exception:
+        chunker._encoding = offline_encoding()
+        return chunker._encoding.name
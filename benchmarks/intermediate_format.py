@@ -0,0 +1,95 @@
+"""Size and parse time of the processed objects for each supported codec.
+
+Processed records are built from the synthetic fixture pages run through
+the data processing extractor, written with ``S3MultipartWriter`` into an
+in-memory S3 stand-in and read back the way the vectorization Lambda
+does. The ``legacy`` row is the previous read path: the whole body
+decoded, split and parsed with ``json.loads`` before validation.
+
+The fixtures are a few short pages repeating every few records, so
+compression ratios here are far higher than on a real crawl; sizes are
+for comparing codecs, not planning.
+
+Usage:
+    python benchmarks/intermediate_format.py --items 2000
+"""
+import argparse
+import json
+from typing import List, Optional
+
+from common import fixture_pages, load_lambda, summarize, timed
+from fakes import FakeS3
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def processed_records(n_items: int) -> List[str]:
+    processing = load_lambda('data_processing')
+    pages = list(fixture_pages().items())
+    records = []
+    for i in range(n_items):
+        content_type, html = pages[i % len(pages)]
+        url = f"https://2e.aonprd.com/{content_type}.aspx?ID={i}"
+        records.append(processing.process_html_content(html, url).model_dump_json())
+    return records
+
+
+def write(s3: FakeS3, key: str, records: List[str], compression: Optional[str]) -> None:
+    from streaming import S3MultipartWriter
+    with S3MultipartWriter(s3, 'bench', key, compression=compression) as writer:
+        for record in records:
+            writer.write_line(record)
+
+
+def chunks(data: bytes):
+    return (data[i:i + READ_CHUNK_SIZE] for i in range(0, len(data), READ_CHUNK_SIZE))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    records = processed_records(args.items)
+    vectorization = load_lambda('vectorization_lambda')
+    from record_format import compression_for_key, iter_lines, jsonl_key
+    ProcessedItem = vectorization.ProcessedItem
+
+    s3 = FakeS3()
+    plain_key = jsonl_key('processed/bench', None)
+    write(s3, plain_key, records, None)
+    plain_size = len(s3.objects[('bench', plain_key)])
+
+    def legacy_read() -> None:
+        lines = s3.objects[('bench', plain_key)].decode('utf-8').strip().split('\n')
+        for line in lines:
+            ProcessedItem.model_validate(json.loads(line))
+
+    report = {
+        'items': args.items,
+        'legacy': {
+            'bytes': plain_size,
+            'read': summarize(timed(legacy_read, args.repeat), args.items),
+        },
+    }
+    for compression in (None, 'gzip', 'zstd'):
+        key = jsonl_key('processed/bench', compression)
+        write_times = timed(lambda: write(s3, key, records, compression), args.repeat)
+
+        def read() -> None:
+            for line in iter_lines(chunks(s3.objects[('bench', key)]), compression_for_key(key)):
+                ProcessedItem.model_validate_json(line)
+
+        report[compression or 'plain'] = {
+            'bytes': len(s3.objects[('bench', key)]),
+            'ratio': round(plain_size / len(s3.objects[('bench', key)]), 2),
+            'write': summarize(write_times, args.items),
+            'read': summarize(timed(read, args.repeat), args.items),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Upsert and storage bytes of the full and compact vector payload layouts.
+
+Items go through the vectorization Lambda's ``prepare_vector_item`` with
+stand-ins for Bedrock and the index, once per layout, and the vectors are
+serialized the way the Upstash client sends them. In the compact layout
+the parent records are written to an in-memory store and counted
+separately. Every compact vector is then rehydrated from its parent record
+and checked against its full-layout counterpart.
+
+``vector_bytes`` is the dense and sparse vectors, the bulk of an upsert
+and the same in both layouts; the compact layout shrinks the metadata and
+text the index stores, and ``payload_bytes_ratio_with_parents`` shows
+what moves to the parent records.
+
+The default corpus is the labeled sample in ``fixtures/retrieval``; point
+``--corpus`` at processed output (``.jsonl``, ``.jsonl.gz`` or
+``.jsonl.zst``) to measure a real crawl.
+
+Usage:
+    python benchmarks/payload_size.py
+    python benchmarks/payload_size.py --corpus processed/2025-04-20/crawl/run/part-00000.jsonl.zst
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from common import load_lambda
+from retrieval_eval import RETRIEVAL_DIR, load_corpus
+
+
+def _json_bytes(value: Any) -> int:
+    return len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def measure(vectors: List[Any]) -> Dict[str, int]:
+    from upstash_vector.utils import vectors_to_payload
+    payload, _ = vectors_to_payload(vectors)
+    return {
+        'vectors': len(vectors),
+        'upsert_bytes': _json_bytes(payload),
+        'metadata_bytes': sum(_json_bytes(vector['metadata']) for vector in payload),
+        'data_bytes': sum(len((vector['data'] or '').encode('utf-8')) for vector in payload),
+        'vector_bytes': sum(
+            _json_bytes(vector['vector']) + _json_bytes(vector.get('sparseVector')) for vector in payload
+        ),
+    }
+
+
+def prepare(vectorization: Any, lines: List[str], parents: Optional[Any]) -> List[Any]:
+    from fakes import FakeBedrock, FakeIndex
+
+    async def run() -> List[Any]:
+        engine = vectorization.create_embedding_engine(FakeBedrock(latency_ms=0, jitter_ms=0), None)
+        # An empty index, so IDs are content-addressed and every chunk is new
+        index = FakeIndex(latency_ms=0, jitter_ms=0, per_vector_ms=0)
+        try:
+            vectors = []
+            for i, line in enumerate(lines):
+                prepared = await vectorization.prepare_vector_item(
+                    (i, line, 'payload'), engine, index, parents=parents
+                )
+                for vector, error in prepared.results:
+                    if error:
+                        raise RuntimeError(error)
+                    vectors.append(vector)
+            return vectors
+        finally:
+            engine.close()
+
+    return asyncio.run(run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=str(RETRIEVAL_DIR / 'corpus.jsonl'))
+    parser.add_argument('--dimensions', type=int, default=512)
+    args = parser.parse_args()
+
+    os.environ['EMBEDDING_DIMENSIONS'] = str(args.dimensions)
+    vectorization = load_lambda('vectorization_lambda')
+    from fakes import install_encoding
+    from parent_store import ParentStore, rehydrate
+    from upstash_vector.types import QueryResult
+
+    class MemoryParentStore(ParentStore):
+        def __init__(self):
+            self.records: Dict[str, bytes] = {}
+
+        def get(self, parent_id: str) -> Optional[Dict[str, Any]]:
+            body = self.records.get(parent_id)
+            return json.loads(body) if body is not None else None
+
+        def put(self, parent_id: str, record: Dict[str, Any]) -> int:
+            self.records[parent_id] = json.dumps(record, separators=(',', ':')).encode('utf-8')
+            return len(self.records[parent_id])
+
+    encoding = install_encoding()
+    lines = [item.model_dump_json() for item in load_corpus(args.corpus, vectorization)]
+
+    full = prepare(vectorization, lines, None)
+    store = MemoryParentStore()
+    compact = prepare(vectorization, lines, store)
+
+    # Compact results must rehydrate to exactly what the full layout stores
+    as_results = [
+        QueryResult(id=v.id, score=1.0, vector=None, metadata=dict(v.metadata), data=v.data, sparse_vector=None)
+        for v in compact
+    ]
+    expected = {v.id: (v.metadata, v.data) for v in full}
+    for result in rehydrate(store, as_results):
+        if (result.metadata, result.data) != expected[result.id]:
+            raise AssertionError(f"Rehydrated {result.id} differs from the full layout")
+
+    report = {'encoding': encoding, 'pages': len(lines), 'dimensions': args.dimensions}
+    report['full'] = measure(full)
+    report['compact'] = {
+        **measure(compact),
+        'parent_records': len(store.records),
+        'parent_record_bytes': sum(len(body) for body in store.records.values()),
+    }
+    full_stored = report['full']['metadata_bytes'] + report['full']['data_bytes']
+    compact_stored = (
+        report['compact']['metadata_bytes'] + report['compact']['data_bytes']
+        + report['compact']['parent_record_bytes']
+    )
+    report['upsert_bytes_ratio'] = round(report['compact']['upsert_bytes'] / report['full']['upsert_bytes'], 3)
+    report['payload_bytes_ratio'] = round(
+        (report['compact']['metadata_bytes'] + report['compact']['data_bytes']) / full_stored, 3
+    )
+    report['payload_bytes_ratio_with_parents'] = round(compact_stored / full_stored, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""End-to-end offline benchmark of both Lambdas against fake AWS services.
+
+Crawler-style lines built from the synthetic fixtures go through the data
+processing Lambda's extraction; its output then goes through the
+vectorization Lambda's chunking, embedding and upserts, with Bedrock and
+Upstash replaced by the stand-ins in ``fakes.py``. Each Lambda runs in a
+fresh process, so peak RSS is its own. The report gives items/sec,
+chunks/sec, peak RSS and p50/p90/p99 latency for every stage, as JSON.
+
+``--output`` saves the report; ``--compare`` sets it against a saved one,
+so a change can be measured before it is deployed.
+
+Usage:
+    python benchmarks/pipeline.py --items 300 --output before.json
+    python benchmarks/pipeline.py --items 300 --compare before.json
+    python benchmarks/pipeline.py --bedrock-max-concurrency 8 --bedrock-error-rate 0.02
+    python benchmarks/pipeline.py --upstash-error-rate 0.05 --upstash-poison-rate 0.01
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from common import iter_crawl_lines, load_lambda, percentiles
+
+SOURCE_KEY = 'processed/benchmark.jsonl'
+# Metrics set against a baseline by --compare; lower is better for the rest
+_HIGHER_IS_BETTER = ('items_per_second', 'chunks_per_second')
+
+
+class StageTimer:
+    """Records the duration of every call to the functions it wraps"""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.units: Counter = Counter()
+
+    def wrap(
+        self,
+        owner: Any,
+        name: str,
+        stage: str,
+        count: Optional[Callable[[Any], int]] = None
+    ) -> None:
+        """Replace ``owner.name`` with a timed wrapper.
+
+        Module-level functions are looked up at call time, so wrapping the
+        module attribute also times calls made from inside the module.
+        """
+        fn = getattr(owner, name)
+
+        def record(start: float, result: Any) -> None:
+            self.durations[stage].append(time.perf_counter() - start)
+            if count is not None:
+                self.units[stage] += count(result)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                result = await fn(*args, **kwargs)
+                record(start, result)
+                return result
+        else:
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                result = fn(*args, **kwargs)
+                record(start, result)
+                return result
+        setattr(owner, name, timed)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {'calls': len(durations), **percentiles(durations)}
+            for stage, durations in self.durations.items()
+        }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def run_processing(args: argparse.Namespace) -> Dict[str, Any]:
+    index = load_lambda('data_processing')
+    timer = StageTimer()
+    timer.wrap(index, 'process_html_content', 'extract')
+    timer.wrap(index, 'extract_with_fallback', 'markdown')
+
+    with open(args.input, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    processed_items = failed_items = 0
+    start = time.perf_counter()
+    with open(args.processed, 'w', encoding='utf-8') as out:
+        for processed, failure in index.iter_process_items(lines):
+            if processed:
+                processed_items += 1
+                out.write(processed.model_dump_json() + '\n')
+            else:
+                failed_items += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        'items': len(lines),
+        'processed_items': processed_items,
+        'failed_items': failed_items,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(len(lines) / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timer.report(),
+    }
+
+
+def run_vectorization(args: argparse.Namespace) -> Dict[str, Any]:
+    os.environ.update({
+        'EMBEDDING_CACHE_ENABLED': 'false',
+        'EMBEDDING_CONCURRENCY_INITIAL': str(args.concurrency_initial),
+        'EMBEDDING_CONCURRENCY_MAX': str(args.concurrency_max),
+    })
+    index = load_lambda('vectorization_lambda')
+    from fakes import FakeBedrock, FakeIndex, install_encoding
+    encoding = install_encoding()
+
+    bedrock = FakeBedrock(
+        latency_ms=args.bedrock_latency_ms,
+        throttle_rate=args.bedrock_throttle_rate,
+        error_rate=args.bedrock_error_rate,
+        max_concurrency=args.bedrock_max_concurrency,
+        seed=args.seed
+    )
+    vector_index = FakeIndex(
+        latency_ms=args.upstash_latency_ms,
+        error_rate=args.upstash_error_rate,
+        poison_rate=args.upstash_poison_rate,
+        seed=args.seed
+    )
+    engine = index.create_embedding_engine(bedrock)
+
+    timer = StageTimer()
+    timer.wrap(index, 'prepare_vector_item', 'item')
+    timer.wrap(index, 'create_text_chunks', 'chunk', count=len)
+    timer.wrap(index, 'create_sparse_vectors', 'sparse')
+    timer.wrap(engine, 'embed', 'embed')
+
+    with open(args.processed, encoding='utf-8') as f:
+        items = [(idx, line, SOURCE_KEY) for idx, line in enumerate(f.read().splitlines())]
+
+    from near_duplicates import DuplicateRegistry
+    duplicates = DuplicateRegistry(args.dedup_mode) if args.dedup_mode != 'off' else None
+
+    start = time.perf_counter()
+    result = asyncio.run(index.process_items(
+        items, engine, vector_index, incremental=not args.full_sync, duplicates=duplicates
+    ))
+    elapsed = time.perf_counter() - start
+    engine.close()
+
+    chunks = timer.units['chunk']
+    return {
+        'items': len(items),
+        'chunks': chunks,
+        'vectors': result.successful,
+        'failed': len(result.failed),
+        'duplicates': result.duplicates,
+        'encoding': encoding,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(len(items) / elapsed, 1),
+        'chunks_per_second': round(chunks / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {
+            **timer.report(),
+            'bedrock_call': {'calls': bedrock.stats.calls, **percentiles(bedrock.stats.latencies)},
+            'upstash_call': {'calls': vector_index.stats.calls, **percentiles(vector_index.stats.latencies)},
+        },
+        'bedrock': bedrock.stats.report(),
+        'upstash': vector_index.stats.report(),
+        'embedding': engine.report(),
+        'upserts': result.upserts,
+    }
+
+
+_STAGES = {'processing': run_processing, 'vectorization': run_vectorization}
+
+
+def _flatten(report: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Relative change of throughput, memory and stage latencies against a baseline"""
+    now, before = _flatten(current), _flatten(baseline)
+    comparison = {}
+    for metric, value in now.items():
+        name = metric.rsplit('.', 1)[-1]
+        if name not in (*_HIGHER_IS_BETTER, 'peak_rss_mb', 'p50', 'p99') or not before.get(metric):
+            continue
+        change = (value - before[metric]) / before[metric] * 100
+        comparison[metric] = {
+            'baseline': before[metric],
+            'current': value,
+            'change_pct': round(change, 1),
+            'regression': change < -10 if name in _HIGHER_IS_BETTER else change > 10,
+        }
+    return comparison
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full-sync', action='store_true', help='upsert every chunk, as SYNC_MODE=full')
+    parser.add_argument('--dedup-mode', choices=['off', 'reuse', 'collapse'], default='off',
+                        help='near-duplicate handling, as DEDUP_MODE')
+    parser.add_argument('--concurrency-initial', type=int, default=4)
+    parser.add_argument('--concurrency-max', type=int, default=32)
+    parser.add_argument('--bedrock-latency-ms', type=float, default=80.0)
+    parser.add_argument('--bedrock-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-error-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-max-concurrency', type=int, default=16,
+                        help='calls above this many at once are throttled')
+    parser.add_argument('--upstash-latency-ms', type=float, default=40.0)
+    parser.add_argument('--upstash-error-rate', type=float, default=0.0)
+    parser.add_argument('--upstash-poison-rate', type=float, default=0.0,
+                        help='share of vectors the index always rejects')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare against')
+    parser.add_argument('--stage', choices=sorted(_STAGES), help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--processed', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(_STAGES[args.stage](args)))
+        return
+
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('stage', 'input', 'processed', 'output', 'compare')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+    }
+    env = {**os.environ, 'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING')}
+    with tempfile.TemporaryDirectory() as tmp:
+        crawl, processed = os.path.join(tmp, 'crawl.jsonl'), os.path.join(tmp, 'processed.jsonl')
+        with open(crawl, 'w', encoding='utf-8') as f:
+            for line in iter_crawl_lines(args.items):
+                f.write(line + '\n')
+
+        for stage in ('processing', 'vectorization'):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                 '--stage', stage, '--input', crawl, '--processed', processed],
+                env=env, capture_output=True, text=True
+            )
+            if output.returncode:
+                sys.stderr.write(output.stderr)
+                raise SystemExit(f"{stage} benchmark failed")
+            report[stage] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = compare(
+            {stage: report[stage] for stage in _STAGES},
+            {stage: baseline[stage] for stage in _STAGES if stage in baseline}
+        )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""Retrieval quality against cost for embedding, chunking and sparse settings.
+
+A labeled query set is run against a brute-force hybrid index built in
+memory for every configuration in the sweep. The index scores like the
+Upstash hybrid index does: cosine similarity on the dense vectors, inner
+product on the sparse ones, and the two result lists fused with RRF or
+DBSF. Sparse vectors are either taken from the dense embedding or BM25
+over the chunk text, with IDF from the corpus. Chunks are collapsed to
+their pages before scoring, so recall@k and MRR are over pages and stay
+comparable across chunk sizes.
+
+Each configuration reports recall@k, MRR, the tokens sent to Bedrock to
+embed the corpus, the bytes the index would store (dense, sparse, metadata
+and data) and search latency. With ``--min-recall``, the cheapest
+configuration meeting the bar is named.
+
+By default embeddings come from ``LexicalBedrock``, an offline stand-in
+whose vectors track word overlap; quality numbers from it rank the
+settings but are not Titan's. ``--bedrock`` embeds with the real model,
+and ``--embedding-cache`` keeps those embeddings between runs. The default
+corpus and queries are a small hand-written, labeled set in the aonprd
+format, in ``fixtures/retrieval``; ``--corpus`` takes processed output
+(``.jsonl``, ``.jsonl.gz`` or ``.jsonl.zst``) with a matching
+``--queries`` file of ``{"query": ..., "relevant": [url, ...]}`` entries.
+
+Usage:
+    python benchmarks/retrieval_eval.py
+    python benchmarks/retrieval_eval.py --dimensions 256 512 1024 --chunk-tokens 256 512 \\
+        --sparse-top-k 16 32 64 --min-recall 0.9 --recall-at 5
+    python benchmarks/retrieval_eval.py --bedrock --embedding-cache embeddings.json
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from common import load_lambda, percentiles
+
+RETRIEVAL_DIR = Path(__file__).resolve().parent / 'fixtures' / 'retrieval'
+MODEL_ID = 'amazon.titan-embed-text-v2:0'
+# Rank constant of reciprocal rank fusion
+RRF_K = 60
+FUSIONS = ('rrf', 'dbsf', 'dense', 'sparse')
+
+
+class HybridIndex:
+    """Brute-force dense + sparse index over one configuration's chunks"""
+
+    def __init__(self):
+        self.parents: List[str] = []
+        self._dense: List[np.ndarray] = []
+        self._sparse: List[Any] = []
+        self.bytes = {'dense': 0, 'sparse': 0, 'metadata': 0}
+
+    def add(self, parent: str, dense: List[float], sparse: Any, payload: Dict[str, Any]) -> None:
+        self.parents.append(parent)
+        self._dense.append(np.asarray(dense, dtype=np.float32))
+        self._sparse.append(sparse)
+        # Stored as float32 values and (uint32 index, float32 value) pairs
+        self.bytes['dense'] += 4 * len(dense)
+        self.bytes['sparse'] += 8 * len(sparse.indices)
+        self.bytes['metadata'] += len(json.dumps(payload).encode('utf-8'))
+
+    def build(self) -> None:
+        dense = np.vstack(self._dense)
+        self.dense = dense / np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+        # Sparse indices are mapped to the columns in use, as BM25 ones span the vocabulary
+        self.columns = np.unique(np.concatenate([np.asarray(v.indices, dtype=np.int64) for v in self._sparse]))
+        self.sparse = np.zeros((len(self._sparse), len(self.columns)), dtype=np.float32)
+        for row, vector in enumerate(self._sparse):
+            self.sparse[row, np.searchsorted(self.columns, vector.indices)] = vector.values
+
+    def _top(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def query(self, dense: List[float], sparse: Any, top_k: int, fusion: str = 'rrf') -> List[int]:
+        """Row numbers of the best ``top_k`` chunks, best first"""
+        query = np.asarray(dense, dtype=np.float32)
+        dense_scores = self.dense @ (query / max(np.linalg.norm(query), 1e-12))
+        if fusion == 'dense':
+            return list(self._top(dense_scores, top_k))
+        sparse_query = np.zeros(len(self.columns), dtype=np.float32)
+        indices = np.asarray(sparse.indices, dtype=np.int64)
+        positions = np.searchsorted(self.columns, indices).clip(max=len(self.columns) - 1)
+        known = self.columns[positions] == indices
+        sparse_query[positions[known]] = np.asarray(sparse.values, dtype=np.float32)[known]
+        sparse_scores = self.sparse @ sparse_query
+        if fusion == 'sparse':
+            return list(self._top(sparse_scores, top_k))
+
+        fused: Dict[int, float] = {}
+        for scores in (dense_scores, sparse_scores):
+            top = self._top(scores, top_k)
+            if fusion == 'rrf':
+                for rank, row in enumerate(top):
+                    fused[row] = fused.get(row, 0.0) + 1 / (RRF_K + rank + 1)
+            else:
+                # Distribution-based score fusion: scale each list by its mean +- 3 sigma
+                values = scores[top]
+                low = values.mean() - 3 * values.std()
+                high = values.mean() + 3 * values.std()
+                for row, value in zip(top, values):
+                    scaled = (value - low) / (high - low) if high > low else 0.5
+                    fused[row] = fused.get(row, 0.0) + scaled
+        return sorted(fused, key=lambda row: (-fused[row], row))[:top_k]
+
+
+class Embedder:
+    """Embeds texts once per (dimensions, text), optionally persisted to a file"""
+
+    def __init__(self, embed: Callable[[str, int], List[float]], cache_path: Optional[str], concurrency: int):
+        self._embed = embed
+        self.cache_path = cache_path
+        self.concurrency = concurrency
+        self.cache: Dict[str, List[float]] = {}
+        self.calls = 0
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf-8') as f:
+                self.cache = json.load(f)
+
+    def embed_all(self, texts: List[str], dimensions: int) -> List[List[float]]:
+        keys = [f"{dimensions}:{text}" for text in texts]
+        missing = sorted({key for key in keys if key not in self.cache})
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                embeddings = pool.map(lambda key: self._embed(key.partition(':')[2], dimensions), missing)
+                self.cache.update(zip(missing, embeddings))
+            self.calls += len(missing)
+            self.save()
+        return [self.cache[key] for key in keys]
+
+    def save(self) -> None:
+        if self.cache_path:
+            tmp = f"{self.cache_path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp, self.cache_path)
+
+
+def load_corpus(path: str, vectorization: Any) -> List[Any]:
+    from record_format import compression_for_key, iter_lines
+    with open(path, 'rb') as f:
+        lines = iter_lines(iter(lambda: f.read(64 * 1024), b''), compression_for_key(path))
+        return [vectorization.ProcessedItem.model_validate_json(line) for line in lines if line.strip()]
+
+
+def chunk_corpus(items: List[Any], chunker: Any) -> List[Tuple[Any, Any, int, int]]:
+    """(item, chunk, chunk index, chunks in item) for every chunk of the corpus"""
+    chunks = []
+    for item in items:
+        text = item.markdown if item.markdown and item.markdown.strip() else item.description
+        if not text or not text.strip():
+            continue
+        item_chunks = chunker.split(text, item.title)
+        chunks.extend((item, chunk, i, len(item_chunks)) for i, chunk in enumerate(item_chunks))
+    return chunks
+
+
+def payload(item: Any, chunk: Any, chunk_index: int, total_chunks: int) -> Dict[str, Any]:
+    """Metadata and data stored with a vector in the full payload layout"""
+    from index_sync import stable_parent_id
+    from parent_store import chunk_metadata
+    return {
+        'metadata': chunk_metadata(item, stable_parent_id(item.url), chunk, chunk_index, total_chunks),
+        'data': chunk.text,
+    }
+
+
+def score(ranked_pages: List[str], relevant: List[str], ks: List[int]) -> Tuple[Dict[int, float], float]:
+    """recall@k for each k and the reciprocal rank of the first relevant page"""
+    relevant = set(relevant)
+    recall = {k: len(relevant & set(ranked_pages[:k])) / len(relevant) for k in ks}
+    first = next((rank for rank, page in enumerate(ranked_pages, 1) if page in relevant), None)
+    return recall, (1 / first if first else 0.0)
+
+
+def evaluate(
+    index: HybridIndex,
+    queries: List[Dict[str, Any]],
+    query_dense: List[List[float]],
+    query_sparse: List[Any],
+    ks: List[int],
+    candidates: int,
+    fusion: str
+) -> Dict[str, Any]:
+    recalls = {k: 0.0 for k in ks}
+    reciprocal_ranks = 0.0
+    latencies = []
+    for query, dense, sparse in zip(queries, query_dense, query_sparse):
+        start = time.perf_counter()
+        rows = index.query(dense, sparse, candidates, fusion)
+        latencies.append(time.perf_counter() - start)
+        # Distinct pages in the order their best chunk ranks
+        pages = list(dict.fromkeys(index.parents[row] for row in rows))
+        recall, reciprocal_rank = score(pages, query['relevant'], ks)
+        for k in ks:
+            recalls[k] += recall[k]
+        reciprocal_ranks += reciprocal_rank
+    return {
+        **{f"recall@{k}": round(recalls[k] / len(queries), 4) for k in ks},
+        'mrr': round(reciprocal_ranks / len(queries), 4),
+        'search_latency_ms': percentiles(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=str(RETRIEVAL_DIR / 'corpus.jsonl'))
+    parser.add_argument('--queries', default=str(RETRIEVAL_DIR / 'queries.json'))
+    parser.add_argument('--dimensions', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--chunk-tokens', type=int, nargs='+', default=[256, 512])
+    parser.add_argument('--chunk-overlap', type=int, nargs='+', default=[64])
+    parser.add_argument('--sparse-encoder', choices=('dense', 'bm25'), nargs='+', default=['dense', 'bm25'],
+                        help='sparse vectors from the dense embedding or BM25 over the chunk text')
+    parser.add_argument('--sparse-top-k', type=int, nargs='+', default=[16, 32, 64],
+                        help='dense-derived sparse vectors only')
+    parser.add_argument('--sparse-threshold', type=float, nargs='+', default=[0.1],
+                        help='dense-derived sparse vectors only')
+    parser.add_argument('--fusion', choices=FUSIONS, nargs='+', default=['rrf', 'dense'])
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--candidates', type=int, default=50, help='chunks fetched per query before fusion')
+    parser.add_argument('--min-recall', type=float, help='quality bar for the recommendation')
+    parser.add_argument('--recall-at', type=int, default=5, help='k of the recall the bar applies to')
+    parser.add_argument('--cost', choices=('index_bytes', 'embedded_tokens'), default='index_bytes',
+                        help='what "cheapest" minimizes among configurations meeting the bar')
+    parser.add_argument('--bedrock', action='store_true', help='embed with Bedrock instead of the offline model')
+    parser.add_argument('--model-id', default=MODEL_ID)
+    parser.add_argument('--embedding-cache', help='JSON file keeping embeddings between runs')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    vectorization = load_lambda('vectorization_lambda')
+    from chunker import MarkdownChunker, get_encoding
+    from fakes import install_encoding
+    from sparse_encoder import Bm25Encoder, IdfTable, tokenize
+
+    encoding = install_encoding()
+    if args.bedrock:
+        import boto3
+        client = boto3.client('bedrock-runtime', config=vectorization.BEDROCK_CLIENT_CONFIG)
+        embedder_name = args.model_id
+    else:
+        from fakes import LexicalBedrock
+        client = LexicalBedrock(latency_ms=0, jitter_ms=0)
+        embedder_name = 'offline-lexical'
+    embedder = Embedder(
+        lambda text, dimensions: vectorization.generate_bedrock_embeddings(
+            client, text, model_id=args.model_id, dimensions=dimensions
+        ),
+        args.embedding_cache,
+        args.concurrency
+    )
+
+    items = load_corpus(args.corpus, vectorization)
+    with open(args.queries, encoding='utf-8') as f:
+        queries = json.load(f)
+    ks = sorted(set(args.k) | {args.recall_at})
+    sparse_settings = [
+        ('dense', top_k, threshold)
+        for top_k, threshold in itertools.product(args.sparse_top_k, args.sparse_threshold)
+        if 'dense' in args.sparse_encoder
+    ] + [('bm25', None, None)] * ('bm25' in args.sparse_encoder)
+
+    configs = []
+    for chunk_tokens, overlap in itertools.product(args.chunk_tokens, args.chunk_overlap):
+        chunker = MarkdownChunker(max_tokens=chunk_tokens, overlap_tokens=overlap)
+        chunks = chunk_corpus(items, chunker)
+        embedded_tokens = sum(chunker.count_tokens(chunk.text) for _, chunk, _, _ in chunks)
+        chunk_texts = [chunk.text for _, chunk, _, _ in chunks]
+        query_texts = [query['query'] for query in queries]
+        # IDF over this chunking of the corpus, as the backfill would build it
+        table = IdfTable.for_encoding(get_encoding())
+        table.add(tokenize(get_encoding(), chunk_texts))
+        bm25 = Bm25Encoder(table, get_encoding())
+        for dimensions in args.dimensions:
+            chunk_dense = embedder.embed_all(chunk_texts, dimensions)
+            query_dense = embedder.embed_all(query_texts, dimensions)
+            for encoder, top_k, threshold in sparse_settings:
+                if encoder == 'bm25':
+                    chunk_sparse = bm25.encode_documents(chunk_texts)
+                    query_sparse = bm25.encode_queries(query_texts)
+                else:
+                    chunk_sparse = vectorization.create_sparse_vectors(chunk_dense, top_k, threshold)
+                    query_sparse = vectorization.create_sparse_vectors(query_dense, top_k, threshold)
+                index = HybridIndex()
+                for (item, chunk, i, total), dense, sparse in zip(chunks, chunk_dense, chunk_sparse):
+                    index.add(item.url, dense, sparse, payload(item, chunk, i, total))
+                index.build()
+                for fusion in args.fusion:
+                    configs.append({
+                        'chunk_tokens': chunk_tokens,
+                        'chunk_overlap': overlap,
+                        'dimensions': dimensions,
+                        'sparse_encoder': encoder,
+                        'sparse_top_k': top_k,
+                        'sparse_threshold': threshold,
+                        'fusion': fusion,
+                        'vectors': len(chunks),
+                        'embedded_tokens': embedded_tokens,
+                        'index_bytes': sum(index.bytes.values()),
+                        'index_bytes_by_part': dict(index.bytes),
+                        **evaluate(index, queries, query_dense, query_sparse, ks, args.candidates, fusion),
+                    })
+
+    report = {
+        'embedder': embedder_name,
+        'encoding': encoding,
+        'pages': len(items),
+        'queries': len(queries),
+        'embedding_calls': embedder.calls,
+        'configs': configs,
+    }
+    if args.min_recall is not None:
+        passing = [c for c in configs if c[f"recall@{args.recall_at}"] >= args.min_recall]
+        report['recommended'] = min(
+            passing, key=lambda c: (c[args.cost], -c[f"recall@{args.recall_at}"], -c['mrr']), default=None
+        )
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
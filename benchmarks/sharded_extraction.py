@@ -0,0 +1,77 @@
+"""Reproduce the sharded fan-out locally with a process pool.
+
+Writes a synthetic crawl file, splits it into byte-range shards with the
+same planner the Lambdas use, and extracts every shard in a process pool.
+Checks that the merged report covers every line exactly once and reports
+throughput per pool size. As with ``extraction_throughput.py``, more
+processes than available CPUs add no throughput.
+
+Usage:
+    python benchmarks/sharded_extraction.py --items 2000 --shards 8 --processes 1 2 4
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from common import iter_crawl_lines, load_lambda
+
+# Loaded at import so the pool's forked workers inherit the modules
+index = load_lambda('data_processing')
+
+from sharding import Shard, file_chunk_reader, iter_shard_lines, plan_shards, run_shards_locally  # noqa: E402
+
+
+def extract_shard(shard: Shard) -> Dict[str, Any]:
+    """Shard worker: extract the lines of one byte range of a local file"""
+    lines = iter_shard_lines(file_chunk_reader(shard.key), shard.start, shard.end)
+    report = {'processed_items': 0, 'failed_items': 0, 'urls': []}
+    for processed, failure in index.iter_process_items(lines):
+        if processed:
+            report['processed_items'] += 1
+            report['urls'].append(processed.url)
+        else:
+            report['failed_items'] += 1
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'crawl.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for line in iter_crawl_lines(args.items):
+                f.write(line + '\n')
+
+        size = os.path.getsize(path)
+        shards = plan_shards('local', 'local', path, size, -(-size // args.shards))
+
+        report = {'items': args.items, 'cpus': len(os.sched_getaffinity(0)), 'shards': len(shards), 'runs': {}}
+        for processes in args.processes:
+            start = time.perf_counter()
+            merged = run_shards_locally(extract_shard, shards, processes)
+            elapsed = time.perf_counter() - start
+
+            urls = merged.pop('urls', [])
+            if len(urls) != args.items or len(set(urls)) != args.items:
+                raise AssertionError(
+                    f"Shards covered {len(set(urls))} distinct of {args.items} lines ({len(urls)} total)"
+                )
+            report['runs'][processes] = {
+                **merged,
+                'seconds': round(elapsed, 3),
+                'items_per_second': round(args.items / elapsed, 1),
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Micro-benchmark for create_sparse_vector at 512 and 1024 dimensions.
+
+Compares the original pure-Python implementation with the NumPy version,
+both per chunk and through the batch API, after checking that all three
+produce identical sparse vectors (including NaNs, the below-threshold
+fallback and tied magnitudes).
+
+Also times the BM25 encoder on chunks of the retrieval fixture corpus:
+building the IDF table, loading it from its stored form and encoding
+chunks in one batch, after checking that text without words still gets a
+sparse vector.
+
+Usage:
+    python benchmarks/sparse_vector.py --chunks 256
+"""
+import argparse
+import json
+import math
+import random
+
+from common import load_lambda, summarize, timed
+from retrieval_eval import RETRIEVAL_DIR, chunk_corpus, load_corpus
+
+
+def legacy_create_sparse_vector(embeddings, top_k=32, threshold=0.1):
+    """The list-comprehension implementation this module replaced"""
+    indexed_values = [
+        (i, v) for i, v in enumerate(embeddings)
+        if isinstance(v, float) and not math.isnan(v)
+    ]
+    if not indexed_values:
+        raise ValueError("No valid values in embeddings (all NaN)")
+    significant_values = [(i, abs(v)) for i, v in indexed_values if abs(v) > threshold]
+    if not significant_values:
+        significant_values = sorted(
+            [(i, abs(v)) for i, v in indexed_values], key=lambda x: x[1], reverse=True
+        )[:top_k]
+    top = sorted(significant_values, key=lambda x: x[1], reverse=True)[:top_k]
+    return [i for i, _ in top], [v for _, v in top]
+
+
+def sample_embeddings(n_chunks: int, dims: int, seed: int = 0):
+    """Titan-like unit-scale embeddings plus a few edge-case rows"""
+    rng = random.Random(seed)
+    rows = [[rng.gauss(0, 1 / math.sqrt(dims)) for _ in range(dims)] for _ in range(n_chunks)]
+    rows[0] = [rng.uniform(-0.05, 0.05) for _ in range(dims)]        # nothing above threshold
+    rows[1] = [0.5 if i % 7 == 0 else 0.01 for i in range(dims)]      # ties at the cut-off
+    rows[2] = [float('nan') if i % 3 else v for i, v in enumerate(rows[2])]
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    index = load_lambda('vectorization_lambda')
+    report = {}
+
+    for dims in (512, 1024):
+        rows = sample_embeddings(args.chunks, dims)
+
+        for row, batched in zip(rows, index.create_sparse_vectors(rows)):
+            single = index.create_sparse_vector(row)
+            expected = legacy_create_sparse_vector(row)
+            for actual in (single, batched):
+                if (list(actual.indices), list(actual.values)) != expected:
+                    raise AssertionError(f"Sparse vectors differ from the legacy output at {dims} dims")
+
+        report[f"{dims}_dims"] = {
+            'legacy_per_chunk': summarize(
+                timed(lambda: [legacy_create_sparse_vector(r) for r in rows], args.repeat), args.chunks
+            ),
+            'numpy_per_chunk': summarize(
+                timed(lambda: [index.create_sparse_vector(r) for r in rows], args.repeat), args.chunks
+            ),
+            'numpy_batch': summarize(
+                timed(lambda: index.create_sparse_vectors(rows), args.repeat), args.chunks
+            ),
+        }
+
+    from chunker import MarkdownChunker, get_encoding
+    from fakes import install_encoding
+    from sparse_encoder import Bm25Encoder, IdfTable, tokenize
+
+    install_encoding()
+    encoding = get_encoding()
+    items = load_corpus(str(RETRIEVAL_DIR / 'corpus.jsonl'), index)
+    texts = [chunk.text for _, chunk, _, _ in chunk_corpus(items, MarkdownChunker())]
+    texts = [texts[i % len(texts)] for i in range(args.chunks)]
+    table = IdfTable.for_encoding(encoding)
+    table.add(tokenize(encoding, texts))
+    body = table.to_bytes()
+    encoder = Bm25Encoder(table, encoding)
+    for vector in encoder.encode_documents(['| --- | --- |', '']) + encoder.encode_queries(['?']):
+        if not vector.indices:
+            raise AssertionError("Text without words encoded to an empty sparse vector")
+    report['bm25'] = {
+        'encoding': encoding.name,
+        'table_bytes': len(body),
+        'idf_table_build': summarize(
+            timed(lambda: IdfTable.for_encoding(encoding).add(tokenize(encoding, texts)), args.repeat), args.chunks
+        ),
+        'idf_table_load_seconds': summarize(timed(lambda: IdfTable.from_bytes(body), args.repeat), 1)['median_seconds'],
+        'encode_batch': summarize(timed(lambda: encoder.encode_documents(texts), args.repeat), args.chunks),
+        'mean_terms_per_chunk': round(
+            sum(len(vector.indices) for vector in encoder.encode_documents(texts)) / len(texts), 1
+        ),
+    }
+
+    print(json.dumps({'chunks': args.chunks, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
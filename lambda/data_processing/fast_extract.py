@@ -0,0 +1,165 @@
+import re
+from typing import Dict, List, Optional
+
+from lxml import etree
+
+# aonprd page types whose main div uses the Header / HeaderDescrip /
+# DetailedOutput span layout, keyed by the .aspx name in the URL
+KNOWN_LAYOUTS = frozenset({
+    'Actions', 'Ancestries', 'Archetypes', 'Armor', 'Backgrounds', 'Classes',
+    'Conditions', 'Deities', 'Equipment', 'Feats', 'Heritages', 'Languages',
+    'MonsterAbilities', 'Monsters', 'Rules', 'Shields', 'Skills', 'Spells',
+    'Traits', 'Weapons',
+})
+
+HEADINGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+BLOCKS = frozenset({'div', 'p', 'ul', 'ol', 'table', 'hr', 'br', *HEADINGS})
+SKIPPED = frozenset({'script', 'style', 'sup', 'img'})
+
+DISPLAY_OPTIONS = 'Quick display options:'
+
+_WHITESPACE = re.compile(r'\s+')
+_TABLE_ROWS = etree.XPath('.//tr')
+_TABLE_CELLS = etree.XPath('./th|./td')
+_LIST_ITEMS = etree.XPath('./li')
+
+
+def _clean(text: Optional[str]) -> str:
+    return _WHITESPACE.sub(' ', text) if text else ''
+
+
+def _is_trait(element) -> bool:
+    return element.tag == 'span' and element.get('class', '').startswith('trait')
+
+
+class _MarkdownRenderer:
+    """Render an already-parsed aonprd content span as markdown.
+
+    Block elements (headings, lists, tables, line breaks) become separate
+    paragraphs; inline elements keep bold/italic emphasis and drop link
+    targets, matching what trafilatura emits for these pages. Runs of trait
+    spans are collected into a single ``**Traits**`` line.
+
+    With ``repeated_title`` set, the first h1 is assumed to repeat the page
+    title and only its trailing details (actions, item level) are kept.
+    """
+
+    def __init__(self, repeated_title: bool = False):
+        self.repeated_title = repeated_title
+        self.paragraphs: List[str] = []
+        self.line: List[str] = []
+        self.traits: List[str] = []
+
+    def flush(self) -> None:
+        if self.traits:
+            self.paragraphs.append(f"**Traits** {', '.join(self.traits)}")
+            self.traits = []
+        text = ''.join(self.line).strip()
+        if text:
+            self.paragraphs.append(text)
+        self.line = []
+
+    def inline(self, element) -> str:
+        """Render an element and its descendants as a single line"""
+        if element.tag in SKIPPED or not isinstance(element.tag, str):
+            return ''
+        parts = [_clean(element.text)]
+        for child in element:
+            parts.append(self.inline(child))
+            parts.append(_clean(child.tail))
+        text = ''.join(parts)
+
+        if element.tag in ('b', 'strong') and text.strip():
+            return f"**{text.strip()}**"
+        if element.tag in ('i', 'em') and text.strip():
+            return f"*{text.strip()}*"
+        if element.tag == 'br':
+            return ' '
+        return text
+
+    def block(self, element) -> None:
+        """Render the children of a block-level element"""
+        self.line.append(_clean(element.text))
+        for child in element:
+            self.child(child)
+            self.line.append(_clean(child.tail))
+
+    def child(self, element) -> None:
+        tag = element.tag
+        if not isinstance(tag, str) or tag in SKIPPED:
+            return
+
+        if _is_trait(element):
+            if not self.traits:
+                self.flush()
+            self.traits.append(self.inline(element).strip())
+            return
+        if self.traits:
+            self.flush()
+
+        if tag == 'h1' and self.repeated_title:
+            self.repeated_title = False
+            self.flush()
+            details = [self.inline(c).strip() for c in element if c.tag != 'a']
+            details = ' '.join(d for d in details if d)
+            if details:
+                self.paragraphs.append(f"**{details}**")
+        elif tag in HEADINGS:
+            self.flush()
+            self.paragraphs.append(f"{'#' * HEADINGS[tag]} {self.inline(element).strip()}")
+        elif tag in ('br', 'hr'):
+            self.flush()
+        elif tag in ('ul', 'ol'):
+            self.flush()
+            items = [self.inline(li).strip() for li in _LIST_ITEMS(element)]
+            self.paragraphs.append('\n'.join(f"- {item}" for item in items if item))
+        elif tag == 'table':
+            self.flush()
+            self.paragraphs.append(self.table(element))
+        elif tag in BLOCKS:
+            self.flush()
+            self.block(element)
+            self.flush()
+        else:
+            self.line.append(self.inline(element))
+
+    def table(self, element) -> str:
+        rows = [
+            [self.inline(cell).strip().replace('|', '\\|') for cell in _TABLE_CELLS(row)]
+            for row in _TABLE_ROWS(element)
+        ]
+        rows = [row for row in rows if row]
+        if not rows:
+            return ''
+        width = max(len(row) for row in rows)
+        lines = [f"| {' | '.join(row + [''] * (width - len(row)))} |" for row in rows]
+        lines.insert(1, f"|{' --- |' * width}")
+        return '\n'.join(lines)
+
+    def render(self, element) -> str:
+        self.block(element)
+        self.flush()
+        return '\n\n'.join(p for p in self.paragraphs if p)
+
+
+def supports_layout(content_type: Optional[str], span_dict: Dict) -> bool:
+    """Whether a page can be rendered by the template extractor"""
+    return content_type in KNOWN_LAYOUTS and span_dict.get('content') is not None
+
+
+def render_markdown(span_dict: Dict) -> str:
+    """Render the categorized MainContent_ spans of a known layout as markdown"""
+    sections = []
+
+    header = span_dict.get('header')
+    if header is not None:
+        sections.append(_MarkdownRenderer().render(header))
+
+    description = span_dict.get('description')
+    if description is not None:
+        rendered = _MarkdownRenderer().render(description)
+        sections.append(rendered.split(DISPLAY_OPTIONS)[0].strip())
+
+    repeated_title = header is not None
+    sections.append(_MarkdownRenderer(repeated_title).render(span_dict['content']))
+    return '\n\n'.join(s for s in sections if s)
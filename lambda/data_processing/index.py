@@ -2,18 +2,63 @@ import json
 import logging
 import os
 import re
+import threading
+import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-import boto3
 import lxml.html
+from lxml import etree
 from pydantic import BaseModel, Field
-from trafilatura import extract
+
+from clients import get_client, is_cold_start
+from fast_extract import render_markdown, supports_layout
+from manifest import ContentManifest, S3ManifestStore
+from metrics import get_metrics, log_sampled, metric_scope
+from parallel import DEFAULT_CHUNK_SIZE, ParallelExtractor, resolve_worker_count
+from record_format import parse_compression
+from s3_events import S3Object, handle_objects
+from sharding import (
+    SHARD_KEY,
+    Shard,
+    ShardReportStore,
+    dispatch_shards,
+    iter_shard_lines,
+    merge_reports,
+    plan_shards,
+    s3_chunk_reader,
+)
+from streaming import DEFAULT_MAX_PART_BYTES, DEFAULT_PART_SIZE, RollingJsonlWriter, iter_s3_lines
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
+# Stage timings, emitted as EMF metrics once per invocation
+metrics = get_metrics()
+
+_manifest_lock = threading.Lock()
+
+# Render known aonprd layouts directly instead of re-parsing with trafilatura
+FAST_EXTRACTOR_ENABLED = os.environ.get('FAST_EXTRACTOR_ENABLED', 'true').lower() == 'true'
+
+# Codec of the processed objects, chosen by their key suffix ('none', 'gzip' or 'zstd')
+OUTPUT_COMPRESSION = parse_compression(os.environ.get('OUTPUT_COMPRESSION'))
+
+# Bump when extraction output changes so the content manifest re-extracts every page
+EXTRACTOR_VERSION = '2'
+
+# Item field carrying a previously recorded result for an unchanged page
+CACHED_RESULT_FIELD = '_cached_result'
+
+# Compiled once and reused for every page
+_MAIN_DIV = etree.XPath('//div[@class="main"]')
+_MAIN_CONTENT_SPANS = etree.XPath('.//span[contains(@id, "MainContent_")]')
+_ALL_TEXT = etree.XPath('.//text()')
+_H1_TEXT = etree.XPath('.//h1/text()')
+_SOURCE_TEXT = etree.XPath('.//b[contains(text(), "Source")]/following-sibling::a[1]/i/text()')
+_SOURCE_LINK = etree.XPath('.//b[contains(text(), "Source")]/following-sibling::a[1]/@href')
+
 
 class ProcessingError(Exception):
     """Custom exception for processing errors with context"""
@@ -35,10 +80,10 @@ class ExtractedContent(BaseModel):
     markdown: Optional[str] = None
 
 
-def _get_text(element, xpath='.//text()'):
+def _get_text(element, xpath=_ALL_TEXT):
     """Safely extract text from an element"""
     if element is not None:
-        texts = element.xpath(xpath)
+        texts = xpath(element)
         return ' '.join(t.strip() for t in texts if t.strip())
     return None
 
@@ -51,9 +96,9 @@ def _get_source(element) -> Tuple[Optional[str], Optional[str]]:
     """
     if element is not None:
         # Get the "Source" text and following content up to the next tag
-        source_text = element.xpath('.//b[contains(text(), "Source")]/following-sibling::a[1]/i/text()')
+        source_text = _SOURCE_TEXT(element)
         # Get the linked source text
-        source_link = element.xpath('.//b[contains(text(), "Source")]/following-sibling::a[1]/@href')
+        source_link = _SOURCE_LINK(element)
         
         if source_text and source_link:
             return (
@@ -94,6 +139,10 @@ def extract_with_fallback(
     description: str
 ) -> str:
     """Process HTML with trafilatura with fallback"""
+    # Imported on first use: known layouts never need it, and it is the
+    # heaviest import of this module
+    from trafilatura import extract
+
     # Try to extract content using trafilatura
     markdown = extract(html_content, output_format='markdown', deduplicate=True)
     
@@ -108,23 +157,19 @@ def extract_with_fallback(
 def process_html_content(html_content: str, url: str) -> ExtractedContent:
     """Process HTML content and extract structured data"""
     try:
-        tree = lxml.html.fromstring(html_content)
+        with metrics.time('html_parse'):
+            tree = lxml.html.fromstring(html_content)
     except Exception as e:
         raise ValueError(f"Failed to parse HTML: {str(e)}")
     
     # Get main div
-    main_div = tree.xpath('//div[@class="main"]')
+    main_div = _MAIN_DIV(tree)
     if not main_div or len(main_div) == 0:
         raise ValueError("No main div found")
     main = main_div[0]
     
-    # Convert to string for trafilatura
-    main_html = lxml.etree.tostring(
-        main, encoding='unicode', method='html'
-    )
-    
     # Find spans
-    spans = main.xpath('.//span[contains(@id, "MainContent_")]')
+    spans = _MAIN_CONTENT_SPANS(main)
     span_dict = {}
     
     # Categorize spans
@@ -138,7 +183,7 @@ def process_html_content(html_content: str, url: str) -> ExtractedContent:
             span_dict['content'] = span
     
     # Extract content
-    title = _get_text(span_dict.get('header'), './/h1/text()')
+    title = _get_text(span_dict.get('header'), _H1_TEXT)
     source_text, source_link = _get_source(span_dict.get('description'))
     description = _get_text(span_dict.get('description'))
     content_type = re.search(
@@ -146,10 +191,19 @@ def process_html_content(html_content: str, url: str) -> ExtractedContent:
         url.strip()
     ).group(1)
     
-    # Generate markdown
-    markdown = extract_with_fallback(
-        main_html, title, source_text, source_link, description
-    )
+    # Generate markdown, rendering known layouts straight from the parsed tree
+    if FAST_EXTRACTOR_ENABLED and supports_layout(content_type, span_dict):
+        with metrics.time('fast_extraction'):
+            markdown = render_markdown(span_dict)
+    else:
+        with metrics.time('trafilatura_extraction'):
+            # Convert to string for trafilatura
+            main_html = etree.tostring(
+                main, encoding='unicode', method='html'
+            )
+            markdown = extract_with_fallback(
+                main_html, title, source_text, source_link, description
+            )
     
     return ExtractedContent(
         title=title.strip() if len(title.strip()) > 0 else None,
@@ -163,8 +217,10 @@ def process_html_content(html_content: str, url: str) -> ExtractedContent:
     )
 
 
-def parse_jsonl(content: str):
-    for line_num, line in enumerate(content.splitlines(), 1):
+def parse_jsonl(content: Union[str, Iterable[str]]):
+    """Parse JSONL from a string or lazily from an iterable of lines"""
+    lines = content.splitlines() if isinstance(content, str) else content
+    for line_num, line in enumerate(lines, 1):
         line = line.strip()
         if not line:  # Skip empty lines
             continue
@@ -197,39 +253,126 @@ def handle_processing_error(error: Exception, context: dict = None) -> Dict[str,
     }
 
 
-def process_items(content: str, is_jsonl: bool, source_key: str) -> Tuple[List[Dict], List[Dict]]:
+def process_item(idx: int, item: Dict) -> ExtractedContent:
+    """Validate a parsed JSONL item and extract its content"""
+    if not all(k in item for k in ('content', 'url')):
+        raise ProcessingError("Missing required fields", {
+            'item_index': idx,
+            'available_fields': list(item.keys())
+        })
+
+    log_sampled(logger, "Processing item %s: %s", idx, item['url'])
+    return process_html_content(item['content'], item['url'])
+
+
+def process_indexed_item(idx: int, item: Dict) -> Tuple[Optional[ExtractedContent], Optional[Dict]]:
+    """Process one item, returning a (processed, failure) pair instead of raising"""
+    try:
+        if CACHED_RESULT_FIELD in item:
+            metrics.count('items_reused')
+            return ExtractedContent.model_validate_json(item[CACHED_RESULT_FIELD]), None
+        with metrics.time('item'):
+            processed = process_item(idx, item)
+        metrics.count('items_processed')
+        return processed, None
+    except Exception as e:
+        metrics.count('items_failed')
+        error_details = {
+            'item_index': idx,
+            'url': item.get('url', 'unknown'),
+            'error': str(e)
+        }
+        logger.warning(f"Failed to process item {idx}", extra=error_details)
+        return None, error_details
+
+
+def _apply_manifest(
+    items: Iterable[Tuple[int, Dict]],
+    manifest: ContentManifest,
+    pending_hashes: Dict[str, str],
+    reuse_unchanged: bool
+) -> Iterator[Tuple[int, Dict]]:
+    """Drop or substitute items whose raw HTML matches the manifest"""
+    for idx, item in items:
+        url, html = item.get('url'), item.get('content')
+        if not isinstance(url, str) or not isinstance(html, str):
+            yield idx, item
+            continue
+
+        url = url.strip()
+        content_hash, entry = manifest.check(url, html)
+        previous = None
+        if entry is not None:
+            if not reuse_unchanged:
+                continue
+            previous = manifest.load_previous(entry)
+
+        if previous is None:
+            # New, changed, or the recorded result is no longer available
+            pending_hashes[url] = content_hash
+            yield idx, item
+        else:
+            yield idx, {'url': url, CACHED_RESULT_FIELD: previous}
+
+
+def iter_process_items(
+    lines: Union[str, Iterable[str]],
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    manifest: Optional[ContentManifest] = None,
+    reuse_unchanged: bool = True
+) -> Iterator[Tuple[Optional[ExtractedContent], Optional[Dict]]]:
+    """Process JSONL items lazily, yielding (processed, failure) pairs in input order.
+
+    With more than one worker, extraction is spread across a process pool.
+    With a manifest, pages whose HTML is unchanged since the last run are not
+    extracted again: their previous result is reused, or they are skipped
+    entirely when ``reuse_unchanged`` is False.
+    """
+    items = enumerate(parse_jsonl(lines))
+    pending_hashes: Dict[str, str] = {}
+    if manifest is not None:
+        items = _apply_manifest(items, manifest, pending_hashes, reuse_unchanged)
+
+    if workers > 1:
+        logger.info(f"Extracting with {workers} worker processes")
+        results = ParallelExtractor(process_indexed_item, workers, chunk_size).imap(items)
+    else:
+        results = (process_indexed_item(idx, item) for idx, item in items)
+
+    item_count = 0
+    for processed, failure in results:
+        if processed:
+            item_count += 1
+            if item_count % 100 == 0:
+                logger.info(f"Processed {item_count} items")
+
+        if pending_hashes:
+            url = processed.url if processed else failure.get('url', 'unknown').strip()
+            content_hash = pending_hashes.pop(url, None)
+            if processed and content_hash:
+                manifest.record(url, content_hash, processed.model_dump_json())
+        yield processed, failure
+
+
+def process_items(
+    content: str,
+    is_jsonl: bool,
+    source_key: str,
+    workers: int = 1
+) -> Tuple[List[Dict], List[Dict]]:
     """Process items with structured error handling"""
     processed_items: List[ExtractedContent] = []
     failed_items: List[Dict] = []
-    item_count = 0
     
     if is_jsonl:
         logger.info("Starting JSONL file processing")
         
-        for idx, item in enumerate(parse_jsonl(content)):
-            try:
-                if not all(k in item for k in ('content', 'url')):
-                    raise ProcessingError("Missing required fields", {
-                        'item_index': idx,
-                        'available_fields': list(item.keys())
-                    })
-                
-                logger.info(f"Processing item {idx}: {item['url']}")
-                processed: ExtractedContent = process_html_content(item['content'], item['url'])
+        for processed, failure in iter_process_items(content, workers=workers):
+            if processed:
                 processed_items.append(processed)
-                item_count += 1
-                
-                if item_count % 100 == 0:
-                    logger.info(f"Processed {item_count} items")
-                
-            except Exception as e:
-                error_details = {
-                    'item_index': idx,
-                    'url': item.get('url', 'unknown'),
-                    'error': str(e)
-                }
-                logger.warning(f"Failed to process item {item}", extra=error_details)
-                failed_items.append(error_details)
+            else:
+                failed_items.append(failure)
     else:
         try:
             processed_items = [process_html_content(content, source_key)]
@@ -243,64 +386,295 @@ def process_items(content: str, is_jsonl: bool, source_key: str) -> Tuple[List[D
     return processed_items, failed_items
 
 
-def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """AWS Lambda handler for processing HTML content with improved error handling"""
-    logger.info("Processing request", extra={'event': event})
-    s3 = boto3.client('s3')
-    
+def _open_manifest(s3, processed_bucket: str, run_id: str) -> Optional[ContentManifest]:
+    """Content manifest for the configured MANIFEST_MODE, or None when off"""
+    if os.environ.get('MANIFEST_MODE', 'off').lower() not in ('skip', 'reuse'):
+        return None
+    return ContentManifest(
+        S3ManifestStore(s3, processed_bucket, os.environ.get('MANIFEST_PREFIX', 'manifest')),
+        run_id=run_id,
+        salt=f"{EXTRACTOR_VERSION}:{FAST_EXTRACTOR_ENABLED}"
+    )
+
+
+def source_partition(source_key: str) -> str:
+    """Output partition name for a source object: its key, made path-safe"""
+    stem = re.sub(r'\.(jsonl|json|html?)$', '', source_key, flags=re.IGNORECASE)
+    return re.sub(r'[^A-Za-z0-9._-]+', '-', stem).strip('-.')[:200] or 'source'
+
+
+def output_prefix(source_key: str, run_id: str) -> str:
+    """Where a run writes its parts: ``processed/{date}/{partition}/{run_id}/``.
+
+    Run IDs start with the date the run began, so shards finishing after
+    midnight still write next to the rest of their run.
+    """
+    return f"processed/{run_id[:10]}/{source_partition(source_key)}/{run_id}/"
+
+
+def save_run_manifest(
+    s3,
+    processed_bucket: str,
+    run_id: str,
+    source_bucket: str,
+    source_key: str,
+    report: Dict[str, Any]
+) -> str:
+    """Record a finished run and the parts it wrote.
+
+    Kept outside ``processed/`` so writing it does not trigger vectorization.
+    """
+    prefix = os.environ.get('RUN_MANIFEST_PREFIX', 'runs').rstrip('/')
+    key = f"{prefix}/{run_id[:10]}/{source_partition(source_key)}/{run_id}.json"
+    manifest = {
+        'run_id': run_id,
+        'source': f"s3://{source_bucket}/{source_key}",
+        'completed_at': datetime.now().isoformat(),
+        'processed_items': report.get('processed_items', 0),
+        'failed_items': report.get('failed_items', 0),
+        'skipped_items': report.get('skipped_items', 0),
+        'failed_shards': report.get('failed_shards') or [],
+        'parts': sorted(report.get('parts') or [], key=lambda part: part['key']),
+    }
+    s3.put_object(
+        Bucket=processed_bucket,
+        Key=key,
+        Body=json.dumps(manifest).encode('utf-8'),
+        ContentType='application/json'
+    )
+    return key
+
+
+def write_processed_output(
+    s3,
+    results: Iterable[Tuple[Optional[ExtractedContent], Optional[Dict]]],
+    processed_bucket: str,
+    output_stem: str,
+    manifest: Optional[ContentManifest] = None
+) -> Dict[str, Any]:
+    """Stream results into size-rolled part objects and return the run's report.
+
+    Parts are named ``{output_stem}{n:05d}.jsonl`` (plus the compression
+    suffix) and each one is picked up by its own vectorization invocation.
+    """
+    part_size = int(os.environ.get('OUTPUT_PART_SIZE_BYTES', DEFAULT_PART_SIZE))
+    max_part_bytes = int(os.environ.get('OUTPUT_MAX_PART_BYTES', DEFAULT_MAX_PART_BYTES))
+    skip_unchanged = os.environ.get('MANIFEST_MODE', 'off').lower() == 'skip'
+    processed_count = 0
+    failed_items = []
+    # Write to processed bucket as results arrive
+    with RollingJsonlWriter(
+        s3, processed_bucket, output_stem, max_part_bytes, OUTPUT_COMPRESSION, part_size
+    ) as writer:
+        for processed, failure in results:
+            if processed:
+                writer.write_line(processed.model_dump_json())
+                processed_count += 1
+            else:
+                failed_items.append(failure)
+
+        skipped_count = manifest.stats['unchanged'] if manifest and skip_unchanged else 0
+        if not processed_count and (failed_items or not skipped_count):
+            # Raising here aborts the upload so no empty output is written
+            raise ProcessingError("No items were successfully processed", {
+                'total_failures': len(failed_items),
+                'failed_items': failed_items
+            })
+        if not processed_count:
+            logger.info("All items unchanged since the last run, skipping output")
+
+    logger.info("Processing completed successfully", extra={
+        'processed_count': processed_count,
+        'failed_count': len(failed_items),
+        'parts': len(writer.parts)
+    })
+    return {
+        'processed_items': processed_count,
+        'failed_items': len(failed_items),
+        'skipped_items': skipped_count,
+        'manifest': manifest.stats if manifest else None,
+        'output_locations': [f"s3://{processed_bucket}/{part['key']}" for part in writer.parts],
+        'parts': writer.parts,
+        'failures': failed_items if failed_items else None
+    }
+
+
+def _iter_results(lines: Iterable[str], manifest: Optional[ContentManifest]):
+    return iter_process_items(
+        lines,
+        workers=resolve_worker_count(),
+        chunk_size=int(os.environ.get('EXTRACTION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)),
+        manifest=manifest,
+        reuse_unchanged=os.environ.get('MANIFEST_MODE', 'off').lower() == 'reuse'
+    )
+
+
+def fan_out(s3, source_bucket: str, source_key: str, run_id: str, context: Any) -> Dict[str, Any]:
+    """Split a large input into byte-range shards, one invocation each"""
+    head = s3.head_object(Bucket=source_bucket, Key=source_key)
+    shards = plan_shards(
+        run_id,
+        source_bucket,
+        source_key,
+        head['ContentLength'],
+        int(os.environ['SHARD_SIZE_BYTES']),
+        int(os.environ.get('MAX_SHARDS', '1000')),
+        etag=head.get('ETag', '')
+    )
+    dispatch_shards(get_client('lambda'), context.invoked_function_arn, shards)
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'message': f"Processing split into {len(shards)} shards",
+            'run_id': run_id,
+            'shards': len(shards)
+        })
+    }
+
+
+def process_shard(s3, shard: Shard, context: Any) -> Dict[str, Any]:
+    """Process one shard, then merge all reports if it was the last to finish.
+
+    Each shard writes its own output object, which the vectorization Lambda
+    picks up independently, and defers its manifest updates to a delta that
+    the aggregating shard applies once, so concurrent shards never race on
+    the manifest index.
+    """
+    processed_bucket = os.environ['PROCESSED_BUCKET_NAME']
+    output_stem = f"{output_prefix(shard.key, shard.run_id)}{shard.name}-part-"
+    manifest = _open_manifest(s3, processed_bucket, f"{shard.run_id}-{shard.name}")
+
+    logger.info(f"Processing shard {shard.name} ({shard.start}-{shard.end}) of {shard.key}")
+    lines = iter_shard_lines(
+        s3_chunk_reader(s3, shard.bucket, shard.key, shard.etag), shard.start, shard.end
+    )
     try:
-        # Extract S3 event details
-        record = event['Records'][0]['s3']
-        source_bucket = record['bucket']['name']
-        source_key = record['object']['key']
+        report = write_processed_output(
+            s3, _iter_results(lines, manifest), processed_bucket, output_stem, manifest
+        )
+        delta = manifest.commit(deferred=True) if manifest else None
+        report['manifest_deltas'] = [delta] if delta else []
+    except Exception as e:
+        if manifest:
+            manifest.discard()
+        logger.error(f"Shard {shard.name} failed: {str(e)}")
+        report = {'failed_shards': [{'shard': shard.name, 'error': str(e)}]}
+
+    reports = ShardReportStore(s3, processed_bucket, 'shard-reports/processing')
+    reports.save(shard, report)
+    all_reports = reports.collect(shard)
+    if all_reports is None:
+        return {'statusCode': 200, 'body': json.dumps({'message': f"Shard {shard.name} complete", **report})}
+
+    # Last shard to finish: merge the run's reports and manifest deltas
+    merged = merge_reports(all_reports)
+    if manifest and merged.get('manifest_deltas'):
+        manifest.store.apply_deltas(merged['manifest_deltas'])
+    report_key = reports.save_merged(shard.run_id, merged)
+    run_manifest = save_run_manifest(s3, processed_bucket, shard.run_id, shard.bucket, shard.key, merged)
+    logger.info(f"All {shard.count} shards of {shard.key} complete, report at {report_key}")
+    merged.pop('parts', None)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Processing complete',
+            'shards': shard.count,
+            'run_manifest': run_manifest,
+            **merged
+        })
+    }
+
+
+def process_object(s3, obj: S3Object, run_id: str, context: Any) -> Dict[str, Any]:
+    """Extract one uploaded object into processed part objects"""
+    source_bucket, source_key = obj.bucket, obj.key
+    manifest = None
+
+    try:
+        processed_bucket = os.environ['PROCESSED_BUCKET_NAME']
+        is_jsonl = source_key.endswith('.jsonl')
+
+        shard_bytes = int(os.environ.get('SHARD_SIZE_BYTES', '0'))
+        if is_jsonl and shard_bytes and obj.size > shard_bytes and context is not None:
+            return fan_out(s3, source_bucket, source_key, run_id, context)
         
         # Get source object
         response = s3.get_object(Bucket=source_bucket, Key=source_key)
-        content = response['Body'].read().decode('utf-8')
         
-        # Process content
-        is_jsonl = source_key.endswith('.jsonl')
-        processed_items, failed_items = process_items(content, is_jsonl, source_key)
+        # Part objects of this run, partitioned by source so concurrent uploads never collide
+        output_stem = f"{output_prefix(source_key, run_id)}part-"
         
-        if not processed_items:
-            raise ProcessingError("No items were successfully processed", {
-                'total_failures': len(failed_items),
-                'failed_items': failed_items
-            })
-        
-        # Write to processed bucket
-        processed_bucket = os.environ['PROCESSED_BUCKET_NAME']
-        date_prefix = datetime.now().strftime('%Y-%m-%d')
-        output_key = f"processed/{date_prefix}/processed.jsonl"
+        # Process content, streaming JSONL lines straight from the S3 body
+        if is_jsonl:
+            logger.info("Starting streaming JSONL processing")
+            manifest = _open_manifest(s3, processed_bucket, run_id)
+            results = _iter_results(iter_s3_lines(response['Body']), manifest)
+        else:
+            content = response['Body'].read().decode('utf-8')
+            processed_items, failed_items = process_items(content, is_jsonl, source_key)
+            results = [(item, None) for item in processed_items]
+            results.extend((None, failure) for failure in failed_items)
+
+        report = write_processed_output(s3, results, processed_bucket, output_stem, manifest)
         
-        output_content = '\n'.join(json.dumps(item) for item in processed_items)
-        s3.put_object(
-            Bucket=processed_bucket,
-            Key=output_key,
-            Body=output_content.encode('utf-8'),
-            ContentType='application/jsonl'
+        if manifest:
+            # Only mark pages as done once their output is durably written;
+            # objects of one event commit in turn, as each merges into the index
+            with _manifest_lock:
+                manifest.commit()
+        report['run_manifest'] = save_run_manifest(
+            s3, processed_bucket, run_id, source_bucket, source_key, report
         )
+        report.pop('parts')
         
-        result = {
+        return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Processing complete',
-                'processed_items': len(processed_items),
-                'failed_items': len(failed_items),
-                'output_location': f"s3://{processed_bucket}/{output_key}",
-                'failures': failed_items if failed_items else None
-            })
+            'body': json.dumps({'message': 'Processing complete', **report})
         }
         
-        logger.info("Processing completed successfully", extra={
-            'processed_count': len(processed_items),
-            'failed_count': len(failed_items)
-        })
-        
-        return result
-        
     except Exception as e:
+        if manifest:
+            manifest.discard()
         return handle_processing_error(e, {
             'source_bucket': source_bucket,
             'source_key': source_key
         })
+
+
+@metric_scope
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """AWS Lambda handler for processing HTML content with improved error handling.
+
+    Handles S3 notifications, delivered directly or in SQS batches, with
+    every object they name processed concurrently (RECORD_CONCURRENCY at a
+    time, or one at a time when extraction forks worker processes). JSONL
+    inputs larger than SHARD_SIZE_BYTES are split into byte-range shards
+    processed by parallel invocations of this function.
+    """
+    logger.info("Processing request", extra={'event': event, 'cold_start': is_cold_start()})
+    s3 = get_client('s3')
+
+    if SHARD_KEY in event:
+        try:
+            return process_shard(s3, Shard.model_validate(event[SHARD_KEY]), context)
+        except Exception as e:
+            return handle_processing_error(e, {
+                'source_bucket': event[SHARD_KEY].get('bucket'),
+                'source_key': event[SHARD_KEY].get('key')
+            })
+
+    date_prefix = datetime.now().strftime('%Y-%m-%d')
+    request_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+
+    def run_id(obj: S3Object) -> str:
+        # Objects of one event need their own run, as a run names its outputs
+        suffix = f"-{obj.position}" if obj.position else ''
+        return f"{date_prefix}-{request_id}{suffix}"
+
+    # Extraction workers are forked, which is unsafe with other threads running
+    record_concurrency = 1 if resolve_worker_count() > 1 else int(os.environ.get('RECORD_CONCURRENCY', '1'))
+    return handle_objects(
+        event,
+        lambda obj: process_object(s3, obj, run_id(obj), context),
+        record_concurrency
+    )
@@ -0,0 +1,290 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+from streaming import S3MultipartWriter
+
+logger = logging.getLogger()
+
+INDEX_NAME = 'index.json.gz'
+PACKS_DIR = 'packs'
+DELTAS_DIR = 'deltas'
+
+# Unchanged pages usually appear in the same order as in the pack that
+# recorded them, so one ranged read serves many consecutive lookups
+READ_AHEAD_BYTES = 4 * 1024 * 1024
+
+# url -> [content_hash, pack_name, byte_offset, byte_length]
+ManifestEntry = List
+
+
+class ManifestStore(ABC):
+    """Persistence for the content manifest.
+
+    The index maps each URL to the hash of its raw HTML and the location of
+    its last extraction result. Results are appended to one JSONL "pack" per
+    run so recording them costs no extra requests per page.
+    """
+
+    @abstractmethod
+    def load_index(self) -> Dict[str, ManifestEntry]:
+        """Return the current URL index, or an empty one"""
+
+    @abstractmethod
+    def write_index(self, entries: Dict[str, ManifestEntry]) -> None:
+        """Replace the URL index"""
+
+    @abstractmethod
+    def open_pack(self, name: str):
+        """Open a writer with ``write_line``, ``bytes_written``, ``close`` and ``abort``"""
+
+    @abstractmethod
+    def read_range(self, pack: str, offset: int, length: int) -> Optional[bytes]:
+        """Read up to ``length`` bytes of a pack, or None if it is gone"""
+
+    @abstractmethod
+    def write_delta(self, name: str, updates: Dict[str, ManifestEntry]) -> None:
+        """Store index updates to be merged later by ``apply_deltas``"""
+
+    @abstractmethod
+    def load_delta(self, name: str) -> Dict[str, ManifestEntry]:
+        """Return stored index updates, or an empty dict"""
+
+    def save_index(self, updates: Dict[str, ManifestEntry]) -> None:
+        """Merge updates into the latest index so concurrent runs lose less"""
+        entries = self.load_index()
+        entries.update(updates)
+        self.write_index(entries)
+
+    def apply_deltas(self, names: List[str]) -> int:
+        """Merge the deltas of concurrent shards into the index in one write"""
+        updates: Dict[str, ManifestEntry] = {}
+        for name in names:
+            updates.update(self.load_delta(name))
+        if updates:
+            self.save_index(updates)
+        return len(updates)
+
+
+class S3ManifestStore(ManifestStore):
+    """Manifest kept under a prefix of an S3 bucket"""
+
+    def __init__(self, client: BaseClient, bucket: str, prefix: str = 'manifest'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _key(self, *parts: str) -> str:
+        return '/'.join((self.prefix, *parts))
+
+    def load_index(self) -> Dict[str, ManifestEntry]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(INDEX_NAME))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise
+        return json.loads(gzip.decompress(response['Body'].read()))['entries']
+
+    def write_index(self, entries: Dict[str, ManifestEntry]) -> None:
+        body = gzip.compress(json.dumps({'version': 1, 'entries': entries}).encode('utf-8'))
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(INDEX_NAME),
+            Body=body,
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+
+    def write_delta(self, name: str, updates: Dict[str, ManifestEntry]) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(DELTAS_DIR, f"{name}.json.gz"),
+            Body=gzip.compress(json.dumps(updates).encode('utf-8')),
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+
+    def load_delta(self, name: str) -> Dict[str, ManifestEntry]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self._key(DELTAS_DIR, f"{name}.json.gz")
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise
+        return json.loads(gzip.decompress(response['Body'].read()))
+
+    def open_pack(self, name: str) -> S3MultipartWriter:
+        return S3MultipartWriter(self.client, self.bucket, self._key(PACKS_DIR, name))
+
+    def read_range(self, pack: str, offset: int, length: int) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket,
+                Key=self._key(PACKS_DIR, pack),
+                Range=f"bytes={offset}-{offset + length - 1}"
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404', 'InvalidRange'):
+                return None
+            raise
+        return response['Body'].read()
+
+
+class _LocalPackWriter:
+    def __init__(self, path: str):
+        self._file = open(path, 'wb')
+        self.bytes_written = 0
+
+    def write_line(self, line: str) -> None:
+        data = line.encode('utf-8') + b'\n'
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self._file.name)
+
+
+class LocalManifestStore(ManifestStore):
+    """Manifest kept in a local directory, for tests and local runs"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, PACKS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(directory, DELTAS_DIR), exist_ok=True)
+
+    def load_index(self) -> Dict[str, ManifestEntry]:
+        path = os.path.join(self.directory, INDEX_NAME)
+        if not os.path.exists(path):
+            return {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)['entries']
+
+    def write_index(self, entries: Dict[str, ManifestEntry]) -> None:
+        path = os.path.join(self.directory, INDEX_NAME)
+        with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': entries}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def write_delta(self, name: str, updates: Dict[str, ManifestEntry]) -> None:
+        path = os.path.join(self.directory, DELTAS_DIR, f"{name}.json.gz")
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(updates, f)
+
+    def load_delta(self, name: str) -> Dict[str, ManifestEntry]:
+        path = os.path.join(self.directory, DELTAS_DIR, f"{name}.json.gz")
+        if not os.path.exists(path):
+            return {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def open_pack(self, name: str) -> _LocalPackWriter:
+        return _LocalPackWriter(os.path.join(self.directory, PACKS_DIR, name))
+
+    def read_range(self, pack: str, offset: int, length: int) -> Optional[bytes]:
+        path = os.path.join(self.directory, PACKS_DIR, pack)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class ContentManifest:
+    """Skip or reuse extraction for pages whose raw HTML has not changed.
+
+    Hashes are salted with the extractor version so that changing the
+    extraction logic invalidates previously recorded results. Updates are
+    only persisted by ``commit``, which callers invoke once the run's output
+    has been written, so a failed run never marks pages as done.
+    """
+
+    def __init__(self, store: ManifestStore, run_id: str, salt: str = ''):
+        self.store = store
+        self.salt = salt
+        self.pack_name = f"{run_id}.jsonl"
+        self.entries = store.load_index()
+        self.updates: Dict[str, ManifestEntry] = {}
+        self.stats = {'unchanged': 0, 'changed': 0, 'new': 0}
+        self._pack = None
+        self._window: Tuple[Optional[str], int, bytes] = (None, 0, b'')
+        logger.info(f"Loaded content manifest with {len(self.entries)} entries")
+
+    def content_hash(self, html: str) -> str:
+        return hashlib.sha256(f"{self.salt}\0{html}".encode('utf-8')).hexdigest()
+
+    def check(self, url: str, html: str) -> Tuple[str, Optional[ManifestEntry]]:
+        """Hash a page, returning its previous entry if the content is unchanged"""
+        content_hash = self.content_hash(html)
+        entry = self.entries.get(url)
+        if entry is None:
+            self.stats['new'] += 1
+        elif entry[0] == content_hash:
+            self.stats['unchanged'] += 1
+            return content_hash, entry
+        else:
+            self.stats['changed'] += 1
+        return content_hash, None
+
+    def load_previous(self, entry: ManifestEntry) -> Optional[str]:
+        """Fetch the recorded extraction result for an unchanged page"""
+        _, pack, offset, length = entry
+        window_pack, window_start, window = self._window
+        in_window = window_start <= offset and offset + length <= window_start + len(window)
+        if pack != window_pack or not in_window:
+            window = self.store.read_range(pack, offset, max(length, READ_AHEAD_BYTES))
+            if window is None or len(window) < length:
+                return None
+            window_start = offset
+            self._window = (pack, window_start, window)
+
+        start = offset - window_start
+        return window[start:start + length].decode('utf-8')
+
+    def record(self, url: str, content_hash: str, payload: str) -> None:
+        """Remember the extraction result for a new or changed page"""
+        if self._pack is None:
+            self._pack = self.store.open_pack(self.pack_name)
+        offset = self._pack.bytes_written
+        self._pack.write_line(payload)
+        length = self._pack.bytes_written - offset
+        self.updates[url] = [content_hash, self.pack_name, offset, length]
+
+    def commit(self, deferred: bool = False) -> Optional[str]:
+        """Persist recorded results and index updates.
+
+        With ``deferred``, as used by concurrent shards, the updates are
+        written as a delta for ``apply_deltas`` instead of rewriting the
+        shared index; the delta name is returned.
+        """
+        if self._pack is not None:
+            self._pack.close()
+        if not self.updates:
+            return None
+        if deferred:
+            name = self.pack_name[:-len('.jsonl')]
+            self.store.write_delta(name, self.updates)
+            logger.info(f"Wrote content manifest delta with {len(self.updates)} entries")
+            return name
+        self.store.save_index(self.updates)
+        logger.info(f"Updated content manifest with {len(self.updates)} entries")
+        return None
+
+    def discard(self) -> None:
+        """Drop everything recorded during this run"""
+        if self._pack is not None:
+            self._pack.abort()
+        self.updates = {}
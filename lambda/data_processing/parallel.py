@@ -0,0 +1,184 @@
+import logging
+import multiprocessing
+import os
+import threading
+from itertools import islice
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import get_metrics
+
+logger = logging.getLogger()
+
+DEFAULT_CHUNK_SIZE = 8
+
+# Fork so workers inherit the process function and loaded modules without pickling
+_CONTEXT = multiprocessing.get_context('fork')
+
+# (processed, failure) pair as produced by the per-item process function
+ItemResult = Tuple[Optional[Any], Optional[Dict]]
+ProcessFn = Callable[[int, Dict], ItemResult]
+
+
+def resolve_worker_count(value: Optional[str] = None) -> int:
+    """Resolve a worker count setting, where 'auto' or 0 means one per CPU"""
+    value = value if value is not None else os.environ.get('EXTRACTION_WORKERS', '1')
+    if str(value).strip().lower() in ('auto', '0'):
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def _worker_loop(conn: Connection, process_fn: ProcessFn) -> None:
+    """Receive chunks of (idx, item), process them and send back the results.
+
+    Stage metrics recorded in the worker travel back with each chunk.
+    """
+    metrics = get_metrics()
+    # Drop whatever the parent had recorded before the fork
+    metrics.drain()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        chunk_id, items = task
+        results = [process_fn(idx, item) for idx, item in items]
+        conn.send((chunk_id, results, metrics.drain()))
+    conn.close()
+
+
+class _Worker:
+    """A forked extraction process and the pipe used to talk to it.
+
+    Lambda has no /dev/shm, so multiprocessing.Pool and ProcessPoolExecutor
+    cannot create their semaphores there. Plain processes and pipes work.
+    """
+
+    def __init__(self, worker_id: int, process_fn: ProcessFn):
+        self.worker_id = worker_id
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(
+            target=_worker_loop, args=(child_conn, process_fn), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[Tuple[int, List[Tuple[int, Dict]]]] = None
+        self.stats = {'processed': 0, 'failed': 0}
+
+    def submit(self, chunk_id: int, items: List[Tuple[int, Dict]]) -> None:
+        self.task = (chunk_id, items)
+        self.conn.send(self.task)
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ParallelExtractor:
+    """Spread per-item extraction across a pool of worker processes.
+
+    Items are submitted in chunks to amortize pipe overhead and results are
+    yielded in input order regardless of which worker finishes first. Each
+    worker holds at most one chunk, and no new chunk is handed out while
+    ``max_pending_chunks`` are waiting to be yielded, so memory stays bounded.
+
+    Workers are forked, which is only safe from a single-threaded process: a
+    lock another thread holds at the fork (logging, a connection pool) stays
+    held forever in the child. With other threads running, items are
+    extracted in process instead.
+    """
+
+    def __init__(
+        self,
+        process_fn: ProcessFn,
+        workers: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        self.process_fn = process_fn
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.max_pending_chunks = self.workers * 4
+        self.worker_stats: Dict[int, Dict[str, int]] = {}
+
+    def _record(self, worker: _Worker, results: List[ItemResult]) -> None:
+        for _, failure in results:
+            worker.stats['failed' if failure else 'processed'] += 1
+
+    def imap(self, items: Iterable[Tuple[int, Dict]]) -> Iterator[ItemResult]:
+        """Process (idx, item) pairs in parallel, yielding results in order"""
+        if threading.active_count() > 1:
+            logger.warning(
+                f"Extracting in process, as forking with {threading.active_count()} threads running may deadlock"
+            )
+            yield from (self.process_fn(idx, item) for idx, item in items)
+            return
+
+        chunks = iter(lambda it=iter(items): list(islice(it, self.chunk_size)), [])
+        pool = [_Worker(i, self.process_fn) for i in range(self.workers)]
+        pending: Dict[int, List[ItemResult]] = {}
+        next_chunk_id = 0
+        next_to_yield = 0
+        exhausted = False
+
+        def feed(worker: _Worker) -> None:
+            nonlocal next_chunk_id, exhausted
+            if exhausted or next_chunk_id - next_to_yield >= self.max_pending_chunks:
+                return
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                return
+            worker.submit(next_chunk_id, chunk)
+            next_chunk_id += 1
+
+        try:
+            while True:
+                for worker in pool:
+                    if worker.task is None:
+                        feed(worker)
+
+                busy = {worker.conn: worker for worker in pool if worker.task}
+                if not busy:
+                    break
+
+                for conn in wait(list(busy)):
+                    worker = busy[conn]
+                    chunk_id, chunk = worker.task
+                    worker.task = None
+                    try:
+                        _, results, worker_metrics = conn.recv()
+                        get_metrics().merge(worker_metrics)
+                    except (EOFError, OSError):
+                        # The worker died (e.g. OOM); fail its chunk and replace it
+                        logger.error(f"Extraction worker {worker.worker_id} exited unexpectedly")
+                        results = [(None, {
+                            'item_index': idx,
+                            'url': item.get('url', 'unknown'),
+                            'error': 'Extraction worker exited unexpectedly'
+                        }) for idx, item in chunk]
+                        worker.stop()
+                        replacement = _Worker(worker.worker_id, self.process_fn)
+                        replacement.stats = worker.stats
+                        pool[pool.index(worker)] = worker = replacement
+
+                    self._record(worker, results)
+                    pending[chunk_id] = results
+
+                while next_to_yield in pending:
+                    yield from pending.pop(next_to_yield)
+                    next_to_yield += 1
+        finally:
+            for worker in pool:
+                self.worker_stats[worker.worker_id] = worker.stats
+                worker.stop()
+
+        logger.info("Parallel extraction finished", extra={'worker_stats': self.worker_stats})
@@ -0,0 +1,231 @@
+import logging
+from typing import Any, Iterator, List, Optional
+
+from botocore.client import BaseClient
+
+from record_format import compressor, iter_lines, jsonl_key
+
+logger = logging.getLogger()
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# Uncompressed bytes per output object before rolling over to the next one
+DEFAULT_MAX_PART_BYTES = 16 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_s3_lines(
+    body: Any,
+    chunk_size: int = READ_CHUNK_SIZE,
+    compression: Optional[str] = None
+) -> Iterator[str]:
+    """Yield decoded lines from an S3 StreamingBody as the bytes arrive"""
+    return iter_lines(body.iter_chunks(chunk_size), compression)
+
+
+class S3MultipartWriter:
+    """Buffered S3 writer that uploads fixed-size multipart parts as it goes.
+
+    Memory use is bounded by ``part_size`` regardless of the total output size.
+    Outputs that never fill a single part are written with one ``put_object``.
+    Used as a context manager, the upload is aborted if the block raises.
+    With ``compression`` ('gzip' or 'zstd') records are compressed as they
+    are written, so parts hold compressed bytes.
+    """
+
+    def __init__(
+        self,
+        client: BaseClient,
+        bucket: str,
+        key: str,
+        content_type: str = 'application/jsonl',
+        part_size: int = DEFAULT_PART_SIZE,
+        compression: Optional[str] = None
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.compression = compression
+        self.bytes_written = 0
+        self.bytes_stored = 0
+        self._compressor = compressor(compression)
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[dict] = []
+        self._closed = False
+
+    def __enter__(self) -> 'S3MultipartWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, data: bytes) -> None:
+        """Append bytes, flushing a part whenever the buffer is full"""
+        self.bytes_written += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer_bytes(data)
+
+    def _buffer_bytes(self, data: bytes) -> None:
+        self._buffer.extend(data)
+        self.bytes_stored += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(part)
+
+    def write_line(self, line: str) -> None:
+        """Append a single JSONL record"""
+        self.write(line.encode('utf-8') + b'\n')
+
+    def _object_args(self) -> dict:
+        # No ContentEncoding: readers pick the codec from the key suffix and
+        # must get the compressed bytes back untouched
+        return {'Bucket': self.bucket, 'Key': self.key, 'ContentType': self.content_type}
+
+    def _upload_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(**self._object_args())
+            self._upload_id = response['UploadId']
+            logger.info(f"Started multipart upload for s3://{self.bucket}/{self.key}")
+
+        part_number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self) -> None:
+        """Flush remaining bytes and finalize the object"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._compressor is not None:
+            self._buffer_bytes(self._compressor.flush())
+
+        if self._upload_id is None:
+            # Everything fit in one part, skip the multipart round trips
+            self.client.put_object(Body=bytes(self._buffer), **self._object_args())
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts}
+            )
+            logger.info(
+                f"Completed multipart upload of {len(self._parts)} parts "
+                f"to s3://{self.bucket}/{self.key}"
+            )
+        self._buffer = bytearray()
+
+    def abort(self) -> None:
+        """Discard buffered data and abort any in-progress multipart upload"""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id
+                )
+            except Exception as e:
+                logger.warning(f"Failed to abort multipart upload: {str(e)}")
+
+
+class RollingJsonlWriter:
+    """JSONL writer that rolls over to a new object every ``max_part_bytes``.
+
+    Parts are named ``{stem}{n:05d}`` plus the suffix of the compression and
+    each is written by its own ``S3MultipartWriter``, so every part is a
+    complete object as soon as it closes. ``max_part_bytes`` counts the
+    uncompressed records, bounding the work each part hands downstream; a
+    single record larger than that still gets a part of its own. Aborting
+    deletes the parts that already closed, so a failed run leaves no output
+    behind for vectorization.
+    """
+
+    def __init__(
+        self,
+        client: BaseClient,
+        bucket: str,
+        stem: str,
+        max_part_bytes: int = DEFAULT_MAX_PART_BYTES,
+        compression: Optional[str] = None,
+        part_size: int = DEFAULT_PART_SIZE
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.stem = stem
+        self.max_part_bytes = max(1, max_part_bytes)
+        self.compression = compression
+        self.part_size = part_size
+        self.parts: List[dict] = []
+        self._writer: Optional[S3MultipartWriter] = None
+        self._records = 0
+
+    def __enter__(self) -> 'RollingJsonlWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write_line(self, line: str) -> None:
+        data = line.encode('utf-8') + b'\n'
+        if self._writer is not None and self._writer.bytes_written + len(data) > self.max_part_bytes:
+            self._finish_part()
+        if self._writer is None:
+            key = jsonl_key(f"{self.stem}{len(self.parts):05d}", self.compression)
+            self._writer = S3MultipartWriter(
+                self.client, self.bucket, key, part_size=self.part_size, compression=self.compression
+            )
+        self._writer.write(data)
+        self._records += 1
+
+    def _finish_part(self) -> None:
+        writer, self._writer = self._writer, None
+        writer.close()
+        self.parts.append({
+            'key': writer.key,
+            'records': self._records,
+            'bytes': writer.bytes_written,
+            'stored_bytes': writer.bytes_stored,
+        })
+        self._records = 0
+
+    def close(self) -> None:
+        """Finish the part in progress"""
+        if self._writer is not None:
+            self._finish_part()
+
+    def abort(self) -> None:
+        """Discard the part in progress and delete the parts already finished"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+            self._records = 0
+        for part in self.parts:
+            try:
+                self.client.delete_object(Bucket=self.bucket, Key=part['key'])
+            except Exception as e:
+                logger.warning(f"Failed to delete part {part['key']}: {str(e)}")
+        self.parts = []
@@ -0,0 +1,41 @@
+"""AWS clients kept at module scope so warm invocations reuse them.
+
+Creating a boto3 client loads and parses its service model, which costs
+tens of milliseconds per client; clients are thread-safe, so one per
+service and configuration is enough for the lifetime of the process.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+
+_clients: Dict[Tuple[str, Optional[int]], BaseClient] = {}
+_lock = threading.Lock()
+_cold_start = True
+
+
+def get_client(service: str, config: Optional[Config] = None) -> BaseClient:
+    """Return the process-wide client for a service and configuration.
+
+    Clients are keyed on the identity of ``config``, so callers should pass
+    a module-level ``Config`` rather than building one per call.
+    """
+    key = (service, id(config) if config is not None else None)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                kwargs = {'config': config} if config is not None else {}
+                client = boto3.client(service, **kwargs)
+                _clients[key] = client
+    return client
+
+
+def is_cold_start() -> bool:
+    """True only for the first invocation handled by this process"""
+    global _cold_start
+    cold, _cold_start = _cold_start, False
+    return cold
@@ -0,0 +1,153 @@
+"""Per-stage timings and counts, emitted once per invocation as CloudWatch EMF.
+
+Stages are timed into a process-wide recorder and written to stdout as
+Embedded Metric Format documents when the handler returns, so CloudWatch
+turns one log line per invocation into metrics without any API calls.
+Every duration is sent as a metric value, so CloudWatch can compute
+percentiles; a summary with counts and p50/p90/p99 is included in the
+same document for Logs Insights.
+"""
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+DEFAULT_NAMESPACE = 'LoreChat/Ingestion'
+# CloudWatch accepts at most 100 values per metric in one EMF document
+MAX_VALUES_PER_DOCUMENT = 100
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class StageMetrics:
+    """Thread-safe recorder of stage durations (in milliseconds) and counts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations: Dict[str, List[float]] = {}
+        self._counts: Counter = Counter()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds * 1000)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += value
+
+    def drain(self) -> Dict[str, Any]:
+        """Return everything recorded so far and start again from empty"""
+        with self._lock:
+            snapshot = {'durations': self._durations, 'counts': dict(self._counts)}
+            self._durations, self._counts = {}, Counter()
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add a snapshot drained from another recorder, e.g. in a worker process"""
+        with self._lock:
+            for stage, durations in snapshot['durations'].items():
+                self._durations.setdefault(stage, []).extend(durations)
+            self._counts.update(snapshot['counts'])
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+        return {
+            stage: {
+                'count': len(values),
+                'p50': round(_percentile(values, 50), 2),
+                'p90': round(_percentile(values, 90), 2),
+                'p99': round(_percentile(values, 99), 2),
+                'max': round(values[-1], 2),
+                'total': round(sum(values), 1),
+            }
+            for stage, values in durations.items()
+        }
+
+    def emit(self, dimensions: Dict[str, str], namespace: Optional[str] = None) -> None:
+        """Print the recorded metrics as EMF documents and reset the recorder"""
+        summary = self.summary()
+        snapshot = self.drain()
+        durations, counts = snapshot['durations'], snapshot['counts']
+        if not durations and not counts:
+            return
+
+        namespace = namespace or os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+        longest = max((len(values) for values in durations.values()), default=0)
+        # The first document carries the counts and summary; later ones only
+        # the durations that did not fit
+        for offset in range(0, max(longest, 1), MAX_VALUES_PER_DOCUMENT):
+            metrics = [
+                {'Name': stage, 'Unit': 'Milliseconds'}
+                for stage, values in durations.items() if len(values) > offset
+            ]
+            document = {
+                **dimensions,
+                **{
+                    stage: [round(v, 3) for v in values[offset:offset + MAX_VALUES_PER_DOCUMENT]]
+                    for stage, values in durations.items() if len(values) > offset
+                },
+            }
+            if offset == 0:
+                metrics.extend({'Name': name, 'Unit': 'Count'} for name in counts)
+                document.update(counts)
+                document['stages'] = summary
+            document['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [sorted(dimensions)],
+                    'Metrics': metrics,
+                }],
+            }
+            print(json.dumps(document))
+
+
+_metrics = StageMetrics()
+
+
+def get_metrics() -> StageMetrics:
+    """The process-wide recorder"""
+    return _metrics
+
+
+def metric_scope(handler: Callable[[Dict[str, Any], Any], Any]) -> Callable[[Dict[str, Any], Any], Any]:
+    """Emit the metrics recorded during each invocation of a Lambda handler"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Any:
+        _metrics.drain()
+        try:
+            return handler(event, context)
+        finally:
+            name = getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+            _metrics.emit({'FunctionName': name})
+    return wrapper
+
+
+_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+
+
+def log_sampled(logger: logging.Logger, message: str, *args: Any) -> None:
+    """Debug log for a sampled share (LOG_SAMPLE_RATE) of per-item events.
+
+    Arguments are only formatted when the line is actually written, so the
+    call costs next to nothing in hot loops.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < _sample_rate:
+        logger.debug(message, *args)
@@ -0,0 +1,85 @@
+"""Compressed JSONL for the objects passed between the pipeline stages.
+
+The format of an object follows from its key: ``.jsonl`` is plain,
+``.jsonl.gz`` gzip and ``.jsonl.zst`` zstandard. Writers compress as
+records arrive and readers decompress as bytes arrive, so neither side
+holds a whole object in memory.
+"""
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+SUFFIXES = {
+    None: '.jsonl',
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst',
+}
+# gzip header and trailer around the deflate stream
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def compression_for_key(key: str) -> Optional[str]:
+    """Compression of a JSONL object from its key suffix"""
+    for compression, suffix in SUFFIXES.items():
+        if compression is not None and key.endswith(suffix):
+            return compression
+    if key.endswith('.jsonl'):
+        return None
+    raise ValueError(f"Not a JSONL object: {key}")
+
+
+def is_jsonl_key(key: str) -> bool:
+    return any(key.endswith(suffix) for suffix in SUFFIXES.values())
+
+
+def parse_compression(value: Optional[str]) -> Optional[str]:
+    """Normalize an OUTPUT_COMPRESSION setting ('none', 'gzip' or 'zstd')"""
+    value = (value or 'none').strip().lower()
+    if value in ('', 'none', 'off'):
+        return None
+    if value not in SUFFIXES:
+        raise ValueError(f"Unsupported compression: {value}")
+    return value
+
+
+def jsonl_key(stem: str, compression: Optional[str]) -> str:
+    """Key for a JSONL object with the suffix of its compression"""
+    return f"{stem}{SUFFIXES[compression]}"
+
+
+def compressor(compression: Optional[str], level: Optional[int] = None) -> Any:
+    """Streaming compressor with ``compress(data)`` and ``flush()``, or None"""
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, _GZIP_WBITS)
+    import zstandard
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+
+
+def decompressor(compression: Optional[str]) -> Any:
+    """Streaming decompressor with ``decompress(data)``, or None"""
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return zlib.decompressobj(_GZIP_WBITS)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def iter_lines(chunks: Iterable[bytes], compression: Optional[str] = None) -> Iterator[str]:
+    """Yield the decoded lines of a byte stream, decompressing on the way.
+
+    Blank lines are yielded too, so line numbers match the object's records.
+    """
+    decoder = decompressor(compression)
+    pending = b''
+    for chunk in chunks:
+        if decoder is not None:
+            chunk = decoder.decompress(chunk)
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+    if pending:
+        yield pending.decode('utf-8')
@@ -0,0 +1,122 @@
+"""S3 object notifications, delivered directly or through an SQS queue.
+
+A direct S3 notification can hold several records, and an SQS batch holds
+several messages, each an S3 notification of its own. Both are flattened
+to the distinct objects they name, which are handled concurrently. With
+SQS the result is a partial batch response: only messages whose objects
+failed are listed in ``batchItemFailures`` and redelivered, which needs
+ReportBatchItemFailures on the event source mapping.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote_plus
+
+logger = logging.getLogger()
+
+
+class S3Object(NamedTuple):
+    """An object named by a notification, and where it came from"""
+    bucket: str
+    key: str
+    size: int
+    # Position among the event's distinct objects
+    position: int
+    # SQS messages that named it; empty for direct notifications
+    message_ids: Tuple[str, ...] = ()
+
+
+def is_sqs_event(event: Dict[str, Any]) -> bool:
+    records = event.get('Records') or []
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+
+def s3_objects(event: Dict[str, Any]) -> Tuple[List[S3Object], List[str]]:
+    """Distinct objects of an event, and the IDs of SQS messages that could not be read.
+
+    Keys arrive URL-encoded and are decoded here. An object named more than
+    once, as a burst of overwrites does, is handled once.
+    """
+    found: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    unreadable = []
+
+    def add(record: Dict[str, Any], message_id: Optional[str] = None) -> None:
+        s3 = record['s3']
+        bucket, key = s3['bucket']['name'], unquote_plus(s3['object']['key'])
+        entry = found.setdefault((bucket, key), {'size': 0, 'message_ids': []})
+        entry['size'] = s3['object'].get('size', 0)
+        if message_id is not None and message_id not in entry['message_ids']:
+            entry['message_ids'].append(message_id)
+
+    for record in event.get('Records') or []:
+        if record.get('eventSource') != 'aws:sqs':
+            if 's3' in record:
+                add(record)
+            continue
+        try:
+            # The s3:TestEvent sent when a notification is set up has no records
+            for inner in json.loads(record['body']).get('Records') or []:
+                add(inner, record['messageId'])
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            logger.error(f"Unreadable message {record.get('messageId')}: {str(error)}")
+            unreadable.append(record['messageId'])
+
+    objects = [
+        S3Object(bucket, key, entry['size'], position, tuple(entry['message_ids']))
+        for position, ((bucket, key), entry) in enumerate(found.items())
+    ]
+    return objects, unreadable
+
+
+def _failed(response: Dict[str, Any]) -> bool:
+    return response.get('statusCode', 500) >= 500
+
+
+def handle_objects(
+    event: Dict[str, Any],
+    handle: Callable[[S3Object], Dict[str, Any]],
+    max_workers: int = 1
+) -> Dict[str, Any]:
+    """Run ``handle`` on every object of an S3 or SQS event, concurrently.
+
+    ``handle`` returns a Lambda response; a status of 500 or more, or an
+    exception, counts as a failure. SQS events get a partial batch
+    response. A direct notification of one object gets that object's
+    response, and of several a summary of all of them.
+    """
+    objects, unreadable = s3_objects(event)
+
+    def run(obj: S3Object) -> Dict[str, Any]:
+        try:
+            return handle(obj)
+        except Exception as error:
+            logger.error(f"Error handling s3://{obj.bucket}/{obj.key}: {str(error)}")
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'message': f"Error handling {obj.key}", 'error': str(error)})
+            }
+
+    if len(objects) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(objects))) as pool:
+            responses = list(pool.map(run, objects))
+    else:
+        responses = [run(obj) for obj in objects]
+    failed = [obj for obj, response in zip(objects, responses) if _failed(response)]
+    logger.info(f"Handled {len(objects)} objects, {len(failed)} failed")
+
+    if is_sqs_event(event):
+        failed_ids = list(dict.fromkeys(unreadable + [i for obj in failed for i in obj.message_ids]))
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_ids]}
+    if len(responses) == 1:
+        return responses[0]
+    return {
+        'statusCode': max((response.get('statusCode', 500) for response in responses), default=200),
+        'body': json.dumps({
+            'message': f"Handled {len(objects)} objects, {len(failed)} failed",
+            'results': [
+                {'bucket': obj.bucket, 'key': obj.key, 'statusCode': response.get('statusCode', 500)}
+                for obj, response in zip(objects, responses)
+            ]
+        })
+    }
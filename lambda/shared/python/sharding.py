@@ -0,0 +1,215 @@
+"""Split large JSONL inputs into byte-range shards and merge their reports.
+
+Shards are planned from the object size alone. A shard owns every line
+that starts inside its byte range, so workers can read their range
+independently without a pass over the file to find line boundaries.
+The same plan runs either as one Lambda invocation per shard or
+in-process on a process pool for local runs.
+"""
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from botocore.client import BaseClient
+from pydantic import BaseModel
+
+logger = logging.getLogger()
+
+SHARD_KEY = 'shard'
+REPORT_NAME = 'report.json'
+READ_CHUNK_SIZE = 64 * 1024
+
+# Opens a stream of raw bytes starting at the given offset
+ChunkReader = Callable[[int], Iterable[bytes]]
+
+
+class Shard(BaseModel):
+    """Byte range of an input object handled by one worker"""
+    run_id: str
+    bucket: str
+    key: str
+    etag: str = ''
+    index: int
+    count: int
+    start: int
+    end: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.index:05d}-of-{self.count:05d}"
+
+
+def plan_shards(
+    run_id: str,
+    bucket: str,
+    key: str,
+    size: int,
+    shard_bytes: int,
+    max_shards: int = 1000,
+    etag: str = ''
+) -> List[Shard]:
+    """Cut ``size`` bytes into contiguous ranges of roughly ``shard_bytes``"""
+    count = max(1, min(max_shards, -(-size // max(shard_bytes, 1))))
+    step = -(-size // count)
+    return [
+        Shard(
+            run_id=run_id, bucket=bucket, key=key, etag=etag,
+            index=i, count=count, start=i * step, end=min(size, (i + 1) * step)
+        )
+        for i in range(count)
+    ]
+
+
+def iter_shard_lines(read_from: ChunkReader, start: int, end: int) -> Iterator[str]:
+    """Yield the lines that start within ``[start, end)``.
+
+    Reading begins one byte early: everything up to the first newline
+    belongs to the previous shard, which also covers a line starting
+    exactly at ``start``. The last line is read past ``end`` to its newline.
+    """
+    offset = max(start - 1, 0)
+    skipping = start > 0
+    pending = b''
+    for chunk in read_from(offset):
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            line_start = offset
+            offset += len(line) + 1
+            if skipping:
+                skipping = False
+                continue
+            if line_start >= end:
+                return
+            if line:
+                yield line.decode('utf-8')
+    if pending and not skipping and offset < end:
+        yield pending.decode('utf-8')
+
+
+def s3_chunk_reader(
+    client: BaseClient,
+    bucket: str,
+    key: str,
+    etag: str = '',
+    chunk_size: int = READ_CHUNK_SIZE
+) -> ChunkReader:
+    """Ranged, streaming reads of one version of an S3 object"""
+    def read_from(offset: int) -> Iterator[bytes]:
+        params = {'Bucket': bucket, 'Key': key, 'Range': f"bytes={offset}-"}
+        if etag:
+            # Fail rather than mix lines from two versions of the object
+            params['IfMatch'] = etag
+        body = client.get_object(**params)['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+    return read_from
+
+
+def file_chunk_reader(path: str, chunk_size: int = READ_CHUNK_SIZE) -> ChunkReader:
+    """Streaming reads of a local file, for in-process runs"""
+    def read_from(offset: int) -> Iterator[bytes]:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    return read_from
+
+
+def dispatch_shards(lambda_client: BaseClient, function_arn: str, shards: List[Shard]) -> None:
+    """Start one asynchronous invocation per shard"""
+    for shard in shards:
+        lambda_client.invoke(
+            FunctionName=function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({SHARD_KEY: shard.model_dump()}).encode('utf-8')
+        )
+    logger.info(f"Dispatched {len(shards)} shards to {function_arn}")
+
+
+def merge_reports(reports: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge worker reports: numbers add up, lists concatenate, dicts merge"""
+    merged: Dict[str, Any] = {}
+    for report in reports:
+        for key, value in report.items():
+            current = merged.get(key)
+            if isinstance(value, bool) or value is None:
+                merged[key] = value if current is None else current
+            elif isinstance(value, (int, float)):
+                merged[key] = (current or 0) + value
+            elif isinstance(value, list):
+                merged[key] = (current or []) + value
+            elif isinstance(value, dict):
+                merged[key] = merge_reports([current or {}, value])
+            elif current is None:
+                merged[key] = value
+    return merged
+
+
+class ShardReportStore:
+    """Per-shard reports under ``prefix/run_id/``; the last shard merges them"""
+
+    def __init__(self, client: BaseClient, bucket: str, prefix: str = 'shard-reports'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _run_prefix(self, run_id: str) -> str:
+        return f"{self.prefix}/{run_id}/"
+
+    def save(self, shard: Shard, report: Dict[str, Any]) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self._run_prefix(shard.run_id)}{shard.name}.json",
+            Body=json.dumps(report).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def collect(self, shard: Shard) -> Optional[List[Dict[str, Any]]]:
+        """Return every shard report of the run once all have been saved"""
+        prefix = self._run_prefix(shard.run_id)
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(
+                obj['Key'] for obj in page.get('Contents', [])
+                if not obj['Key'].endswith(REPORT_NAME)
+            )
+        if len(keys) < shard.count:
+            return None
+        return [
+            json.loads(self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+            for key in sorted(keys)
+        ]
+
+    def save_merged(self, run_id: str, report: Dict[str, Any]) -> str:
+        key = f"{self._run_prefix(run_id)}{REPORT_NAME}"
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=json.dumps(report).encode('utf-8'),
+            ContentType='application/json'
+        )
+        return key
+
+
+def run_shards_locally(
+    worker: Callable[[Shard], Dict[str, Any]],
+    shards: List[Shard],
+    processes: int = 1
+) -> Dict[str, Any]:
+    """Run every shard in a process pool and merge their reports.
+
+    ``worker`` must be a module-level function so it can be pickled.
+    """
+    if processes <= 1:
+        return merge_reports(worker(shard) for shard in shards)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return merge_reports(executor.map(worker, shards))
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+from pydantic import BaseModel
+
+logger = logging.getLogger()
+
+CONTINUATION_KEY = 'continuation'
+
+
+class Checkpoint(BaseModel):
+    """Progress through one input file, carried across invocations"""
+    source_bucket: str
+    source_key: str
+    etag: str
+    next_line: int = 0
+    invocations: int = 0
+    successful: int = 0
+    failed: List[Dict[str, str]] = []
+    unchanged: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+class CheckpointStore:
+    """Checkpoints kept as small JSON objects under a prefix of an S3 bucket.
+
+    A checkpoint is only valid for the object version it was taken from, so
+    a re-uploaded file starts again from the first line.
+    """
+
+    def __init__(self, client: BaseClient, bucket: str, prefix: str = 'checkpoints'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _key(self, source_bucket: str, source_key: str) -> str:
+        digest = hashlib.sha256(f"{source_bucket}/{source_key}".encode('utf-8')).hexdigest()
+        return f"{self.prefix}/{digest}.json"
+
+    def load(self, source_bucket: str, source_key: str, etag: str) -> Optional[Checkpoint]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self._key(source_bucket, source_key)
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        checkpoint = Checkpoint.model_validate_json(response['Body'].read())
+        if checkpoint.etag != etag:
+            logger.info(f"Ignoring checkpoint for a previous version of {source_key}")
+            return None
+        return checkpoint
+
+    def save(self, checkpoint: Checkpoint) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(checkpoint.source_bucket, checkpoint.source_key),
+            Body=checkpoint.model_dump_json().encode('utf-8'),
+            ContentType='application/json'
+        )
+        logger.info(
+            f"Saved checkpoint for {checkpoint.source_key} at line {checkpoint.next_line}"
+        )
+
+    def delete(self, source_bucket: str, source_key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(source_bucket, source_key))
+
+
+def continuation_event(
+    source_bucket: str,
+    source_key: str,
+    shard: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Event a handler sends itself to carry on from the stored checkpoint"""
+    continuation = {'bucket': source_bucket, 'key': source_key}
+    if shard is not None:
+        continuation['shard'] = shard
+    return {CONTINUATION_KEY: continuation}
+
+
+def invoke_continuation(
+    lambda_client: BaseClient,
+    function_arn: str,
+    source_bucket: str,
+    source_key: str,
+    shard: Optional[Dict[str, Any]] = None
+) -> None:
+    lambda_client.invoke(
+        FunctionName=function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(continuation_event(source_bucket, source_key, shard)).encode('utf-8')
+    )
+    logger.info(f"Re-invoked {function_arn} to continue {source_key}")
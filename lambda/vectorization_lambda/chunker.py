@@ -0,0 +1,265 @@
+"""Token-aware markdown chunking for embedding.
+
+Chunks are sized in tokens rather than characters, break preferentially at
+markdown headings, and start with the heading path they sit under, so a
+chunk from deep in a page still says what it is about. Each chunk records
+its character span in the source markdown.
+"""
+import os
+import re
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_ENCODING = 'cl100k_base'
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 64
+PATH_SEPARATOR = ' > '
+# Share of a chunk's tokens the heading path may take before it is cut short
+PREFIX_MAX_SHARE = 0.25
+
+_HEADING = re.compile(r'^(#{1,6})[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+_BLOCK_BREAK = re.compile(r'\n[ \t]*\n')
+# Finer split points for blocks that do not fit, tried in order
+_SPLIT_PATTERNS = [re.compile(r'\n'), re.compile(r'(?<=[.!?])[ \t]+'), re.compile(r'[ \t]+')]
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+class Chunk(NamedTuple):
+    """A chunk of a page: embedding text, heading path and source span"""
+    text: str
+    heading_path: Tuple[str, ...]
+    start: int
+    end: int
+
+
+def get_encoding() -> Any:
+    """The process-wide tiktoken encoding, loaded on first use.
+
+    Set TIKTOKEN_CACHE_DIR to a bundled cache so loading does not need
+    network access.
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(os.environ.get('TIKTOKEN_ENCODING', DEFAULT_ENCODING))
+    return _encoding
+
+
+class _Block(NamedTuple):
+    start: int
+    end: int
+    tokens: int
+    heading_path: Tuple[str, ...]
+    is_heading: bool
+
+
+class MarkdownChunker:
+    """Greedy packer of markdown blocks into token-bounded chunks.
+
+    Blocks are paragraphs and headings. A heading closes the current chunk
+    once it is at least half full, so sections stay together without
+    producing tiny chunks for short ones. Blocks larger than a chunk are
+    split at lines, then sentences, then words. Consecutive chunks share up
+    to ``overlap_tokens`` of trailing blocks.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = CHUNK_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        encoding: Any = None
+    ):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = encoding
+        self._prefix_cache: Dict[Tuple[str, ...], Tuple[str, int]] = {}
+        self._separator_tokens: Optional[int] = None
+
+    def _encode(self, text: str) -> List[int]:
+        return (self.encoding or get_encoding()).encode_ordinary(text)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._encode(text))
+
+    def _prefix(self, heading_path: Tuple[str, ...]) -> Tuple[str, int]:
+        """The heading path line a chunk opens with, and its token count.
+
+        A path over ``PREFIX_MAX_SHARE`` of ``max_tokens``, from a long title
+        or heading, is cut short so the text under it still fits.
+        """
+        cached = self._prefix_cache.get(heading_path)
+        if cached is None:
+            if len(self._prefix_cache) > 4096:
+                self._prefix_cache.clear()
+            path = PATH_SEPARATOR.join(heading_path)
+            tokens = self._encode(path)
+            limit = max(1, int(self.max_tokens * PREFIX_MAX_SHARE))
+            if len(tokens) > limit:
+                encoding = self.encoding or get_encoding()
+                path = encoding.decode_bytes(tokens[:limit]).decode('utf-8', 'ignore').rstrip()
+            prefix = f"{path}\n\n" if path else ''
+            cached = self._prefix_cache[heading_path] = (prefix, self.count_tokens(prefix))
+        return cached
+
+    def _blocks(self, text: str, title: Optional[str]) -> List[_Block]:
+        root = (title.strip(),) if title and title.strip() else ()
+        path: List[Tuple[int, str]] = []
+        blocks = []
+        position = 0
+        for match in [*_BLOCK_BREAK.finditer(text), None]:
+            end = match.start() if match else len(text)
+            start, stop = position, end
+            # Trim surrounding whitespace so spans cover the content only
+            while start < stop and text[start].isspace():
+                start += 1
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+            position = match.end() if match else len(text)
+            if start == stop:
+                continue
+
+            single_line = text.startswith('#', start) and text.find('\n', start, stop) < 0
+            heading = _HEADING.match(text, start, stop) if single_line else None
+            if heading:
+                level = len(heading.group(1))
+                path = [(lvl, name) for lvl, name in path if lvl < level]
+                path.append((level, heading.group(2).strip()))
+            heading_path = root + tuple(name for _, name in path if not root or name != root[0])
+            blocks.extend(self._fit(text, start, stop, heading_path, bool(heading)))
+        return blocks
+
+    def _fit(
+        self,
+        text: str,
+        start: int,
+        end: int,
+        heading_path: Tuple[str, ...],
+        is_heading: bool
+    ) -> List[_Block]:
+        """Return the span as one block, or split it until every piece fits.
+
+        The span is encoded once, and split points are chosen from its token
+        offsets; only the resulting pieces are counted again, since a piece
+        can encode slightly differently on its own.
+        """
+        budget = max(1, self.max_tokens - self._prefix(heading_path)[1])
+        tokens = self._encode(text[start:end])
+        if len(tokens) <= budget:
+            return [_Block(start, end, len(tokens), heading_path, is_heading)]
+
+        encoding = self.encoding or get_encoding()
+        starts = [start + offset for offset in encoding.decode_with_offsets(tokens)[1]]
+        blocks = []
+        for piece_start, piece_end in self._split(text, start, end, starts, budget):
+            piece_tokens = self.count_tokens(text[piece_start:piece_end])
+            if piece_tokens <= budget or piece_end - piece_start <= 1:
+                blocks.append(_Block(piece_start, piece_end, piece_tokens, heading_path, False))
+            else:
+                blocks.extend(self._fit(text, piece_start, piece_end, heading_path, False))
+        return blocks
+
+    def _split(
+        self,
+        text: str,
+        start: int,
+        end: int,
+        starts: List[int],
+        budget: int,
+        level: int = 0
+    ) -> List[Tuple[int, int]]:
+        """Spans of at most ``budget`` tokens, counted from token start offsets"""
+        def count(span_start: int, span_end: int) -> int:
+            return bisect_left(starts, span_end) - bisect_left(starts, span_start)
+
+        if count(start, end) <= budget:
+            return [(start, end)]
+
+        if level >= len(_SPLIT_PATTERNS):
+            # No separators left: cut every ``budget`` tokens
+            first, last = bisect_left(starts, start), bisect_left(starts, end)
+            cuts = sorted({start, end, *(starts[i] for i in range(first + budget, last, budget))})
+            return list(zip(cuts, cuts[1:]))
+
+        pieces = []
+        piece_start = start
+        for match in _SPLIT_PATTERNS[level].finditer(text, start, end):
+            if match.start() > piece_start:
+                pieces.append((piece_start, match.start()))
+            piece_start = match.end()
+        if piece_start < end:
+            pieces.append((piece_start, end))
+        if len(pieces) <= 1:
+            return self._split(text, start, end, starts, budget, level + 1)
+
+        # Re-join adjacent pieces greedily so splits stay as coarse as possible
+        spans = []
+        group_start, group_end = pieces[0]
+        for piece_start, piece_end in pieces[1:]:
+            if count(group_start, piece_end) <= budget:
+                group_end = piece_end
+                continue
+            spans.extend(self._split(text, group_start, group_end, starts, budget, level + 1))
+            group_start, group_end = piece_start, piece_end
+        spans.extend(self._split(text, group_start, group_end, starts, budget, level + 1))
+        return spans
+
+    def _emit(self, text: str, blocks: List[_Block]) -> Chunk:
+        heading_path = blocks[0].heading_path
+        start, end = blocks[0].start, blocks[-1].end
+        # A chunk opening with its own heading only needs the path above it
+        prefix = self._prefix(heading_path[:-1] if blocks[0].is_heading else heading_path)[0]
+        return Chunk(f"{prefix}{text[start:end]}", heading_path, start, end)
+
+    def split(self, text: str, title: Optional[str] = None) -> List[Chunk]:
+        """Split markdown into chunks of at most ``max_tokens`` tokens"""
+        if self._separator_tokens is None:
+            # Blocks are joined by blank lines, which cost tokens of their own
+            self._separator_tokens = self.count_tokens('\n\n')
+        blocks = [
+            block._replace(tokens=block.tokens + self._separator_tokens)
+            for block in self._blocks(text, title)
+        ]
+        chunks: List[Chunk] = []
+        current: List[_Block] = []
+        used = 0
+        fresh = 0
+
+        for block in blocks:
+            prefix_tokens = self._prefix(current[0].heading_path)[1] if current else 0
+            full = current and prefix_tokens + used + block.tokens > self.max_tokens
+            section_break = current and block.is_heading and used * 2 >= self.max_tokens
+            if full or section_break:
+                # A heading left at the end belongs with the text that follows it
+                held = current.pop() if len(current) > 1 and current[-1].is_heading else None
+                if held and self._prefix(held.heading_path)[1] + held.tokens + block.tokens > self.max_tokens:
+                    current.append(held)
+                    held = None
+                chunks.append(self._emit(text, current))
+                # Carry trailing blocks forward as overlap, never across a heading
+                carried: List[_Block] = [held] if held else []
+                if not held and not block.is_heading:
+                    carried_tokens = 0
+                    for previous in reversed(current):
+                        if previous.is_heading or carried_tokens + previous.tokens > self.overlap_tokens:
+                            break
+                        carried.insert(0, previous)
+                        carried_tokens += previous.tokens
+                current = carried
+                used = sum(b.tokens for b in carried)
+                fresh = 0
+                if current:
+                    prefix_tokens = self._prefix(current[0].heading_path)[1]
+                    if prefix_tokens + used + block.tokens > self.max_tokens:
+                        current, used = [], 0
+            current.append(block)
+            used += block.tokens
+            fresh += 1
+
+        if current and fresh:
+            chunks.append(self._emit(text, current))
+        return chunks
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+DEFAULT_MEMORY_ENTRIES = 10000
+
+
+def _pack(embedding: List[float]) -> bytes:
+    return array('f', embedding).tobytes()
+
+
+def _unpack(data: bytes) -> List[float]:
+    values = array('f')
+    values.frombytes(data)
+    return values.tolist()
+
+
+def new_stats() -> Dict[str, int]:
+    """Empty lookup counts, for one caller's share of a shared cache"""
+    return {'memory_hits': 0, 'durable_hits': 0, 'misses': 0}
+
+
+class EmbeddingStore(ABC):
+    """Durable tier of the embedding cache, holding packed float32 vectors"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the packed embedding for a key, or None on a miss"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        """Store a packed embedding"""
+
+
+class S3EmbeddingStore(EmbeddingStore):
+    """One small object per embedding under a prefix of an S3 bucket"""
+
+    def __init__(self, client: BaseClient, bucket: str, prefix: str = 'embeddings'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key[:2]}/{key}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=data,
+            ContentType='application/octet-stream'
+        )
+
+
+class LocalEmbeddingStore(EmbeddingStore):
+    """Embeddings kept as files in a local directory, for tests and local runs"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = os.path.join(self.directory, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.directory, key)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache keyed on (model, dimensions, text hash).
+
+    A bounded in-memory LRU tier lives as long as the process, so it carries
+    over between warm Lambda invocations; misses fall through to the durable
+    store. Entries are kept as packed float32 to keep the memory tier small.
+    Thread-safe, since embeddings are generated from a worker pool.
+
+    ``stats`` counts every lookup since the cache was created. Callers
+    sharing the cache, such as objects vectorized concurrently, pass their
+    own counts to ``get`` and ``report`` to see only their lookups.
+    """
+
+    def __init__(
+        self,
+        store: Optional[EmbeddingStore] = None,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES
+    ):
+        self.store = store
+        self.max_memory_entries = max_memory_entries
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = new_stats()
+
+    @staticmethod
+    def key(model_id: str, dimensions: int, text: str) -> str:
+        return hashlib.sha256(f"{model_id}\0{dimensions}\0{text}".encode('utf-8')).hexdigest()
+
+    def _count(self, outcome: str, stats: Optional[Dict[str, int]]) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+            if stats is not None:
+                stats[outcome] += 1
+
+    def _remember(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(
+        self,
+        model_id: str,
+        dimensions: int,
+        text: str,
+        stats: Optional[Dict[str, int]] = None
+    ) -> Optional[List[float]]:
+        """Look up an embedding, checking memory first and then the durable store"""
+        key = self.key(model_id, dimensions, text)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            self._count('memory_hits', stats)
+            return _unpack(data)
+
+        data = None
+        if self.store is not None:
+            try:
+                data = self.store.get(key)
+            except Exception as e:
+                logger.warning(f"Embedding cache read failed: {str(e)}")
+
+        self._count('durable_hits' if data is not None else 'misses', stats)
+        if data is None:
+            return None
+
+        self._remember(key, data)
+        return _unpack(data)
+
+    def put(self, model_id: str, dimensions: int, text: str, embedding: List[float]) -> None:
+        """Store a freshly generated embedding in both tiers"""
+        key = self.key(model_id, dimensions, text)
+        data = _pack(embedding)
+        self._remember(key, data)
+        if self.store is not None:
+            try:
+                self.store.put(key, data)
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {str(e)}")
+
+    def report(self, stats: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+        """Hit rate and avoided Bedrock calls of the lookups in ``stats``, or of all of them"""
+        with self._lock:
+            stats = dict(stats if stats is not None else self.stats)
+        lookups = sum(stats.values())
+        hits = stats['memory_hits'] + stats['durable_hits']
+        return {
+            **stats,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'avoided_bedrock_calls': hits,
+        }
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from embedding_cache import EmbeddingCache, new_stats
+from metrics import get_metrics
+
+logger = logging.getLogger()
+metrics = get_metrics()
+
+# Bedrock is over quota: back off and shrink the concurrency limit
+THROTTLING_ERROR_CODES = frozenset({
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+})
+
+# Transient service-side errors worth retrying without changing the limit
+RETRYABLE_ERROR_CODES = frozenset({
+    'ServiceUnavailableException',
+    'InternalServerException',
+    'ModelTimeoutException',
+    'ModelNotReadyException',
+})
+
+
+def _error_code(error: Exception) -> Optional[str]:
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return _error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    code = _error_code(error)
+    return code in THROTTLING_ERROR_CODES or code in RETRYABLE_ERROR_CODES
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on concurrent Bedrock calls.
+
+    Each healthy response adds ``1 / limit``, i.e. roughly one extra slot per
+    round of calls. A throttle multiplies the limit by ``decrease_factor``, at
+    most once per typical call latency so a burst of throttles from requests
+    already in flight counts as a single congestion signal. Responses slower
+    than ``latency_tolerance`` times the best recent latency hold the limit
+    where it is, as queueing on the service side shows up there first.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 32,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self.stats = {'throttles': 0, 'decreases': 0, 'peak_limit': int(self.limit)}
+
+    @classmethod
+    def from_env(cls) -> 'AdaptiveConcurrencyLimiter':
+        return cls(
+            initial=int(os.environ.get('EMBEDDING_CONCURRENCY_INITIAL', '4')),
+            maximum=int(os.environ.get('EMBEDDING_CONCURRENCY_MAX', '32'))
+        )
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so the limiter can outlive a single event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float] = None, throttled: bool = False) -> None:
+        """Free a slot and adjust the limit from the outcome of the call"""
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if throttled:
+                self._on_throttle()
+            elif latency is not None:
+                self._on_success(latency)
+            condition.notify_all()
+
+    def _on_throttle(self) -> None:
+        self.stats['throttles'] += 1
+        now = time.monotonic()
+        if now - self._last_decrease < (self._baseline_latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+        self.stats['decreases'] += 1
+        logger.info(f"Bedrock throttled, embedding concurrency limit now {int(self.limit)}")
+
+    def _on_success(self, latency: float) -> None:
+        # Track the best recent latency: follow drops at once, rises slowly
+        baseline = self._baseline_latency
+        if baseline is None or latency < baseline:
+            self._baseline_latency = latency
+        else:
+            self._baseline_latency = baseline + (latency - baseline) * 0.01
+
+        if latency <= self._baseline_latency * self.latency_tolerance:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self.stats['peak_limit'] = max(self.stats['peak_limit'], int(self.limit))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'limit': int(self.limit),
+            'baseline_latency_ms': round((self._baseline_latency or 0.0) * 1000, 1),
+        }
+
+
+class EmbeddingEngine:
+    """Asyncio front end for a blocking embedding call.
+
+    Cache lookups bypass the concurrency limit; only real Bedrock calls take
+    a slot. Throttled and transient failures are retried with exponential
+    backoff and full jitter, so they cost time rather than failed items.
+    Blocking calls run on a dedicated thread pool sized to the limiter's
+    maximum, as the default executor would cap concurrency at a few threads.
+    """
+
+    def __init__(
+        self,
+        invoke: Callable[[str], List[float]],
+        model_id: str,
+        dimensions: int,
+        cache: Optional[EmbeddingCache] = None,
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        max_retries: int = 8,
+        base_backoff: float = 0.25,
+        max_backoff: float = 20.0
+    ):
+        self.invoke = invoke
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.cache = cache
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # Headroom over the embedding limit for cache and index calls
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.limiter.maximum * 2,
+            thread_name_prefix='embedding'
+        )
+        self.stats = {'bedrock_calls': 0, 'retries': 0}
+        # This engine's lookups, as the cache may be shared with other engines
+        self.cache_stats = new_stats()
+
+    async def run_blocking(self, fn: Callable, *args: Any) -> Any:
+        """Run a blocking call on the engine's thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    async def embed(self, text: str) -> List[float]:
+        """Return embeddings for a text, calling Bedrock only on a cache miss"""
+        if self.cache is not None:
+            cached = await self.run_blocking(
+                self.cache.get, self.model_id, self.dimensions, text, self.cache_stats
+            )
+            if cached is not None:
+                metrics.count('embedding_cache_hits')
+                return cached
+
+        embeddings = await self._invoke_with_retries(text)
+        if self.cache is not None and embeddings:
+            await self.run_blocking(self.cache.put, self.model_id, self.dimensions, text, embeddings)
+        return embeddings
+
+    async def _invoke_with_retries(self, text: str) -> List[float]:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                self.stats['bedrock_calls'] += 1
+                embeddings = await self.run_blocking(self.invoke, text)
+            except Exception as error:
+                throttled = is_throttling_error(error)
+                await self.limiter.release(throttled=throttled)
+                if not is_retryable_error(error) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                self.stats['retries'] += 1
+                metrics.count('bedrock_throttles' if throttled else 'bedrock_retries')
+                logger.warning(
+                    f"Retrying embedding after {_error_code(error)} "
+                    f"(attempt {attempt}, sleeping {delay:.2f}s)"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started
+            metrics.record('bedrock', latency)
+            await self.limiter.release(latency=latency)
+            return embeddings
+
+    def report(self) -> Dict[str, Any]:
+        return {**self.stats, 'concurrency': self.limiter.report()}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -1,24 +1,80 @@
+import asyncio
 import json
 import logging
-import math
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
-import boto3
+import numpy as np
 from botocore.client import BaseClient
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from botocore.config import Config
 from pydantic import BaseModel, Field
 from upstash_vector import Index, Vector
 from upstash_vector.types import SparseVector
 
+from checkpoint import CONTINUATION_KEY, Checkpoint, CheckpointStore, invoke_continuation
+from chunker import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, Chunk, MarkdownChunker, get_encoding
+from clients import get_client, is_cold_start
+from embedding_cache import DEFAULT_MEMORY_ENTRIES, EmbeddingCache, S3EmbeddingStore
+from embedding_engine import AdaptiveConcurrencyLimiter, EmbeddingEngine
+from index_sync import (
+    add_alias_urls, changed_metadata, delete_ids, list_parent_metadata, stable_chunk_id, stable_parent_id,
+    update_metadata
+)
+from metrics import get_metrics, log_sampled, metric_scope
+from near_duplicates import DuplicateRegistry, Representative, chunk_body
+from parent_store import ParentStore, S3ParentStore, chunk_metadata, parent_record, payload_layout
+from record_format import compression_for_key, is_jsonl_key, iter_lines
+from s3_events import S3Object, handle_objects
+from sharding import (
+    SHARD_KEY,
+    Shard,
+    ShardReportStore,
+    dispatch_shards,
+    iter_shard_lines,
+    merge_reports,
+    plan_shards,
+    s3_chunk_reader,
+)
+from sparse_encoder import DEFAULT_IDF_KEY, Bm25Encoder, IdfTable, sparse_encoder_name
+from upsert_queue import MAX_VECTORS_PER_REQUEST, AdaptiveBatchSizer, UpsertQueue
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 100
+# Stage timings, emitted as EMF metrics once per invocation
+metrics = get_metrics()
+
+MAX_FAILURE_RATIO = 0.1
+READ_CHUNK_SIZE = 64 * 1024
+
+# Throttles must reach the adaptive limiter rather than be retried
+# inside botocore, and the connection pool must cover its maximum
+BEDROCK_CLIENT_CONFIG = Config(
+    retries={'mode': 'standard', 'max_attempts': 1},
+    max_pool_connections=int(os.environ.get('EMBEDDING_CONCURRENCY_MAX', '32'))
+)
+
+# Module scope so the in-memory tier survives warm invocations
+_embedding_cache: Optional[EmbeddingCache] = None
+# Loaded once per container; a rebuilt IDF table reaches new containers
+_sparse_encoder: Optional[Bm25Encoder] = None
+
+# Secrets and the Upstash index are reused across warm invocations; secrets
+# are re-read after SECRET_CACHE_TTL_SECONDS so rotation is picked up
+_secret_cache: Dict[str, Tuple[str, float]] = {}
+_secret_lock = threading.Lock()
+_index: Optional[Tuple[Tuple[str, str], Index]] = None
+
+# The chunker shares the process-wide encoding, loaded on first use
+_chunker = MarkdownChunker(
+    max_tokens=int(os.environ.get('CHUNK_TOKENS', CHUNK_TOKENS)),
+    overlap_tokens=int(os.environ.get('CHUNK_OVERLAP_TOKENS', CHUNK_OVERLAP_TOKENS))
+)
 
 
 class ProcessedItem(BaseModel):
@@ -37,33 +93,119 @@ class ProcessingResult(BaseModel):
     """Model for vectorization results"""
     successful: int = 0
     failed: List[Dict[str, str]] = []
+    unchanged: int = 0
+    # Unchanged vectors whose metadata was patched
+    updated: int = 0
+    deleted: int = 0
+    duplicates: int = 0
+    upserts: Dict[str, Any] = {}
+    # First line not yet attempted when the run stopped for lack of time
+    next_line: Optional[int] = None
+
+
+class PreparedVectors(BaseModel):
+    """Vectors prepared for one item, plus what incremental sync found"""
+    # (Vector, error) pairs; typed loosely as pydantic cannot validate Vector
+    results: List[Tuple[Any, Optional[str]]] = []
+    unchanged: int = 0
+    updated: int = 0
+    stale_ids: List[str] = []
+    parent_id: Optional[str] = None
+    # Chunks matched to a near-duplicate representative, and in collapse
+    # mode the (representative, page URL) pairs left out of the index
+    duplicates: int = 0
+    aliases: List[Tuple[Any, str]] = []
+
+
+def is_incremental_sync() -> bool:
+    """Whether vectors use content-addressed IDs and only changes are written"""
+    return os.environ.get('SYNC_MODE', 'full').lower() == 'incremental'
+
+
+def get_secret(secrets_client: BaseClient, name: str) -> str:
+    """Read a secret string, cached for SECRET_CACHE_TTL_SECONDS"""
+    ttl = float(os.environ.get('SECRET_CACHE_TTL_SECONDS', '300'))
+    with _secret_lock:
+        cached = _secret_cache.get(name)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+
+    logger.info(f"Getting secret for name: {name}")
+    value = secrets_client.get_secret_value(SecretId=name)['SecretString']
+    with _secret_lock:
+        _secret_cache[name] = (value, time.monotonic() + ttl)
+    return value
 
 
 def get_upstash_credentials(secrets_client: BaseClient) -> tuple[str, str]:
     """Retrieve Upstash credentials from Secrets Manager"""
-    endpoint_name = os.environ['UPSTASH_ENDPOINT_SECRET_NAME']
-    logger.info(f"Getting secret for endpoint name: {endpoint_name}")
-    endpoint_secret = secrets_client.get_secret_value(
-        SecretId=endpoint_name
-    )
+    endpoint = get_secret(secrets_client, os.environ['UPSTASH_ENDPOINT_SECRET_NAME'])
+    token = get_secret(secrets_client, os.environ['UPSTASH_TOKEN_SECRET_NAME'])
 
-    token_name = os.environ['UPSTASH_TOKEN_SECRET_NAME']
-    logger.info(f"Getting secret for token name: {token_name}")
-    token_secret = secrets_client.get_secret_value(
-        SecretId=token_name
-    )
-
-    if not endpoint_secret['SecretString'] or not token_secret['SecretString']:
+    if not endpoint or not token:
         raise ValueError("Missing secret values")
 
-    endpoint = endpoint_secret['SecretString']
     logger.info(f"Upstash Endpoint length: {len(endpoint)}")
-    token = token_secret['SecretString']
     logger.info(f"Upstash Token length: {len(token)}")
     
     return endpoint, token
 
 
+def get_index(secrets_client: BaseClient) -> Index:
+    """Return the Upstash index, rebuilt only when its credentials change"""
+    global _index
+    credentials = get_upstash_credentials(secrets_client)
+    if _index is None or _index[0] != credentials:
+        logger.info("Initializing Upstash")
+        endpoint, token = credentials
+        _index = (credentials, Index(url=endpoint, token=token))
+    return _index[1]
+
+
+def _sparse_rows(
+    matrix: np.ndarray,
+    top_k: int,
+    threshold: float
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Select sparse (indices, values) for every row of an embedding matrix.
+
+    Per row: NaNs are dropped, magnitudes above ``threshold`` are kept (or all
+    valid magnitudes when none qualify), and the ``top_k`` largest are returned
+    in descending order. Ties go to the lower index, as a stable sort would.
+    """
+    valid = ~np.isnan(matrix)
+    if not valid.any(axis=1).all():
+        row = int(np.flatnonzero(~valid.any(axis=1))[0])
+        raise ValueError(f"No valid values in embeddings (all NaN) in row {row}")
+
+    magnitudes = np.abs(np.where(valid, matrix, 0.0))
+    significant = valid & (magnitudes > threshold)
+    # Rows with nothing above the threshold fall back to every valid value
+    candidates = np.where(significant.any(axis=1, keepdims=True), significant, valid)
+    scores = np.where(candidates, magnitudes, -np.inf)
+
+    n_dims = scores.shape[1]
+    if top_k < n_dims:
+        # k-th largest score per row, then everything above it plus enough
+        # of the lowest-indexed ties to make up exactly k
+        kth = np.partition(scores, n_dims - top_k, axis=1)[:, n_dims - top_k][:, None]
+        above = scores > kth
+        ties = (scores == kth) & candidates
+        needed = top_k - above.sum(axis=1, keepdims=True)
+        selected = above | (ties & (np.cumsum(ties, axis=1) <= needed))
+        selected &= candidates
+    else:
+        selected = candidates
+
+    rows = []
+    for row_scores, row_selected in zip(scores, selected):
+        indices = np.flatnonzero(row_selected)
+        values = row_scores[indices]
+        order = np.lexsort((indices, -values))
+        rows.append((indices[order], values[order]))
+    return rows
+
+
 def create_sparse_vector(
     embeddings: List[float], 
     top_k: int = 32, 
@@ -71,50 +213,33 @@ def create_sparse_vector(
 ) -> SparseVector:
     """Create sparse vector using both top-k and threshold with validation"""
     # Validate input
-    if not embeddings:
+    if embeddings is None or len(embeddings) == 0:
         raise ValueError("Empty embeddings list")
-    
-    # Create indexed values and filter out NaN values
-    indexed_values = [
-        (i, v) for i, v in enumerate(embeddings) 
-        if isinstance(v, float) and not math.isnan(v)  # Explicit NaN check using math.isnan()
-    ]
-    
-    if not indexed_values:
-        raise ValueError("No valid values in embeddings (all NaN)")
-    
-    # Filter by threshold and ensure positive values
-    significant_values = [
-        (i, abs(v)) for i, v in indexed_values 
-        if abs(v) > threshold
-    ]
-    
-    if not significant_values:
-        # If no values meet threshold, take top k of absolute values
-        significant_values = sorted(
-            [(i, abs(v)) for i, v in indexed_values],
-            key=lambda x: x[1],
-            reverse=True
-        )[:top_k]
-    
-    # Take top-k of remaining values
-    top_indices = sorted(
-        significant_values, 
-        key=lambda x: x[1], 
-        reverse=True
-    )[:top_k]
-    
-    if not top_indices:
-        raise ValueError("No significant values found in embeddings")
-    
-    indices = [i for i, _ in top_indices]
-    values = [v for _, v in top_indices]
-    
-    # Validate final values
-    if any(v <= 0 for v in values):
-        raise ValueError("Negative or zero values in sparse vector")
-    
-    return SparseVector(indices, values)
+
+    return create_sparse_vectors(
+        np.asarray(embeddings, dtype=np.float64)[None, :], top_k, threshold
+    )[0]
+
+
+def create_sparse_vectors(
+    embeddings: Union[np.ndarray, List[List[float]]],
+    top_k: int = 32,
+    threshold: float = 0.1
+) -> List[SparseVector]:
+    """Create sparse vectors for an (n_chunks x dims) embedding matrix in one call"""
+    matrix = np.asarray(embeddings, dtype=np.float64)
+    if matrix.ndim != 2 or matrix.size == 0:
+        raise ValueError("Embeddings must be a non-empty (n_chunks x dims) matrix")
+
+    sparse_vectors = []
+    for indices, values in _sparse_rows(matrix, top_k, threshold):
+        if indices.size == 0:
+            raise ValueError("No significant values found in embeddings")
+        # Validate final values
+        if (values <= 0).any():
+            raise ValueError("Negative or zero values in sparse vector")
+        sparse_vectors.append(SparseVector(indices.tolist(), values.tolist()))
+    return sparse_vectors
 
 
 def generate_bedrock_embeddings(
@@ -146,221 +271,740 @@ def generate_bedrock_embeddings(
         raise
 
 
-def create_text_chunks(text: str, title: Optional[str] = None) -> List[str]:
-    """Split text into chunks using RecursiveCharacterTextSplitter"""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,  # Approximately 512 tokens
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=["\n## ", "\n# ", "\n### ", "\n\n", "\n", " ", ""]
+def get_embedding_cache(s3_client: BaseClient) -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, creating it on first use"""
+    global _embedding_cache
+    if os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _embedding_cache is None:
+        bucket = os.environ.get('EMBEDDING_CACHE_BUCKET')
+        store = S3EmbeddingStore(
+            s3_client, bucket, os.environ.get('EMBEDDING_CACHE_PREFIX', 'embeddings')
+        ) if bucket else None
+        _embedding_cache = EmbeddingCache(
+            store,
+            int(os.environ.get('EMBEDDING_CACHE_MEMORY_ENTRIES', DEFAULT_MEMORY_ENTRIES))
+        )
+    return _embedding_cache
+
+
+def create_embedding_engine(
+    bedrock_client: BaseClient,
+    cache: Optional[EmbeddingCache] = None
+) -> EmbeddingEngine:
+    """Build the adaptive embedding engine from the environment"""
+    model_id = os.environ.get('BEDROCK_EMBEDDING_MODEL', 'amazon.titan-embed-text-v2:0')
+    dimensions = int(os.environ.get('EMBEDDING_DIMENSIONS', '512'))
+    return EmbeddingEngine(
+        partial(generate_bedrock_embeddings, bedrock_client, model_id=model_id, dimensions=dimensions),
+        model_id,
+        dimensions,
+        cache=cache,
+        limiter=AdaptiveConcurrencyLimiter.from_env(),
+        max_retries=int(os.environ.get('EMBEDDING_MAX_RETRIES', '8'))
     )
-    
-    # If text is short enough, return as single chunk
-    if len(text) < CHUNK_SIZE:
-        return [text]
-    
-    # Add title to beginning of text if provided
-    if title:
-        text = f"# {title}\n\n{text}"
-    
-    chunks = text_splitter.split_text(text)
-    return chunks
 
 
-def prepare_vector_item(
+def create_text_chunks(text: str, title: Optional[str] = None) -> List[Chunk]:
+    """Split markdown into token-bounded chunks, each led by its heading path"""
+    return _chunker.split(text, title)
+
+
+def embedding_text(item: ProcessedItem) -> str:
+    """Text an item is chunked from: its markdown, or the description without it"""
+    if not item.markdown or len(item.markdown.strip()) == 0:
+        if not item.description or len(item.description.strip()) == 0:
+            raise ValueError("Both markdown and description are empty or None")
+        return item.description
+    return item.markdown
+
+
+def chunk_item(item: ProcessedItem) -> List[Chunk]:
+    """Chunks to embed for an item"""
+    return create_text_chunks(embedding_text(item), item.title)
+
+
+async def prepare_vector_item(
     item_data: Tuple[int, str, str],
-    bedrock_client: BaseClient
-) -> List[Tuple[Optional[Vector], Optional[str]]]:
-    """Prepare vector items with embeddings generation and chunking"""
+    engine: EmbeddingEngine,
+    index: Optional[Index] = None,
+    duplicates: Optional[DuplicateRegistry] = None,
+    parents: Optional[ParentStore] = None,
+    sparse: Optional[Bm25Encoder] = None
+) -> PreparedVectors:
+    """Prepare vector items with embeddings generation and chunking.
+
+    When an index is given, IDs are derived from the URL and chunk text and
+    only chunks missing from the index are embedded; IDs stored for the page
+    that no longer match any chunk are returned as stale. Chunks already in
+    the index have their metadata patched where it changed, such as a new
+    content type or source link, without being embedded again.
+
+    With a duplicate registry, chunks that nearly match one seen earlier in
+    the run take their representative's embedding instead of calling
+    Bedrock, and in collapse mode are not stored at all.
+
+    With a parent store, vectors use the compact payload layout: the page
+    fields and text go into the page's parent record, written before any
+    of its chunks are returned, and chunks carry only a reference to it.
+
+    With a BM25 encoder, sparse vectors are lexical, from the chunk text,
+    rather than taken from the largest dense dimensions.
+    """
     idx, line, source_key = item_data
+    parent_id = None
     try:
-        item = ProcessedItem.model_validate(json.loads(line))
-
-        # Check if we have valid content to generate embeddings
-        if not item.markdown or len(item.markdown.strip()) == 0:
-            if not item.description or len(item.description.strip()) == 0:
-                raise ValueError("Both markdown and description are empty or None")
-            text_for_embedding = item.description
-        else:
-            text_for_embedding = item.markdown
+        item = ProcessedItem.model_validate_json(line)
 
         # Split text into chunks
-        chunks = create_text_chunks(text_for_embedding, item.title)
-        vectors = []
-
-        # Process each chunk
-        for chunk_idx, chunk in enumerate(chunks):
-            # Generate embeddings for chunk
-            logger.info(f"Generating embeddings for item {idx + 1}, chunk {chunk_idx + 1}")
-            embeddings = generate_bedrock_embeddings(
-                bedrock_client,
-                chunk
-            )
-
-            # Create sparse vector
-            sparse_vector = create_sparse_vector(embeddings)
-            sparsity = len(sparse_vector.indices) / len(embeddings)
-            logger.info(f"Sparsity of output vector: {sparsity}")
-
+        with metrics.time('chunking'):
+            chunks = chunk_item(item)
+        metrics.count('chunks', len(chunks))
+        prepared = PreparedVectors()
+
+        if index is not None:
+            parent_id = stable_parent_id(item.url)
+            chunk_ids = [stable_chunk_id(parent_id, chunk.text) for chunk in chunks]
+            started = time.perf_counter()
+            stored = await engine.run_blocking(list_parent_metadata, index, parent_id)
+            metrics.record('index_lookup', time.perf_counter() - started)
+            existing_ids = set(stored)
+            prepared.stale_ids = sorted(existing_ids - set(chunk_ids))
+        else:
+            parent_id = f"{source_key}_{idx}"
             # Create unique vector ID incorporating chunk number
-            vector_id = f"{source_key}_{idx}_{chunk_idx}"
-
+            chunk_ids = [f"{source_key}_{idx}_{chunk_idx}" for chunk_idx in range(len(chunks))]
+            existing_ids = set()
+        prepared.parent_id = parent_id
+
+        if parents is not None:
+            # Rewritten on every pass, as unchanged chunks can still move within the page
+            record = parent_record(item, embedding_text(item), chunks, chunk_ids)
+            started = time.perf_counter()
+            stored_bytes = await engine.run_blocking(parents.put, parent_id, record)
+            metrics.record('parent_store', time.perf_counter() - started)
+            metrics.count('parent_record_bytes', stored_bytes)
+
+        # Select the chunks that need new vectors, and stored ones whose metadata is out of date
+        pending = []
+        patches = []
+        seen_ids = set()
+        for chunk_idx, (chunk, vector_id) in enumerate(zip(chunks, chunk_ids)):
+            if vector_id in existing_ids:
+                prepared.unchanged += 1
+                if vector_id not in seen_ids:
+                    seen_ids.add(vector_id)
+                    patch = changed_metadata(stored[vector_id], chunk_metadata(
+                        item, parent_id, chunk, chunk_idx, len(chunks), compact=parents is not None
+                    ))
+                    if patch:
+                        patches.append((vector_id, patch))
+                if duplicates is not None:
+                    # Stored vectors stand for later copies of their text
+                    duplicates.match_or_add(chunk_body(chunk), vector_id, parent_id, item.url)
+                continue
+            if vector_id in seen_ids:
+                # Repeated chunk text within the page maps to the same vector
+                continue
+            seen_ids.add(vector_id)
+            pending.append((chunk_idx, chunk, vector_id))
+
+        # Patched before duplicates are grouped: a representative registered
+        # below must reach the embedding gather, or copies wait on it forever
+        if patches:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                engine.run_blocking(update_metadata, index, vector_id, patch) for vector_id, patch in patches
+            ))
+            metrics.record('metadata_update', time.perf_counter() - started)
+            prepared.updated = len(patches)
+
+        # Group near-duplicates before any embedding starts, so every
+        # representative registered here is resolved by the gather below
+        representatives: List[Optional[Representative]] = [None] * len(pending)
+        own_embeddings: List[Optional[asyncio.Future]] = [None] * len(pending)
+        if duplicates is not None:
+            loop = asyncio.get_running_loop()
+            kept, representatives, own_embeddings = [], [], []
+            for chunk_idx, chunk, vector_id in pending:
+                future = loop.create_future()
+                representative = duplicates.match_or_add(
+                    chunk_body(chunk), vector_id, parent_id, item.url, future
+                )
+                if representative is not None:
+                    prepared.duplicates += 1
+                    if duplicates.mode == 'collapse':
+                        prepared.aliases.append((representative, item.url))
+                        continue
+                kept.append((chunk_idx, chunk, vector_id))
+                representatives.append(representative)
+                own_embeddings.append(future if representative is None else None)
+            pending = kept
+
+        if not pending:
+            metrics.count('items_processed')
+            return prepared
+
+        async def embed(text: str, representative: Optional[Representative], own: Optional[asyncio.Future]):
+            embeddings = None
+            try:
+                if representative is not None:
+                    embeddings = await representative.get_embedding()
+                    if embeddings is not None:
+                        metrics.count('duplicate_embeddings_reused')
+                if embeddings is None:
+                    embeddings = await engine.embed(text)
+                return embeddings
+            finally:
+                # Duplicates waiting on this chunk fall back to their own call on failure
+                if own is not None and not own.done():
+                    own.set_result(embeddings)
+
+        # Embed all chunks of the item concurrently, within the engine's limit
+        log_sampled(logger, "Generating embeddings for item %s, %s chunks", idx + 1, len(pending))
+        all_embeddings = await asyncio.gather(*(
+            embed(chunk.text, representative, own)
+            for (_, chunk, _), representative, own in zip(pending, representatives, own_embeddings)
+        ))
+
+        # Create sparse vectors for all chunks of the item at once
+        with metrics.time('sparse_encoding'):
+            if sparse is not None:
+                sparse_vectors = sparse.encode_documents([chunk.text for _, chunk, _ in pending])
+            else:
+                sparse_vectors = create_sparse_vectors(all_embeddings)
+
+        for (chunk_idx, chunk, vector_id), embeddings, sparse_vector, representative in zip(
+            pending, all_embeddings, sparse_vectors, representatives
+        ):
+            metadata = chunk_metadata(
+                item, parent_id, chunk, chunk_idx, len(chunks), compact=parents is not None
+            )
+            if representative is not None:
+                # Lets queries drop copies with a HAS NOT FIELD duplicate_of filter
+                metadata["duplicate_of"] = representative.vector_id
             # Create the vector object with chunk metadata
             vector = Vector(
                 id=vector_id,
                 vector=embeddings,
                 sparse_vector=sparse_vector,
-                metadata={
-                    "title": item.title,
-                    "source_text": item.source_text,
-                    "source_link": item.source_link,
-                    "url": item.url,
-                    "content_type": item.content_type,
-                    "extracted_at": item.extracted_at.isoformat(),
-                    "chunk_index": chunk_idx,
-                    "total_chunks": len(chunks),
-                    "parent_id": f"{source_key}_{idx}"
-                },
-                data=chunk
+                metadata=metadata,
+                data=None if parents is not None else chunk.text
             )
-            vectors.append((vector, None))
+            prepared.results.append((vector, None))
 
-        return vectors
+        metrics.count('items_processed')
+        return prepared
 
     except Exception as error:
         error_msg = str(error)
         logger.error(f"Error processing item {idx + 1}: {error_msg}")
-        return [(None, error_msg)]
+        metrics.count('items_failed')
+        return PreparedVectors(results=[(None, error_msg)], parent_id=parent_id)
 
 
-def process_batch(
+async def process_items(
     items: List[Tuple[int, str, str]],
-    bedrock_client: BaseClient,
+    engine: EmbeddingEngine,
     index: Index,
-    max_workers: int = 5
-) -> Tuple[int, List[Dict[str, str]]]:
-    """Process a batch of items in parallel and upsert as a single batch"""
-    successful = 0
-    failed = []
-    vectors_to_upsert = []
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_item = {
-            executor.submit(prepare_vector_item, item, bedrock_client): item
-            for item in items
-        }
-
-        for future in as_completed(future_to_item):
-            item = future_to_item[future]
-            idx, _, source_key = item
-            
-            try:
-                vector_results = future.result()
-                for vector, error in vector_results:
-                    if vector:
-                        vectors_to_upsert.append(vector)
-                        successful += 1
-                    else:
-                        failed.append({
-                            "id": f"{source_key}_{idx}",
-                            "error": error
-                        })
-            except Exception as error:
-                failed.append({
+    incremental: bool = False,
+    upsert_sizer: Optional[AdaptiveBatchSizer] = None,
+    upsert_max_vectors: int = MAX_VECTORS_PER_REQUEST,
+    upsert_workers: int = 2,
+    max_pending_batches: int = 4,
+    should_stop: Optional[Callable[[], bool]] = None,
+    duplicates: Optional[DuplicateRegistry] = None,
+    parents: Optional[ParentStore] = None,
+    sparse: Optional[Bm25Encoder] = None
+) -> ProcessingResult:
+    """Embed and upsert items as a continuous, overlapped stream.
+
+    Items are started as soon as an earlier one finishes, so a slow Bedrock
+    call only holds up its own item; how many calls actually run at once is
+    left to the engine's adaptive limit. Vectors are grouped into upserts
+    sized by ``upsert_sizer``'s byte budget and handed to concurrent upsert
+    workers through a bounded queue, so Bedrock and Upstash work at the same
+    time and a slow index throttles the intake of new items instead of
+    growing memory. A failed upsert is retried and then bisected, so only
+    the vectors that cannot be written count as failed. In incremental mode, stale
+    vectors are deleted in bulk at the end, only for pages whose new vectors
+    were all upserted, so a page is never left without vectors.
+
+    Once ``should_stop`` returns true no new items are started; items in
+    flight are finished and flushed, and ``next_line`` records where a
+    later run should pick up.
+
+    Collapsed near-duplicates are linked once all upserts are done, by
+    writing the pages they came from into their representative's
+    ``alias_urls``. When the representative's page failed, in preparation
+    or upsert, or its alias update fails, its collapsed copies are
+    reported as failed.
+    """
+    result = ProcessingResult()
+    stale_ids: Dict[str, List[str]] = {}
+    failed_parents = set()
+    aliases: Dict[str, Tuple[Representative, set]] = {}
+
+    async def upsert(vectors: List[Vector]) -> None:
+        started = time.perf_counter()
+        try:
+            await engine.run_blocking(partial(index.upsert, vectors=vectors))
+        except Exception:
+            metrics.count('upsert_failures')
+            raise
+        metrics.record('upsert', time.perf_counter() - started)
+        metrics.count('vectors_upserted', len(vectors))
+
+    def upsert_failed(vectors: List[Vector], error: Exception) -> None:
+        result.successful -= len(vectors)
+        failed_parents.update(vector.metadata['parent_id'] for vector in vectors)
+        result.failed.extend([{
+            "id": vector.id,
+            "error": f"Upsert failed: {str(error)}"
+        } for vector in vectors])
+
+    upsert_queue = UpsertQueue(
+        upsert,
+        upsert_failed,
+        sizer=upsert_sizer,
+        max_vectors=upsert_max_vectors,
+        workers=upsert_workers,
+        max_pending_batches=max_pending_batches
+    )
+    upsert_queue.start()
+
+    async def collect(item: Tuple[int, str, str], prepared: PreparedVectors) -> None:
+        idx, _, source_key = item
+        for vector, error in prepared.results:
+            if vector:
+                await upsert_queue.add(vector)
+                result.successful += 1
+            else:
+                result.failed.append({
                     "id": f"{source_key}_{idx}",
-                    "error": str(error)
+                    "error": error
                 })
+        if prepared.parent_id is not None and any(vector is None for vector, _ in prepared.results):
+            # Chunks collapsed onto this page's representatives are not in the index either
+            failed_parents.add(prepared.parent_id)
+        result.unchanged += prepared.unchanged
+        result.updated += prepared.updated
+        result.duplicates += prepared.duplicates
+        for representative, url in prepared.aliases:
+            aliases.setdefault(representative.vector_id, (representative, set()))[1].add(url)
+        if prepared.stale_ids:
+            stale_ids[prepared.parent_id] = prepared.stale_ids
+
+    # Enough items in flight to keep the limiter saturated at its maximum
+    window = engine.limiter.maximum
+    in_flight = {}
+    position = 0
+    exhausted = False
+
+    while in_flight or not exhausted:
+        while not exhausted and len(in_flight) < window:
+            if position >= len(items):
+                exhausted = True
+                break
+            if len(result.failed) > len(items) * MAX_FAILURE_RATIO:
+                logger.info("Stopping due to too many failed items")
+                exhausted = True
+                break
+            if should_stop is not None and should_stop():
+                logger.info("Stopping early to leave time for a checkpoint")
+                result.next_line = items[position][0]
+                exhausted = True
+                break
+            item = items[position]
+            position += 1
+            task = asyncio.create_task(
+                prepare_vector_item(item, engine, index if incremental else None, duplicates, parents, sparse)
+            )
+            in_flight[task] = item
+
+        if not in_flight:
+            break
+
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            await collect(in_flight.pop(task), task.result())
 
-    # Batch upsert all successful vectors
-    if vectors_to_upsert:
+    await upsert_queue.close()
+    result.upserts = upsert_queue.report()
+
+    if aliases:
+        await link_aliases(engine, index, aliases.values(), failed_parents, result)
+
+    # Remove chunks that no longer exist now their replacements are in place
+    to_delete = [
+        vector_id
+        for parent_id, ids in stale_ids.items() if parent_id not in failed_parents
+        for vector_id in ids
+    ]
+    if to_delete:
         try:
-            logger.info(f"Upserting batch of {len(vectors_to_upsert)} vectors")
-            # Process in smaller sub-batches to avoid potential size limits
-            batch_size = 50
-            for i in range(0, len(vectors_to_upsert), batch_size):
-                batch = vectors_to_upsert[i:i + batch_size]
-                index.upsert(vectors=batch)
-                logger.info(f"Upserted sub-batch of {len(batch)} vectors")
+            result.deleted = await engine.run_blocking(delete_ids, index, to_delete)
         except Exception as error:
-            logger.error(f"Batch upsert error: {str(error)}")
-            # If batch upsert fails, mark all vectors as failed
-            successful = 0
-            failed.extend([{
-                "id": vector.id,
-                "error": f"Batch upsert failed: {str(error)}"
-            } for vector in vectors_to_upsert])
+            logger.error(f"Stale vector deletion error: {str(error)}")
 
-    return successful, failed
+    return result
 
 
-def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """AWS Lambda handler for vectorization"""
-    logger.info("Starting vectorization", extra={'event': event})
+async def link_aliases(
+    engine: EmbeddingEngine,
+    index: Index,
+    aliases: Iterable[Tuple[Representative, set]],
+    failed_parents: set,
+    result: ProcessingResult
+) -> None:
+    """Record collapsed duplicates' pages on their representatives"""
+    def unindexed(representative: Representative, urls: set, reason: str = 'was not indexed') -> None:
+        # Copies are only in the index through their representative's alias list
+        result.failed.extend({
+            "id": url,
+            "error": f"Representative {representative.vector_id} of a collapsed duplicate {reason}"
+        } for url in sorted(urls))
+
+    async def link(representative: Representative, urls: set) -> None:
+        urls = urls - {representative.url}
+        if not urls:
+            return
+        if representative.parent_id in failed_parents:
+            unindexed(representative, urls)
+            return
+        try:
+            if not await engine.run_blocking(add_alias_urls, index, representative.vector_id, urls):
+                unindexed(representative, urls)
+        except Exception as error:
+            logger.error(f"Alias update error for {representative.vector_id}: {str(error)}")
+            unindexed(representative, urls, f"could not be linked: {str(error)}")
+
+    await asyncio.gather(*(link(representative, urls) for representative, urls in aliases))
+
+
+def get_checkpoint_store(s3_client: BaseClient) -> Optional[CheckpointStore]:
+    """Checkpoint store from the environment, or None when checkpointing is off"""
+    bucket = os.environ.get('CHECKPOINT_BUCKET')
+    if not bucket:
+        return None
+    return CheckpointStore(s3_client, bucket, os.environ.get('CHECKPOINT_PREFIX', 'checkpoints'))
+
+
+def get_parent_store(s3_client: BaseClient) -> Optional[ParentStore]:
+    """Parent store for the compact payload layout, or None with the full layout"""
+    if payload_layout() == 'full':
+        return None
+    bucket = os.environ.get('PARENT_STORE_BUCKET')
+    if not bucket:
+        raise ValueError("PAYLOAD_LAYOUT=compact requires PARENT_STORE_BUCKET")
+    return S3ParentStore(s3_client, bucket, os.environ.get('PARENT_STORE_PREFIX', 'parents'))
+
+
+def get_sparse_encoder(s3_client: BaseClient) -> Optional[Bm25Encoder]:
+    """BM25 encoder with the IDF table from S3, or None for dense-derived sparse vectors"""
+    global _sparse_encoder
+    if sparse_encoder_name() == 'dense':
+        return None
+    if _sparse_encoder is None:
+        bucket = os.environ.get('SPARSE_IDF_BUCKET')
+        if not bucket:
+            raise ValueError("SPARSE_ENCODER=bm25 requires SPARSE_IDF_BUCKET")
+        response = s3_client.get_object(Bucket=bucket, Key=os.environ.get('SPARSE_IDF_KEY', DEFAULT_IDF_KEY))
+        _sparse_encoder = Bm25Encoder(IdfTable.from_bytes(response['Body'].read()), get_encoding())
+    return _sparse_encoder
+
+
+def fan_out(s3_client: BaseClient, source_bucket: str, source_key: str, context: Any) -> Dict[str, Any]:
+    """Split a large input into byte-range shards, one invocation each"""
+    head = s3_client.head_object(Bucket=source_bucket, Key=source_key)
+    run_id = f"{datetime.now().strftime('%Y-%m-%d')}-{context.aws_request_id}"
+    shards = plan_shards(
+        run_id,
+        source_bucket,
+        source_key,
+        head['ContentLength'],
+        int(os.environ['SHARD_SIZE_BYTES']),
+        int(os.environ.get('MAX_SHARDS', '1000')),
+        etag=head.get('ETag', '')
+    )
+    dispatch_shards(get_client('lambda'), context.invoked_function_arn, shards)
+    return {
+        "statusCode": 202,
+        "body": json.dumps({
+            "message": f"Vectorization of {source_key} split into {len(shards)} shards",
+            "run_id": run_id,
+            "shards": len(shards)
+        })
+    }
+
+
+def complete_shard(
+    s3_client: BaseClient,
+    shard: Shard,
+    report: Dict[str, Any],
+    summary: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Save a finished or failed shard's report; the last shard merges the run's reports"""
+    reports = ShardReportStore(s3_client, shard.bucket, 'shard-reports/vectorization')
+    reports.save(shard, report)
+    all_reports = reports.collect(shard)
+    if all_reports is None:
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "message": f"Vectorization of shard {shard.name} of {shard.key} complete",
+                "result": summary
+            })
+        }
 
-    # Initialize AWS clients
-    s3_client = boto3.client('s3')
-    secrets_client = boto3.client('secretsmanager')
-    bedrock_client = boto3.client('bedrock-runtime')
+    merged = merge_reports(all_reports)
+    report_key = reports.save_merged(shard.run_id, merged)
+    logger.info(f"All {shard.count} shards of {shard.key} complete, report at {report_key}")
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "message": f"Vectorization complete for {shard.key}",
+            "shards": shard.count,
+            "result": merged
+        })
+    }
+
+
+def _error_response(error: Exception) -> Dict[str, Any]:
+    logger.error(f"Vectorization error: {str(error)}")
+    return {
+        "statusCode": 500,
+        "body": json.dumps({
+            "message": "Error in vectorization process",
+            "error": str(error)
+        })
+    }
+
+
+def vectorize_object(
+    source_bucket: str,
+    source_key: str,
+    shard: Optional[Shard],
+    context: Any
+) -> Dict[str, Any]:
+    """Vectorize an object, or one shard of it, from its last checkpoint"""
+    # AWS clients are created once per process and reused while warm
+    s3_client = get_client('s3')
+    secrets_client = get_client('secretsmanager')
+    bedrock_client = get_client('bedrock-runtime', BEDROCK_CLIENT_CONFIG)
 
     try:
-        # Extract S3 event details
-        record = event['Records'][0]['s3']
-        source_bucket = record['bucket']['name']
-        source_key = record['object']['key']
-
-        # Retrieve and process S3 object
-        logger.info(f"Retrieving object from {source_bucket}/{source_key}")
-        response = s3_client.get_object(
-            Bucket=source_bucket,
-            Key=source_key
-        )
-        content = response['Body'].read().decode('utf-8')
-
-        if not content:
-            raise ValueError("No content found in S3 object")
+        if shard is not None:
+            # Lines starting in the shard's byte range of one object version
+            logger.info(f"Retrieving shard {shard.name} of {source_bucket}/{source_key}")
+            etag = shard.etag
+            lines = list(iter_shard_lines(
+                s3_chunk_reader(s3_client, source_bucket, source_key, etag), shard.start, shard.end
+            ))
+            # Shard-qualified keys keep checkpoints and full-sync vector IDs apart
+            checkpoint_key = f"{source_key}#{shard.name}"
+            item_key = f"{source_key}@{shard.start}"
+        else:
+            # Retrieve and process S3 object
+            logger.info(f"Retrieving object from {source_bucket}/{source_key}")
+            response = s3_client.get_object(
+                Bucket=source_bucket,
+                Key=source_key
+            )
+            etag = response.get('ETag', '')
+            # Decompressed and split as the body streams in, by the key's suffix
+            lines = list(iter_lines(
+                response['Body'].iter_chunks(READ_CHUNK_SIZE), compression_for_key(source_key)
+            ))
+            while lines and not lines[-1].strip():
+                lines.pop()
+
+            if not lines:
+                raise ValueError("No content found in S3 object")
+            checkpoint_key = item_key = source_key
+
+        # Resume from an earlier invocation, including retries of the original event
+        checkpoints = get_checkpoint_store(s3_client)
+        checkpoint = checkpoints.load(source_bucket, checkpoint_key, etag) if checkpoints else None
+        if checkpoint is None:
+            checkpoint = Checkpoint(source_bucket=source_bucket, source_key=checkpoint_key, etag=etag)
+        else:
+            logger.info(f"Resuming {source_key} from line {checkpoint.next_line}")
+        max_invocations = int(os.environ.get('MAX_CONTINUATIONS', '100'))
+        if checkpoint.invocations >= max_invocations:
+            raise ValueError(f"Giving up on {source_key} after {checkpoint.invocations} invocations")
+        checkpoint.invocations += 1
 
         # Initialize Upstash Vector
-        logger.info("Initializing Upstash")
-        endpoint, token = get_upstash_credentials(secrets_client)
-        index = Index(url=endpoint, token=token)
+        index = get_index(secrets_client)
+
+        cache = get_embedding_cache(s3_client)
 
         # Process JSONL content
-        result = ProcessingResult()
-        lines = content.strip().split('\n')
-        
-        # Create batches of items
-        batch_size = 10
-        items = [(i, line, source_key) for i, line in enumerate(lines)]
-        
-        for batch_start in range(0, len(items), batch_size):
-            if (len(result.failed) > len(items) * 0.1):
-                logger.info("Stopping due to too many failed items")
-                break
-            batch = items[batch_start:batch_start + batch_size]
-            logger.info(f"Processing batch {batch_start//batch_size + 1}")
-            
-            successful, failed = process_batch(batch, bedrock_client, index)
-            result.successful += successful
-            result.failed.extend(failed)
+        incremental = is_incremental_sync()
+        start_line = checkpoint.next_line
+        items = [
+            (i, line, item_key)
+            for i, line in enumerate(lines[start_line:], start=start_line)
+        ]
+
+        # Stop starting new items once the remaining time only covers draining
+        should_stop = None
+        can_continue = checkpoints is not None and context is not None
+        if can_continue:
+            margin_ms = float(os.environ.get('CHECKPOINT_MARGIN_SECONDS', '60')) * 1000
+            should_stop = lambda: context.get_remaining_time_in_millis() < margin_ms
+
+        engine = create_embedding_engine(bedrock_client, cache)
+        # Duplicates are grouped within one invocation
+        duplicates = DuplicateRegistry.from_env()
+        parents = get_parent_store(s3_client)
+        sparse = get_sparse_encoder(s3_client)
+        try:
+            result = asyncio.run(process_items(
+                items,
+                engine,
+                index,
+                incremental=incremental,
+                upsert_sizer=AdaptiveBatchSizer.from_env(),
+                upsert_workers=int(os.environ.get('UPSERT_CONCURRENCY', '2')),
+                max_pending_batches=int(os.environ.get('UPSERT_QUEUE_BATCHES', '4')),
+                should_stop=should_stop,
+                duplicates=duplicates,
+                parents=parents,
+                sparse=sparse
+            ))
+        finally:
+            engine.close()
+
+        checkpoint.successful += result.successful
+        checkpoint.failed.extend(result.failed)
+        checkpoint.unchanged += result.unchanged
+        checkpoint.updated += result.updated
+        checkpoint.deleted += result.deleted
+
+        summary = {
+            "total_items": len(lines),
+            "successful_items": checkpoint.successful,
+            "failed_items": checkpoint.failed,
+            "unchanged_vectors": checkpoint.unchanged,
+            "updated_vectors": checkpoint.updated,
+            "deleted_vectors": checkpoint.deleted,
+            "invocations": checkpoint.invocations,
+            "embedding_cache": cache.report(engine.cache_stats) if cache is not None else None,
+            "embedding_engine": engine.report(),
+            "near_duplicates": duplicates.report() if duplicates is not None else None,
+            "upserts": result.upserts
+        }
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "message": f"Vectorization complete for {source_key}",
-                "result": {
-                    "total_items": len(lines),
-                    "successful_items": result.successful,
-                    "failed_items": result.failed
-                }
-            })
+        if result.next_line is not None:
+            if result.next_line == start_line:
+                raise ValueError(
+                    f"No progress on {source_key} before the checkpoint margin; "
+                    "increase the timeout or lower CHECKPOINT_MARGIN_SECONDS"
+                )
+            checkpoint.next_line = result.next_line
+            checkpoints.save(checkpoint)
+            invoke_continuation(
+                get_client('lambda'),
+                context.invoked_function_arn,
+                source_bucket,
+                source_key,
+                shard.model_dump() if shard is not None else None
+            )
+            return {
+                "statusCode": 202,
+                "body": json.dumps({
+                    "message": f"Vectorization of {source_key} continues from line {result.next_line}",
+                    "result": summary
+                })
+            }
+
+        if checkpoints is not None and checkpoint.invocations > 1:
+            checkpoints.delete(source_bucket, checkpoint_key)
+
+        if shard is None:
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": f"Vectorization complete for {source_key}",
+                    "result": summary
+                })
+            }
+        report = {
+            key: summary[key]
+            for key in (
+                "total_items", "successful_items", "failed_items",
+                "unchanged_vectors", "updated_vectors", "deleted_vectors", "invocations"
+            )
         }
 
     except Exception as error:
-        logger.error(f"Vectorization error: {str(error)}")
+        if shard is None:
+            return _error_response(error)
+        # A failed shard still reports, or the run's merge would never happen
+        logger.error(f"Shard {shard.name} of {source_key} failed: {str(error)}")
+        report = summary = {'failed_shards': [{'shard': shard.name, 'error': str(error)}]}
+
+    try:
+        return complete_shard(s3_client, shard, report, summary)
+    except Exception as error:
+        return _error_response(error)
+
+
+def vectorize_notified(obj: S3Object, context: Any) -> Dict[str, Any]:
+    """Vectorize an object named by an S3 notification, fanning out large ones"""
+    if not is_jsonl_key(obj.key):
+        logger.info(f"Ignoring {obj.key}, not a JSONL object")
         return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "message": "Error in vectorization process",
-                "error": str(error)
-            })
+            'statusCode': 200,
+            'body': json.dumps({'message': f"Skipped {obj.key}"})
         }
+
+    # Compressed objects cannot be split at byte offsets, so they are
+    # only processed sequentially with continuations
+    shard_bytes = int(os.environ.get('SHARD_SIZE_BYTES', '0'))
+    if (shard_bytes and obj.size > shard_bytes and context is not None
+            and compression_for_key(obj.key) is None):
+        try:
+            return fan_out(get_client('s3'), obj.bucket, obj.key, context)
+        except Exception as error:
+            return _error_response(error)
+    return vectorize_object(obj.bucket, obj.key, None, context)
+
+
+@metric_scope
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """AWS Lambda handler for vectorization.
+
+    Handles S3 notifications for new files, delivered directly or in SQS
+    batches, with every object they name vectorized concurrently
+    (RECORD_CONCURRENCY at a time), and continuation events sent by an
+    earlier invocation that ran short of time. Progress is checkpointed
+    before the deadline and the function re-invokes itself, so files of any
+    size finish without repeating lines that were already processed. Files
+    larger than SHARD_SIZE_BYTES are split into byte-range shards handled by
+    parallel invocations, each checkpointed on its own; only uncompressed
+    files can be split, so the stack leaves it unset for its zstd parts.
+    """
+    logger.info("Starting vectorization", extra={'event': event, 'cold_start': is_cold_start()})
+
+    if SHARD_KEY in event:
+        try:
+            shard = Shard.model_validate(event[SHARD_KEY])
+        except Exception as error:
+            return _error_response(error)
+        return vectorize_object(shard.bucket, shard.key, shard, context)
+    if CONTINUATION_KEY in event:
+        continuation = event[CONTINUATION_KEY]
+        try:
+            shard = Shard.model_validate(continuation['shard']) if continuation.get('shard') else None
+        except Exception as error:
+            return _error_response(error)
+        return vectorize_object(continuation['bucket'], continuation['key'], shard, context)
+
+    return handle_objects(
+        event,
+        lambda obj: vectorize_notified(obj, context),
+        int(os.environ.get('RECORD_CONCURRENCY', '1'))
+    )
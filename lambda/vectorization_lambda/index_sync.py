@@ -0,0 +1,105 @@
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Set
+
+from upstash_vector import Index
+from upstash_vector.types import MetadataUpdateMode
+
+logger = logging.getLogger()
+
+ID_SEPARATOR = '#'
+RANGE_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 1000
+# Keeps alias lists of very common boilerplate well inside the metadata size limit
+MAX_ALIAS_URLS = 100
+# Set anew on every crawl, so patching it would rewrite every unchanged chunk
+VOLATILE_METADATA_FIELDS = ('extracted_at',)
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+def stable_parent_id(url: str) -> str:
+    """Vector ID prefix for a page, independent of where it sits in a crawl file"""
+    return _digest(url.strip())
+
+
+def stable_chunk_id(parent_id: str, chunk: str) -> str:
+    """Content-addressed chunk ID: identical chunk text keeps its ID across runs"""
+    return f"{parent_id}{ID_SEPARATOR}{_digest(chunk)}"
+
+
+def _parent_vectors(index: Index, parent_id: str, include_metadata: bool) -> Iterator[Any]:
+    cursor = ''
+    while True:
+        result = index.range(
+            cursor=cursor,
+            limit=RANGE_PAGE_SIZE,
+            prefix=f"{parent_id}{ID_SEPARATOR}",
+            include_metadata=include_metadata
+        )
+        yield from result.vectors
+        cursor = result.next_cursor
+        if not cursor:
+            return
+
+
+def list_parent_ids(index: Index, parent_id: str) -> Set[str]:
+    """Return the IDs currently stored in the index for a page"""
+    return {vector.id for vector in _parent_vectors(index, parent_id, False)}
+
+
+def list_parent_metadata(index: Index, parent_id: str) -> Dict[str, Dict[str, Any]]:
+    """Return the IDs currently stored in the index for a page, with their metadata"""
+    return {vector.id: vector.metadata or {} for vector in _parent_vectors(index, parent_id, True)}
+
+
+def changed_metadata(stored: Dict[str, Any], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields of ``metadata`` that differ from the stored ones, as a patch.
+
+    Fields only the index sets, such as ``alias_urls``, are left alone, as
+    are VOLATILE_METADATA_FIELDS.
+    """
+    return {
+        name: value for name, value in metadata.items()
+        if name not in VOLATILE_METADATA_FIELDS and stored.get(name) != value
+    }
+
+
+def update_metadata(index: Index, vector_id: str, patch: Dict[str, Any]) -> None:
+    """Patch a stored vector's metadata, leaving its vectors and data as they are"""
+    index.update(id=vector_id, metadata=patch, metadata_update_mode=MetadataUpdateMode.PATCH)
+
+
+def delete_ids(index: Index, ids: Iterable[str]) -> int:
+    """Delete vectors in bulk, returning how many were removed"""
+    ids: List[str] = list(ids)
+    deleted = 0
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        result = index.delete(ids=ids[i:i + DELETE_BATCH_SIZE])
+        deleted += result.deleted
+    if deleted:
+        logger.info(f"Deleted {deleted} stale vectors")
+    return deleted
+
+
+def add_alias_urls(index: Index, vector_id: str, urls: Iterable[str]) -> bool:
+    """Record pages whose near-duplicate chunks this vector stands for.
+
+    The new pages are merged with those earlier runs and shards recorded,
+    and the metadata is patched, so the rest of the vector is untouched.
+    The list is capped at MAX_ALIAS_URLS; ``alias_count`` is exact until
+    then and a lower bound after, as pages past the cap cannot be told
+    apart. Returns False when the vector is not in the index.
+    """
+    current = index.fetch(ids=[vector_id], include_metadata=True)[0]
+    if current is None:
+        return False
+    metadata = current.metadata or {}
+    merged = sorted(set(metadata.get('alias_urls') or []) | set(urls))
+    update_metadata(index, vector_id, {
+        'alias_urls': merged[:MAX_ALIAS_URLS],
+        'alias_count': max(int(metadata.get('alias_count') or 0), len(merged))
+    })
+    return True
@@ -0,0 +1,174 @@
+"""Near-duplicate chunk detection with MinHash signatures and LSH banding.
+
+aonprd repeats trait blurbs, source lines and shared rule text on many
+pages. Each chunk body (without the heading prefix, which names the page)
+is reduced to a MinHash signature over word shingles. Signatures are split
+into bands, and chunks sharing a band are candidates. A candidate counts as
+a duplicate when the signatures agree on at least ``threshold`` of their
+positions, which estimates the Jaccard similarity of the shingle sets.
+The first chunk seen of a group is its representative.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunker import Chunk
+
+# Hash permutations are computed modulo a Mersenne prime below 2**32, so
+# products of 31-bit values stay inside uint64
+_PRIME = np.uint64((1 << 31) - 1)
+_WORD = re.compile(r'\w+')
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MIN_WORDS = 8
+MODES = ('off', 'reuse', 'collapse')
+
+
+def chunk_body(chunk: Chunk) -> str:
+    """Chunk text without the heading path prefix"""
+    length = chunk.end - chunk.start
+    return chunk.text[-length:] if length > 0 else chunk.text
+
+
+class MinHasher:
+    """MinHash signatures over k-word shingles of lower-cased text"""
+
+    def __init__(self, num_perm: int = 64, shingle_words: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+
+    def words(self, text: str) -> List[str]:
+        return _WORD.findall(text.lower())
+
+    def signature(self, words: List[str]) -> np.ndarray:
+        k = min(self.shingle_words, len(words))
+        shingles = {' '.join(words[i:i + k]) for i in range(len(words) - k + 1)}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) & 0x7FFFFFFF for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        return ((self._a * hashes[None, :] + self._b) % _PRIME).min(axis=1)
+
+
+class Representative:
+    """First chunk of a duplicate group, which the other members point to.
+
+    ``embedding`` resolves to the representative's embedding once it has
+    been generated, or to None when it failed or was never generated in
+    this run (e.g. the vector was already in the index).
+    """
+    __slots__ = ('vector_id', 'parent_id', 'url', 'embedding')
+
+    def __init__(self, vector_id: str, parent_id: str, url: str, embedding: Optional[asyncio.Future] = None):
+        self.vector_id = vector_id
+        self.parent_id = parent_id
+        self.url = url
+        self.embedding = embedding
+
+    async def get_embedding(self) -> Optional[List[float]]:
+        return await self.embedding if self.embedding is not None else None
+
+
+class DuplicateRegistry:
+    """Representatives of the chunk groups seen so far in a run.
+
+    ``mode`` decides what happens to a duplicate: with ``reuse`` it is still
+    stored, with its representative's embedding and a ``duplicate_of``
+    link; with ``collapse`` it is not stored at all and its page URL is
+    added to the representative's ``alias_urls``. Used from one event loop,
+    so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        mode: str = 'reuse',
+        threshold: float = DEFAULT_THRESHOLD,
+        min_words: int = DEFAULT_MIN_WORDS,
+        rows_per_band: int = 4,
+        hasher: Optional[MinHasher] = None
+    ):
+        if mode not in MODES[1:]:
+            raise ValueError(f"Unsupported duplicate mode: {mode}")
+        self.mode = mode
+        self.threshold = threshold
+        self.min_words = min_words
+        self.hasher = hasher or MinHasher()
+        self.rows_per_band = rows_per_band
+        self._exact: Dict[bytes, Representative] = {}
+        self._bands: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+        self._representatives: List[Representative] = []
+        self.stats = {'groups': 0, 'exact_duplicates': 0, 'near_duplicates': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['DuplicateRegistry']:
+        """Registry for DEDUP_MODE, or None when detection is off"""
+        mode = os.environ.get('DEDUP_MODE', 'off').lower()
+        if mode == 'off':
+            return None
+        return cls(
+            mode,
+            threshold=float(os.environ.get('DEDUP_THRESHOLD', DEFAULT_THRESHOLD)),
+            min_words=int(os.environ.get('DEDUP_MIN_WORDS', DEFAULT_MIN_WORDS))
+        )
+
+    def match_or_add(
+        self,
+        text: str,
+        vector_id: str,
+        parent_id: str,
+        url: str,
+        embedding: Optional[asyncio.Future] = None
+    ) -> Optional[Representative]:
+        """Return the representative of the text's group, if there is one.
+
+        Otherwise the text becomes a new representative and None is
+        returned. Texts shorter than ``min_words`` are never grouped.
+        """
+        words = self.hasher.words(text)
+        if len(words) < self.min_words:
+            return None
+
+        exact_key = hashlib.blake2b(' '.join(words).encode('utf-8'), digest_size=16).digest()
+        representative = self._exact.get(exact_key)
+        if representative is not None:
+            self.stats['exact_duplicates'] += 1
+            return representative
+
+        signature = self.hasher.signature(words)
+        bands = [
+            (band, signature[start:start + self.rows_per_band].tobytes())
+            for band, start in enumerate(range(0, len(signature), self.rows_per_band))
+        ]
+        candidates = {position for key in bands for position in self._bands.get(key, ())}
+        best, best_similarity = None, self.threshold
+        for position in candidates:
+            similarity = float(np.mean(self._signatures[position] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = position, similarity
+        if best is not None:
+            self.stats['near_duplicates'] += 1
+            self._exact[exact_key] = self._representatives[best]
+            return self._representatives[best]
+
+        representative = Representative(vector_id, parent_id, url, embedding)
+        position = len(self._representatives)
+        self._representatives.append(representative)
+        self._signatures.append(signature)
+        for key in bands:
+            self._bands.setdefault(key, []).append(position)
+        self._exact[exact_key] = representative
+        self.stats['groups'] += 1
+        return None
+
+    def report(self) -> Dict[str, int]:
+        return dict(self.stats)
@@ -0,0 +1,223 @@
+"""Parent records for the compact vector payload layout.
+
+In the full layout every chunk vector carries its page's metadata and its
+own text. In the compact layout the page-level fields and the text the
+page was chunked from are written once, as a parent record in a side
+store, and a chunk keeps only its parent reference (plus the fields
+queries filter on). The record maps each chunk ID to the span of the text
+it covers, its heading prefix, its position and its heading path, so
+``rehydrate`` rebuilds a query result's metadata and text from it.
+
+Spans and positions live in the parent record rather than on the chunks
+because content-addressed chunks are not rewritten when their text is
+unchanged, while their offsets can still move; the record is rewritten
+whenever its page is processed.
+
+The layout cuts the metadata and text held in the index and returned with
+query results, not upsert size: requests are mostly the dense and sparse
+vectors, which are unchanged. Total stored bytes, parent records included,
+stay about the same, since a page's text moves rather than disappears and
+single-chunk pages have nothing to share. ``benchmarks/payload_size.py``
+measures all three.
+"""
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+from chunker import PATH_SEPARATOR, Chunk
+
+logger = logging.getLogger()
+
+LAYOUTS = ('full', 'compact')
+# Page-level fields, repeated on every chunk in the full layout
+PARENT_FIELDS = ('title', 'source_text', 'source_link', 'url', 'content_type', 'extracted_at')
+# Page-level fields compact chunks keep, so metadata filters on them still work
+FILTER_FIELDS = ('content_type',)
+
+
+def payload_layout() -> str:
+    """Payload layout from PAYLOAD_LAYOUT ('full' or 'compact')"""
+    layout = os.environ.get('PAYLOAD_LAYOUT', 'full').lower()
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unsupported payload layout: {layout}")
+    return layout
+
+
+def _page_fields(item: Any) -> Dict[str, Any]:
+    fields = {name: getattr(item, name) for name in PARENT_FIELDS}
+    if isinstance(fields['extracted_at'], datetime):
+        fields['extracted_at'] = fields['extracted_at'].isoformat()
+    return fields
+
+
+def chunk_metadata(
+    item: Any,
+    parent_id: str,
+    chunk: Chunk,
+    chunk_index: int,
+    total_chunks: int,
+    compact: bool = False
+) -> Dict[str, Any]:
+    """Metadata stored on a chunk's vector"""
+    if compact:
+        return {**{name: getattr(item, name) for name in FILTER_FIELDS}, "parent_id": parent_id}
+    return {
+        **_page_fields(item),
+        "chunk_index": chunk_index,
+        "total_chunks": total_chunks,
+        "heading_path": PATH_SEPARATOR.join(chunk.heading_path),
+        "parent_id": parent_id
+    }
+
+
+def parent_record(item: Any, text: str, chunks: Sequence[Chunk], chunk_ids: Sequence[str]) -> Dict[str, Any]:
+    """Page fields, chunked text and per-chunk [start, end, prefix, index, heading path] of a page"""
+    spans: Dict[str, list] = {}
+    for chunk_index, (chunk, vector_id) in enumerate(zip(chunks, chunk_ids)):
+        # Repeated text maps to one vector, which keeps its first position
+        spans.setdefault(vector_id, [
+            chunk.start,
+            chunk.end,
+            chunk.text[:len(chunk.text) - (chunk.end - chunk.start)],
+            chunk_index,
+            PATH_SEPARATOR.join(chunk.heading_path)
+        ])
+    return {**_page_fields(item), 'text': text, 'total_chunks': len(chunks), 'chunks': spans}
+
+
+def chunk_text(record: Dict[str, Any], vector_id: str) -> Optional[str]:
+    """Text of a chunk rebuilt from its parent record, or None if it is not listed"""
+    span = record.get('chunks', {}).get(vector_id)
+    if span is None:
+        return None
+    start, end, prefix = span[:3]
+    return f"{prefix}{record['text'][start:end]}"
+
+
+def chunk_position(record: Dict[str, Any], vector_id: str) -> Dict[str, Any]:
+    """Position fields of a chunk from its parent record, empty if it is not listed"""
+    span = record.get('chunks', {}).get(vector_id)
+    if span is None or len(span) < 5:
+        # Records written before positions moved off the chunks
+        return {}
+    return {'chunk_index': span[3], 'total_chunks': record['total_chunks'], 'heading_path': span[4]}
+
+
+class ParentStore(ABC):
+    """Side store of parent records keyed by parent ID"""
+
+    @abstractmethod
+    def get(self, parent_id: str) -> Optional[Dict[str, Any]]:
+        """Return the record for a page, or None when there is none"""
+
+    @abstractmethod
+    def put(self, parent_id: str, record: Dict[str, Any]) -> int:
+        """Store a page's record, returning the bytes written"""
+
+
+class S3ParentStore(ParentStore):
+    """One JSON object per page under a prefix of an S3 bucket"""
+
+    def __init__(self, client: BaseClient, bucket: str, prefix: str = 'parents'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _key(self, parent_id: str) -> str:
+        return f"{self.prefix}/{parent_id[:2]}/{parent_id}.json"
+
+    def get(self, parent_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(parent_id))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def put(self, parent_id: str, record: Dict[str, Any]) -> int:
+        body = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(parent_id),
+            Body=body,
+            ContentType='application/json'
+        )
+        return len(body)
+
+
+class LocalParentStore(ParentStore):
+    """Parent records kept as files in a local directory, for tests and local runs"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, parent_id: str) -> str:
+        return os.path.join(self.directory, f"{parent_id.replace('/', '_')}.json")
+
+    def get(self, parent_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(parent_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def put(self, parent_id: str, record: Dict[str, Any]) -> int:
+        body = json.dumps(record, separators=(',', ':'))
+        tmp = f"{self._path(parent_id)}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(body)
+        os.replace(tmp, self._path(parent_id))
+        return len(body.encode('utf-8'))
+
+
+def rehydrate(store: ParentStore, results: Iterable[Any], max_workers: int = 8) -> List[Any]:
+    """Fill compact query results back in from their parent records.
+
+    Takes Upstash ``QueryResult`` or ``FetchResult`` objects and returns
+    copies whose metadata has the page fields and whose data is the chunk
+    text, fetching each page's record once. Results in the full layout, or
+    whose record is missing, are returned unchanged.
+    """
+    results = list(results)
+    parent_ids = sorted({
+        result.metadata['parent_id']
+        for result in results
+        if result.metadata and 'parent_id' in result.metadata and 'url' not in result.metadata
+    })
+    if not parent_ids:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(parent_ids))) as pool:
+        records = dict(zip(parent_ids, pool.map(store.get, parent_ids)))
+
+    rehydrated = []
+    for result in results:
+        metadata = result.metadata or {}
+        if 'url' in metadata or 'parent_id' not in metadata:
+            rehydrated.append(result)
+            continue
+        record = records[metadata['parent_id']]
+        if record is None:
+            logger.warning(f"No parent record for {result.id}")
+            rehydrated.append(result)
+            continue
+        text = chunk_text(record, result.id)
+        rehydrated.append(replace(
+            result,
+            metadata={
+                **{name: record.get(name) for name in PARENT_FIELDS},
+                **chunk_position(record, result.id),
+                **metadata
+            },
+            data=text if text is not None else result.data
+        ))
+    return rehydrated
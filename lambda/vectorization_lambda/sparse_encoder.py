@@ -0,0 +1,183 @@
+"""BM25 sparse vectors over the tiktoken vocabulary.
+
+Sparse vectors taken from the largest dense dimensions repeat what the
+dense vector already says, so exact names (spells, feats, traits) get no
+boost from the sparse side of a hybrid query. Here the sparse side is
+lexical: text is lower-cased, reduced to its words and tokenized with the
+chunker's encoding, and token IDs are the sparse indices.
+
+Scoring is split the way BM25 splits it. A chunk stores each token's
+saturated, length-normalized term frequency; a query stores each token's
+IDF; their inner product, which is what the index computes, is the BM25
+score. The IDF table is built offline from the corpus
+(``scripts/backfill.py idf``). Tokens found in more than ``max_doc_ratio``
+of chunks are left out of both sides.
+
+Stored chunk vectors depend on the table too: the length normalization
+uses its ``average_length``, and which tokens count as common follows its
+document frequencies. Extending or rebuilding the table therefore changes
+how new chunks are encoded, and stored vectors must be re-encoded (a full
+sync) to stay consistent with it.
+"""
+import io
+import json
+import math
+import os
+import re
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+from upstash_vector.types import SparseVector
+
+ENCODERS = ('dense', 'bm25')
+DEFAULT_IDF_KEY = 'sparse/idf.npz'
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+DEFAULT_MAX_DOC_RATIO = 0.5
+
+_WORD = re.compile(r'\w+')
+
+
+def sparse_encoder_name() -> str:
+    """Sparse encoder from SPARSE_ENCODER ('dense' or 'bm25')"""
+    name = os.environ.get('SPARSE_ENCODER', 'dense').lower()
+    if name not in ENCODERS:
+        raise ValueError(f"Unsupported sparse encoder: {name}")
+    return name
+
+
+def tokenize(encoding: Any, texts: Iterable[str]) -> List[np.ndarray]:
+    """Token IDs of each text's lower-cased words, each with a leading space.
+
+    Dropping punctuation and spacing words uniformly means a word maps to
+    the same tokens wherever it appears in a line. A text without words,
+    such as a table rule, is the space token alone, so no sparse vector
+    comes out empty.
+    """
+    normalized = [' ' + ' '.join(_WORD.findall(text.lower())) for text in texts]
+    return [np.asarray(tokens, dtype=np.int64) for tokens in encoding.encode_ordinary_batch(normalized)]
+
+
+class IdfTable:
+    """Document frequencies of tokens over a corpus of chunks"""
+
+    def __init__(
+        self,
+        encoding_name: str,
+        vocabulary_size: int,
+        doc_freq: Optional[np.ndarray] = None,
+        documents: int = 0,
+        total_tokens: int = 0
+    ):
+        self.encoding_name = encoding_name
+        self.doc_freq = doc_freq if doc_freq is not None else np.zeros(vocabulary_size, dtype=np.uint32)
+        self.documents = documents
+        self.total_tokens = total_tokens
+        self._idf: Optional[np.ndarray] = None
+
+    @classmethod
+    def for_encoding(cls, encoding: Any) -> 'IdfTable':
+        return cls(encoding.name, encoding.n_vocab)
+
+    @property
+    def average_length(self) -> float:
+        return self.total_tokens / self.documents if self.documents else 1.0
+
+    def add(self, documents: Iterable[np.ndarray]) -> None:
+        """Count the tokens of more chunks"""
+        for tokens in documents:
+            self.doc_freq[np.unique(tokens)] += 1
+            self.documents += 1
+            self.total_tokens += len(tokens)
+        self._idf = None
+
+    def merge(self, other: 'IdfTable') -> None:
+        if other.encoding_name != self.encoding_name:
+            raise ValueError(f"Cannot merge a {other.encoding_name} table into a {self.encoding_name} one")
+        self.doc_freq += other.doc_freq
+        self.documents += other.documents
+        self.total_tokens += other.total_tokens
+        self._idf = None
+
+    def idf(self) -> np.ndarray:
+        """BM25 IDF of every token, ln(1 + (N - df + 0.5) / (df + 0.5))"""
+        if self._idf is None:
+            df = self.doc_freq.astype(np.float64)
+            self._idf = np.log1p((self.documents - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return self._idf
+
+    def to_bytes(self) -> bytes:
+        """Compressed .npz of the tokens seen, delta-encoded, and their counts"""
+        tokens = np.flatnonzero(self.doc_freq)
+        counts = self.doc_freq[tokens]
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            header=np.array(json.dumps({
+                'encoding': self.encoding_name,
+                'vocabulary_size': len(self.doc_freq),
+                'documents': self.documents,
+                'total_tokens': self.total_tokens,
+            })),
+            token_deltas=np.diff(tokens, prepend=0).astype(np.min_scalar_type(len(self.doc_freq))),
+            doc_freq=counts.astype(np.min_scalar_type(int(counts.max()) if counts.size else 0))
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, body: bytes) -> 'IdfTable':
+        with np.load(io.BytesIO(body), allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            doc_freq = np.zeros(header['vocabulary_size'], dtype=np.uint32)
+            doc_freq[np.cumsum(data['token_deltas'], dtype=np.int64)] = data['doc_freq']
+        return cls(header['encoding'], header['vocabulary_size'], doc_freq, header['documents'], header['total_tokens'])
+
+
+class Bm25Encoder:
+    """Document and query sparse vectors scored with BM25 by inner product.
+
+    Document vectors are normalized by the table's ``average_length``, so
+    vectors encoded with different tables are not comparable.
+    """
+
+    def __init__(
+        self,
+        table: IdfTable,
+        encoding: Any,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+        max_doc_ratio: float = DEFAULT_MAX_DOC_RATIO
+    ):
+        if table.encoding_name != encoding.name:
+            raise ValueError(f"IDF table is for {table.encoding_name}, not {encoding.name}")
+        self.table = table
+        self.encoding = encoding
+        self.k1 = k1
+        self.b = b
+        # IDF at exactly max_doc_ratio of the corpus; more common tokens are dropped
+        df = max_doc_ratio * table.documents
+        self.min_idf = math.log1p((table.documents - df + 0.5) / (df + 0.5)) if table.documents else 0.0
+
+    def _counts(self, tokens: np.ndarray):
+        ids, counts = np.unique(tokens, return_counts=True)
+        keep = self.table.idf()[ids] >= self.min_idf
+        # A chunk of nothing but common words still needs a sparse vector
+        return (ids[keep], counts[keep]) if keep.any() else (ids, counts)
+
+    def encode_documents(self, texts: Iterable[str]) -> List[SparseVector]:
+        """Saturated term frequencies of each chunk"""
+        vectors = []
+        for tokens in tokenize(self.encoding, texts):
+            ids, counts = self._counts(tokens)
+            norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.table.average_length)
+            values = counts * (self.k1 + 1) / (counts + norm)
+            vectors.append(SparseVector(ids.tolist(), values.tolist()))
+        return vectors
+
+    def encode_queries(self, texts: Iterable[str]) -> List[SparseVector]:
+        """IDF of each query's distinct tokens"""
+        vectors = []
+        for tokens in tokenize(self.encoding, texts):
+            ids = self._counts(tokens)[0]
+            vectors.append(SparseVector(ids.tolist(), self.table.idf()[ids].tolist()))
+        return vectors
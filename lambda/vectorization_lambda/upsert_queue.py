@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+_CLOSE = object()
+
+# Upstash accepts at most this many vectors in one upsert request
+MAX_VECTORS_PER_REQUEST = 1000
+
+
+def payload_bytes(vector: Any) -> int:
+    """Size of a vector in an upsert request body, serialized as the client does"""
+    sparse = vector.sparse_vector
+    return len(json.dumps({
+        'id': vector.id,
+        'vector': vector.vector,
+        'sparseVector': {'indices': sparse.indices, 'values': sparse.values} if sparse is not None else None,
+        'metadata': vector.metadata,
+        'data': vector.data,
+    }, separators=(',', ':')))
+
+
+class AdaptiveBatchSizer:
+    """Byte budget for upsert requests, steered by their observed latency.
+
+    Requests are aimed at ``target_seconds`` each: large enough that the
+    per-request overhead is amortized, small enough that one slow or failed
+    request costs little. After each successful request the budget moves a
+    ``smoothing`` share of the way toward the size that would have taken
+    the target time, at most doubling at once; a failed request halves it.
+    """
+
+    def __init__(
+        self,
+        initial_bytes: int = 512 * 1024,
+        min_bytes: int = 64 * 1024,
+        max_bytes: int = 4 * 1024 * 1024,
+        target_seconds: float = 1.0,
+        smoothing: float = 0.3
+    ):
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.budget = float(min(max(initial_bytes, min_bytes), max_bytes))
+        self.stats = {'decreases': 0, 'peak_budget_bytes': int(self.budget)}
+
+    @classmethod
+    def from_env(cls) -> 'AdaptiveBatchSizer':
+        return cls(
+            initial_bytes=int(os.environ.get('UPSERT_BATCH_BYTES_INITIAL', 512 * 1024)),
+            max_bytes=int(os.environ.get('UPSERT_BATCH_BYTES_MAX', 4 * 1024 * 1024)),
+            target_seconds=float(os.environ.get('UPSERT_TARGET_SECONDS', '1.0'))
+        )
+
+    def observe(self, size: int, seconds: float) -> None:
+        """Adjust the budget from a request that succeeded"""
+        if size <= 0 or seconds <= 0:
+            return
+        ideal = min(size * self.target_seconds / seconds, self.budget * 2)
+        self.budget += (ideal - self.budget) * self.smoothing
+        self.budget = min(float(self.max_bytes), max(float(self.min_bytes), self.budget))
+        self.stats['peak_budget_bytes'] = max(self.stats['peak_budget_bytes'], int(self.budget))
+
+    def on_failure(self) -> None:
+        self.budget = max(float(self.min_bytes), self.budget / 2)
+        self.stats['decreases'] += 1
+
+    def report(self) -> Dict[str, Any]:
+        return {**self.stats, 'budget_bytes': int(self.budget)}
+
+
+class UpsertQueue:
+    """Bounded hand-off between embedding and concurrent upsert workers.
+
+    Vectors are grouped into requests of up to the sizer's byte budget (and
+    at most ``max_vectors``); full requests go onto a queue holding at most
+    ``max_pending_batches``, drained by ``workers`` coroutines calling
+    ``upsert``. When the index falls behind, ``add`` blocks, which stops the
+    producer from starting new items and keeps memory bounded.
+
+    A request that raises is retried up to ``max_attempts`` times with
+    backoff, then split in half and each half sent on its own, down to
+    single vectors; only vectors that still fail alone are handed to
+    ``on_failed``, so one bad vector never costs the rest of its request.
+    """
+
+    def __init__(
+        self,
+        upsert: Callable[[List[Any]], Awaitable[None]],
+        on_failed: Callable[[List[Any], Exception], None],
+        sizer: Optional[AdaptiveBatchSizer] = None,
+        max_vectors: int = MAX_VECTORS_PER_REQUEST,
+        workers: int = 2,
+        max_pending_batches: int = 4,
+        max_attempts: int = 2,
+        backoff_seconds: float = 0.5
+    ):
+        self.upsert = upsert
+        self.on_failed = on_failed
+        self.sizer = sizer or AdaptiveBatchSizer()
+        self.max_vectors = max_vectors
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending_batches)
+        self._buffer: List[Tuple[Any, int]] = []
+        self._buffer_bytes = 0
+        self._tasks: List[asyncio.Task] = []
+        self._started: Optional[float] = None
+        self.stats = {
+            'batches': 0,
+            'requests': 0,
+            'retries': 0,
+            'bisections': 0,
+            'failed_vectors': 0,
+            'bytes_upserted': 0,
+            'upsert_seconds': 0.0,
+            'producer_blocked_seconds': 0.0,
+            'peak_pending_batches': 0,
+        }
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        while True:
+            batch = await self._queue.get()
+            if batch is _CLOSE:
+                return
+            started = time.monotonic()
+            try:
+                await self._send(batch)
+            except Exception as error:
+                logger.error(f"Upsert worker error: {str(error)}")
+            self.stats['batches'] += 1
+            self.stats['upsert_seconds'] += time.monotonic() - started
+
+    async def _send(self, batch: List[Tuple[Any, int]], bisected: bool = False) -> None:
+        """Upsert a batch, retrying it whole first and then in halves"""
+        vectors = [vector for vector, _ in batch]
+        size = sum(size for _, size in batch)
+        error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            started = time.monotonic()
+            self.stats['requests'] += 1
+            try:
+                await self.upsert(vectors)
+            except Exception as e:
+                error = e
+                # Halves of a failed batch say more about its vectors than its size
+                if not bisected:
+                    self.sizer.on_failure()
+                continue
+            self.sizer.observe(size, time.monotonic() - started)
+            self.stats['bytes_upserted'] += size
+            return
+
+        if len(batch) == 1:
+            logger.error(f"Upsert of {vectors[0].id} failed {self.max_attempts} times: {str(error)}")
+            self.stats['failed_vectors'] += 1
+            self.on_failed(vectors, error)
+            return
+        # Isolate the vectors that fail, so the rest of the batch still lands
+        self.stats['bisections'] += 1
+        middle = len(batch) // 2
+        await self._send(batch[:middle], bisected=True)
+        await self._send(batch[middle:], bisected=True)
+
+    async def _put(self, item: Any) -> None:
+        started = time.monotonic()
+        await self._queue.put(item)
+        self.stats['producer_blocked_seconds'] += time.monotonic() - started
+        self.stats['peak_pending_batches'] = max(
+            self.stats['peak_pending_batches'], self._queue.qsize()
+        )
+
+    async def _flush(self) -> None:
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        await self._put(batch)
+
+    async def add(self, vector: Any) -> None:
+        """Buffer a vector, handing off a batch once the next would not fit"""
+        size = payload_bytes(vector)
+        if self._buffer and (
+            self._buffer_bytes + size > self.sizer.budget or len(self._buffer) >= self.max_vectors
+        ):
+            await self._flush()
+        self._buffer.append((vector, size))
+        self._buffer_bytes += size
+
+    async def close(self) -> None:
+        """Flush the partial batch and wait for all upserts to finish"""
+        if self._buffer:
+            await self._flush()
+        for _ in self._tasks:
+            await self._queue.put(_CLOSE)
+        await asyncio.gather(*self._tasks)
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()},
+            'elapsed_seconds': round(elapsed, 3),
+            'sizer': self.sizer.report(),
+        }
@@ -3,6 +3,8 @@ import * as iam from "aws-cdk-lib/aws-iam";
 import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as s3 from "aws-cdk-lib/aws-s3";
 import * as s3n from "aws-cdk-lib/aws-s3-notifications";
+import * as sqs from "aws-cdk-lib/aws-sqs";
+import { SqsEventSource } from "aws-cdk-lib/aws-lambda-event-sources";
 import { Construct, IConstruct } from "constructs";
 import { Constants } from "../../config/constants";
 import { ResourceTags, TagManager } from "../utils/tag-manager";
@@ -45,14 +47,48 @@ export class DataStack extends cdk.Stack {
       lifecycleRules: [
         {
           enabled: true,
+          prefix: "processed/",
           expiration: cdk.Duration.days(30), // Adjust retention period as needed
         },
+        {
+          // The content manifest must outlive processed output, but the index
+          // is rewritten every run so old versions only need brief retention
+          enabled: true,
+          prefix: "manifest/",
+          noncurrentVersionExpiration: cdk.Duration.days(7),
+        },
+        {
+          // One manifest per processing run listing the part objects it wrote
+          enabled: true,
+          prefix: "runs/",
+          expiration: cdk.Duration.days(30),
+        },
+        {
+          // Per-shard and merged reports of fanned-out runs
+          enabled: true,
+          prefix: "shard-reports/",
+          expiration: cdk.Duration.days(30),
+        },
+        {
+          // Checkpoints are deleted when a file completes; this clears abandoned ones
+          enabled: true,
+          prefix: "checkpoints/",
+          expiration: cdk.Duration.days(7),
+          noncurrentVersionExpiration: cdk.Duration.days(1),
+        },
       ],
     });
     addTags(this.processedDataBucket, "S3", {
       DataClassification: "Internal",
     });
 
+    // Python modules shared by both pipeline Lambdas (sharding, fan-out reports)
+    const sharedLayer = new lambda.LayerVersion(this, "SharedPythonLayer", {
+      code: lambda.Code.fromAsset("lambda/shared"),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: "Shared Python modules for the data pipeline Lambdas",
+    });
+
     // Create Lambda for data processing
     const processingLambda = new lambda.Function(this, "DataProcessingLambda", {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -63,14 +99,37 @@ export class DataStack extends cdk.Stack {
           command: [
             "bash",
             "-c",
-            "pip install -r requirements.txt -t /asset-output && cp index.py /asset-output/",
+            "pip install -r requirements.txt -t /asset-output && cp *.py /asset-output/",
           ],
         },
       }),
+      layers: [sharedLayer],
       timeout: cdk.Duration.minutes(5),
       memorySize: 1024,
       environment: {
         PROCESSED_BUCKET_NAME: this.processedDataBucket.bucketName,
+        OUTPUT_PART_SIZE_BYTES: (8 * 1024 * 1024).toString(),
+        // Processed objects are written as .jsonl.zst ("none" | "gzip" | "zstd")
+        OUTPUT_COMPRESSION: "zstd",
+        // Output rolls over to a new part object after this many uncompressed bytes,
+        // keeping each vectorization invocation to a bounded unit of work
+        OUTPUT_MAX_PART_BYTES: (16 * 1024 * 1024).toString(),
+        RUN_MANIFEST_PREFIX: "runs",
+        // Objects of one notification or SQS batch processed at once
+        RECORD_CONCURRENCY: "4",
+        // Extraction processes; set to "auto" once memorySize buys more than one vCPU
+        EXTRACTION_WORKERS: "1",
+        EXTRACTION_CHUNK_SIZE: "8",
+        FAST_EXTRACTOR_ENABLED: "true",
+        // Reuse previous results for pages whose HTML is unchanged ("off" | "skip" | "reuse")
+        MANIFEST_MODE: "reuse",
+        MANIFEST_PREFIX: "manifest",
+        // JSONL inputs above this size are split across parallel invocations
+        SHARD_SIZE_BYTES: (128 * 1024 * 1024).toString(),
+        MAX_SHARDS: "200",
+        // Stage timings go out as EMF metrics; per-item debug lines are sampled
+        METRICS_NAMESPACE: "LoreChat/Ingestion",
+        LOG_SAMPLE_RATE: "0.01",
         LOG_LEVEL: "INFO",
       },
       tracing: lambda.Tracing.ACTIVE,
@@ -92,10 +151,14 @@ export class DataStack extends cdk.Stack {
             command: [
               "bash",
               "-c",
-              "pip install -r requirements.txt -t /asset-output && cp index.py /asset-output/",
+              // The tokenizer is fetched at build time so cold starts never download it
+              "pip install -r requirements.txt -t /asset-output && cp *.py /asset-output/ && " +
+                "TIKTOKEN_CACHE_DIR=/asset-output/tiktoken_cache PYTHONPATH=/asset-output " +
+                "python -c \"import tiktoken; tiktoken.get_encoding('cl100k_base')\"",
             ],
           },
         }),
+        layers: [sharedLayer],
         timeout: cdk.Duration.minutes(5),
         memorySize: 1024,
         environment: {
@@ -103,8 +166,62 @@ export class DataStack extends cdk.Stack {
             props.infrastructureStack.upstashEndpointSecret.secretName,
           UPSTASH_TOKEN_SECRET_NAME:
             props.infrastructureStack.upstashTokenSecret.secretName,
+          // Secrets are re-read after this long, so rotation is picked up
+          SECRET_CACHE_TTL_SECONDS: "300",
           BEDROCK_EMBEDDING_MODEL: Constants.EMBEDDING_MODEL_ID,
           EMBEDDING_DIMENSIONS: Constants.EMBEDDING_DIMENSIONS.toString(),
+          // Chunks sized in tokens of the bundled tiktoken encoding
+          TIKTOKEN_CACHE_DIR: "/var/task/tiktoken_cache",
+          TIKTOKEN_ENCODING: "cl100k_base",
+          CHUNK_TOKENS: "512",
+          CHUNK_OVERLAP_TOKENS: "64",
+          // Near-duplicate chunks within an invocation share one embedding;
+          // "collapse" stores only the first and lists the others' URLs on it
+          DEDUP_MODE: "reuse",
+          DEDUP_THRESHOLD: "0.9",
+          DEDUP_MIN_WORDS: "8",
+          // "compact" stores page fields and text once per page under PARENT_STORE_PREFIX,
+          // leaving chunks a parent reference; readers must rehydrate before switching
+          PAYLOAD_LAYOUT: "full",
+          PARENT_STORE_BUCKET: this.processedDataBucket.bucketName,
+          PARENT_STORE_PREFIX: "parents",
+          // "bm25" encodes sparse vectors from chunk text with the IDF table at
+          // SPARSE_IDF_KEY (scripts/backfill.py idf); switching needs a full resync
+          SPARSE_ENCODER: "dense",
+          SPARSE_IDF_BUCKET: this.processedDataBucket.bucketName,
+          SPARSE_IDF_KEY: "sparse/idf.npz",
+          // Embeddings keyed by (model, dimensions, chunk hash)
+          EMBEDDING_CACHE_ENABLED: "true",
+          EMBEDDING_CACHE_BUCKET: this.processedDataBucket.bucketName,
+          EMBEDDING_CACHE_PREFIX: "embeddings",
+          EMBEDDING_CACHE_MEMORY_ENTRIES: "10000",
+          // Content-addressed vector IDs, upserting only new chunks ("full" | "incremental")
+          SYNC_MODE: "incremental",
+          // AIMD limit on concurrent Bedrock calls, backing off on throttling
+          EMBEDDING_CONCURRENCY_INITIAL: "4",
+          EMBEDDING_CONCURRENCY_MAX: "32",
+          EMBEDDING_MAX_RETRIES: "8",
+          // Upsert workers draining a bounded queue of batches, sized in
+          // bytes and steered toward the target latency per request
+          UPSERT_CONCURRENCY: "2",
+          UPSERT_QUEUE_BATCHES: "4",
+          UPSERT_BATCH_BYTES_INITIAL: "524288",
+          UPSERT_BATCH_BYTES_MAX: "4194304",
+          UPSERT_TARGET_SECONDS: "1.0",
+          // Objects of one notification or SQS batch vectorized at once, each
+          // with its own Bedrock concurrency limit
+          RECORD_CONCURRENCY: "2",
+          // Checkpoint and re-invoke when less than the margin is left
+          CHECKPOINT_BUCKET: this.processedDataBucket.bucketName,
+          CHECKPOINT_PREFIX: "checkpoints",
+          CHECKPOINT_MARGIN_SECONDS: "60",
+          MAX_CONTINUATIONS: "100",
+          // No SHARD_SIZE_BYTES: zstd parts cannot be split at byte offsets, and
+          // OUTPUT_MAX_PART_BYTES already makes each part its own invocation.
+          // Set it (with MAX_SHARDS) only alongside OUTPUT_COMPRESSION "none".
+          // Stage timings go out as EMF metrics; per-item debug lines are sampled
+          METRICS_NAMESPACE: "LoreChat/Ingestion",
+          LOG_SAMPLE_RATE: "0.01",
           LOG_LEVEL: "INFO",
         },
         tracing: lambda.Tracing.ACTIVE,
@@ -118,6 +235,11 @@ export class DataStack extends cdk.Stack {
     this.sourceDataBucket.grantRead(processingLambda);
     this.processedDataBucket.grantReadWrite(processingLambda);
     this.processedDataBucket.grantRead(vectorizationLambda);
+    this.processedDataBucket.grantReadWrite(vectorizationLambda, "embeddings/*");
+    this.processedDataBucket.grantReadWrite(vectorizationLambda, "parents/*");
+    this.processedDataBucket.grantReadWrite(vectorizationLambda, "checkpoints/*");
+    this.processedDataBucket.grantDelete(vectorizationLambda, "checkpoints/*");
+    this.processedDataBucket.grantReadWrite(vectorizationLambda, "shard-reports/*");
     props.infrastructureStack.upstashEndpointSecret.grantRead(
       vectorizationLambda
     );
@@ -135,18 +257,85 @@ export class DataStack extends cdk.Stack {
       })
     );
 
-    // Set up S3 event notification to trigger processing Lambda
-    this.sourceDataBucket.addEventNotification(
-      s3.EventType.OBJECT_CREATED,
-      new s3n.LambdaDestination(processingLambda)
-    );
+    // Allow both Lambdas to invoke themselves for shards and continuations.
+    // Standalone policies avoid a dependency cycle between each function and
+    // its role's default policy.
+    const allowSelfInvoke = (id: string, fn: lambda.Function) => {
+      const policy = new iam.Policy(this, id, {
+        statements: [
+          new iam.PolicyStatement({
+            effect: iam.Effect.ALLOW,
+            actions: ["lambda:InvokeFunction"],
+            resources: [fn.functionArn],
+          }),
+        ],
+      });
+      policy.attachToRole(fn.role!);
+    };
+    allowSelfInvoke("DataProcessingSelfInvokePolicy", processingLambda);
+    allowSelfInvoke("VectorizationSelfInvokePolicy", vectorizationLambda);
 
-    // Set up event notification from processed data to vectorization Lambda
-    this.processedDataBucket.addEventNotification(
-      s3.EventType.OBJECT_CREATED,
-      new s3n.LambdaDestination(vectorizationLambda),
-      { prefix: "processed/" } // Only trigger on processed files
-    );
+    // S3 notifications invoke each Lambda directly, one upload per event.
+    // With INGESTION_QUEUE=true they are buffered in an SQS queue instead and
+    // delivered in batches, which smooths bursts of uploads; only objects
+    // that failed are redelivered, and ones that keep failing are moved to
+    // a dead-letter queue rather than lost.
+    const useIngestionQueue = process.env.INGESTION_QUEUE === "true";
+    const notify = (
+      id: string,
+      bucket: s3.Bucket,
+      fn: lambda.Function,
+      batchSize: number,
+      filters: s3.NotificationKeyFilter[] = []
+    ) => {
+      if (!useIngestionQueue) {
+        bucket.addEventNotification(
+          s3.EventType.OBJECT_CREATED,
+          new s3n.LambdaDestination(fn),
+          ...filters
+        );
+        return;
+      }
+      const deadLetterQueue = new sqs.Queue(this, `${id}DeadLetterQueue`, {
+        encryption: sqs.QueueEncryption.SQS_MANAGED,
+        enforceSSL: true,
+        retentionPeriod: cdk.Duration.days(14),
+      });
+      const queue = new sqs.Queue(this, `${id}Queue`, {
+        encryption: sqs.QueueEncryption.SQS_MANAGED,
+        enforceSSL: true,
+        // Six times the function timeout, so messages are not redelivered mid-batch
+        visibilityTimeout: cdk.Duration.seconds(
+          (fn.timeout ?? cdk.Duration.minutes(5)).toSeconds() * 6
+        ),
+        deadLetterQueue: { queue: deadLetterQueue, maxReceiveCount: 5 },
+      });
+      addTags(queue, "SQS", { DataClassification: "Internal" });
+      addTags(deadLetterQueue, "SQS", { DataClassification: "Internal" });
+      bucket.addEventNotification(
+        s3.EventType.OBJECT_CREATED,
+        new s3n.SqsDestination(queue),
+        ...filters
+      );
+      fn.addEventSource(
+        new SqsEventSource(queue, {
+          batchSize,
+          maxBatchingWindow: cdk.Duration.seconds(30),
+          // Caps concurrent batches, so a burst drains at a steady rate
+          maxConcurrency: 10,
+          reportBatchItemFailures: true,
+        })
+      );
+    };
+
+    // Trigger processing on uploads of source data
+    notify("DataProcessing", this.sourceDataBucket, processingLambda, 10);
+
+    // Trigger vectorization on processed output only; batches stay small, as
+    // each part is a large unit of work within one invocation's timeout
+    notify("Vectorization", this.processedDataBucket, vectorizationLambda, 2, [
+      { prefix: "processed/" },
+    ]);
 
     // Outputs
     new cdk.CfnOutput(this, "SourceDataBucketName", {
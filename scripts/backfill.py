@@ -0,0 +1,741 @@
+"""Run a full backfill of both pipeline stages on one machine, outside Lambda.
+
+Reuses the Lambda code directly: extraction goes through the data
+processing ``iter_process_items`` (with its process pool), embedding and
+upserts through the vectorization ``process_items`` (with its adaptive
+Bedrock concurrency and upsert queue). Inputs are local JSONL files or
+``s3://bucket/prefix`` URIs, plain or compressed (``.jsonl.gz`` or
+``.jsonl.zst``). Vectors go to Upstash, or to a local JSONL file sink for
+dry runs.
+
+Progress is saved to a state file after every window of lines, keyed by
+input and its version (S3 ETag or local size), so an interrupted run
+picks up where it stopped; at worst the last window is done twice, which
+incremental sync turns into no-ops. Changed inputs start again from the
+first line.
+
+With ``--batch``, vectorize first embeds every chunk with Bedrock batch
+inference jobs, which cost less than on-demand calls and need no
+concurrency tuning, then upserts as usual with the embeddings served from
+the embedding cache. They are kept in its durable tier, the
+EMBEDDING_CACHE_BUCKET prefix or ``--cache-dir``, so memory stays bounded.
+
+``idf`` counts the chunk tokens of processed output into the IDF table
+for BM25 sparse vectors (SPARSE_ENCODER=bm25). The table at ``--output``
+is extended, not replaced: inputs already counted, per the state file, are
+skipped, so re-running over a growing prefix adds only new parts. An
+input rewritten since it was counted is counted again; delete the table
+and its state to rebuild from scratch. Stored BM25 vectors are normalized
+by the table's average chunk length, so after the table changes they are
+re-encoded with ``vectorize --sync full``.
+
+PAYLOAD_LAYOUT, DEDUP_MODE, SPARSE_ENCODER and the other vectorization
+settings are read from the environment, as the Lambda reads them.
+
+Usage:
+    python scripts/backfill.py extract crawl/*.jsonl --output processed.jsonl --workers 8
+    python scripts/backfill.py vectorize processed.jsonl --sink file:vectors.jsonl
+    python scripts/backfill.py vectorize s3://bucket/processed/ --sink upstash --concurrency 64
+    python scripts/backfill.py run crawl/*.jsonl --work-dir backfill/ --sink upstash
+    python scripts/backfill.py idf s3://bucket/processed/ --output s3://bucket/sparse/idf.npz
+    SPARSE_ENCODER=bm25 python scripts/backfill.py vectorize processed.jsonl --sync full --idf idf.npz
+    python scripts/backfill.py vectorize processed.jsonl --sink upstash \
+        --batch s3://bucket/batch-jobs/ --batch-role-arn arn:aws:iam::123456789012:role/bedrock-batch
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from batch_inference import DEFAULT_RECORDS_PER_JOB
+
+ROOT = Path(__file__).resolve().parent.parent
+LAMBDA_DIR = ROOT / 'lambda'
+SHARED_DIR = LAMBDA_DIR / 'shared' / 'python'
+READ_CHUNK_SIZE = 64 * 1024
+# Threads chunking lines and looking up their pages for batch jobs, and
+# how many lines each may have queued, so memory stays flat on any input
+LOOKUP_WORKERS = 16
+LOOKUP_LINES_PER_WORKER = 4
+
+
+def load_lambda(name: str) -> ModuleType:
+    """Import ``lambda/<name>/index.py`` as ``<name>_index``"""
+    module_name = f"{name}_index"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    for path in (SHARED_DIR, LAMBDA_DIR / name):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+    spec = importlib.util.spec_from_file_location(module_name, LAMBDA_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def log(message: str) -> None:
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+class Source:
+    """One JSONL input, local or in S3, read line by line"""
+
+    def __init__(self, uri: str, s3: Any = None, version: str = ''):
+        self.uri = uri
+        self.s3 = s3
+        self.version = version
+
+    @classmethod
+    def expand(cls, uris: List[str]) -> List['Source']:
+        """Local paths as given; S3 prefixes expanded to their objects"""
+        from record_format import is_jsonl_key
+        sources = []
+        for uri in uris:
+            if not uri.startswith('s3://'):
+                sources.append(cls(uri, version=str(os.path.getsize(uri))))
+                continue
+            from clients import get_client
+            s3 = get_client('s3')
+            bucket, _, prefix = uri[5:].partition('/')
+            for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    if is_jsonl_key(obj['Key']):
+                        sources.append(cls(f"s3://{bucket}/{obj['Key']}", s3, obj['ETag']))
+        return sources
+
+    def lines(self, start: int = 0) -> Iterator[Tuple[int, str]]:
+        from record_format import compression_for_key, is_jsonl_key, iter_lines
+        compression = compression_for_key(self.uri) if is_jsonl_key(self.uri) else None
+        if self.s3 is None:
+            raw = open(self.uri, 'rb')
+            stream = iter_lines(iter(lambda: raw.read(READ_CHUNK_SIZE), b''), compression)
+        else:
+            bucket, _, key = self.uri[5:].partition('/')
+            raw = self.s3.get_object(Bucket=bucket, Key=key, IfMatch=self.version)['Body']
+            stream = iter_lines(raw.iter_chunks(READ_CHUNK_SIZE), compression)
+        try:
+            for number, line in enumerate(stream):
+                line = line.rstrip('\n')
+                if number >= start and line.strip():
+                    yield number, line
+        finally:
+            raw.close()
+
+
+def read_location(uri: str) -> Optional[bytes]:
+    """Contents of a local file or s3://bucket/key, or None if there is none"""
+    if not uri.startswith('s3://'):
+        if not os.path.exists(uri):
+            return None
+        with open(uri, 'rb') as f:
+            return f.read()
+    from botocore.exceptions import ClientError
+    from clients import get_client
+    bucket, _, key = uri[5:].partition('/')
+    try:
+        return get_client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def write_location(uri: str, body: bytes) -> None:
+    if not uri.startswith('s3://'):
+        tmp = f"{uri}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, uri)
+        return
+    from clients import get_client
+    bucket, _, key = uri[5:].partition('/')
+    get_client('s3').put_object(Bucket=bucket, Key=key, Body=body)
+
+
+class BackfillState:
+    """Next line to process per stage and input, saved atomically as JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def next_line(self, stage: str, source: Source) -> Optional[int]:
+        """Where to resume, or None when the input is already finished"""
+        entry = self.data.get(stage, {}).get(source.uri)
+        if entry is None:
+            return 0
+        if entry['version'] != source.version:
+            log(f"{source.uri} changed since the last run, starting it again")
+            return 0
+        return None if entry.get('done') else entry['next_line']
+
+    def update(self, stage: str, source: Source, next_line: int, done: bool = False, **totals: int) -> None:
+        entry = self.data.setdefault(stage, {}).get(source.uri)
+        if entry is None or entry['version'] != source.version:
+            entry = {'version': source.version}
+            self.data[stage][source.uri] = entry
+        entry.update(next_line=next_line, done=done)
+        for name, value in totals.items():
+            entry[name] = entry.get(name, 0) + value
+        self.save()
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    """Periodic progress line with throughput"""
+
+    def __init__(self, stage: str, interval: float = 10.0):
+        self.stage = stage
+        self.interval = interval
+        self.started = self.last = time.monotonic()
+        self.counts: Dict[str, int] = {}
+
+    def add(self, force: bool = False, **counts: int) -> None:
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+        now = time.monotonic()
+        if self.counts and (force or now - self.last >= self.interval):
+            self.last = now
+            elapsed = now - self.started
+            rate = self.counts.get('items', 0) / elapsed if elapsed else 0.0
+            summary = ', '.join(f"{value} {name}" for name, value in self.counts.items())
+            log(f"{self.stage}: {summary} ({rate:.1f} items/s, {elapsed:.0f}s)")
+
+
+class FileSink:
+    """Stand-in for the Upstash index that appends vectors to a JSONL file.
+
+    Deletes are written as tombstones and metadata patches as their own
+    records. The IDs and metadata already in the file are loaded on start,
+    so incremental sync behaves as it would against the index. Calls come
+    from the engine's worker threads, so they are serialized.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record.get('deleted'):
+                        self.metadata.pop(record['id'], None)
+                    elif 'metadata_patch' in record:
+                        self.metadata.get(record['id'], {}).update(record['metadata_patch'] or {})
+                    else:
+                        self.metadata[record['id']] = record.get('metadata') or {}
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def upsert(self, vectors: List[Any], namespace: str = '') -> str:
+        lines = []
+        for vector in vectors:
+            sparse = vector.sparse_vector
+            lines.append(json.dumps({
+                'id': vector.id,
+                'vector': [float(v) for v in vector.vector],
+                'sparse_vector': {
+                    'indices': [int(i) for i in sparse.indices],
+                    'values': [float(v) for v in sparse.values],
+                } if sparse is not None else None,
+                'metadata': vector.metadata,
+                'data': vector.data,
+            }))
+        with self._lock:
+            self.metadata.update((vector.id, dict(vector.metadata or {})) for vector in vectors)
+            self._file.write('\n'.join(lines) + '\n')
+        return 'Success'
+
+    def range(
+        self,
+        cursor: str = '',
+        limit: int = 1,
+        prefix: str = '',
+        include_metadata: bool = False,
+        **kwargs
+    ) -> Any:
+        from upstash_vector.types import FetchResult, RangeResult
+        with self._lock:
+            ids = sorted(i for i in self.metadata if i.startswith(prefix) and i > cursor)
+            page = [
+                FetchResult(id=i, metadata=dict(self.metadata[i]) if include_metadata else None)
+                for i in ids[:limit]
+            ]
+        return RangeResult(next_cursor=page[-1].id if len(ids) > limit else '', vectors=page)
+
+    def fetch(self, ids: List[str], include_metadata: bool = False, **kwargs) -> List[Any]:
+        from upstash_vector.types import FetchResult
+        with self._lock:
+            return [
+                FetchResult(id=i, metadata=dict(self.metadata[i]) if include_metadata else None)
+                if i in self.metadata else None
+                for i in ids
+            ]
+
+    def update(self, id: str, metadata: Optional[Dict[str, Any]] = None, **kwargs) -> bool:
+        """Metadata patches are written as their own records"""
+        with self._lock:
+            if id not in self.metadata:
+                return False
+            self.metadata[id].update(metadata or {})
+            self._file.write(json.dumps({'id': id, 'metadata_patch': metadata}) + '\n')
+        return True
+
+    def delete(self, ids: List[str], **kwargs) -> Any:
+        from upstash_vector.types import DeleteResult
+        with self._lock:
+            deleted = [i for i in ids if i in self.metadata]
+            for i in deleted:
+                del self.metadata[i]
+                self._file.write(json.dumps({'id': i, 'deleted': True}) + '\n')
+        return DeleteResult(deleted=len(deleted))
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def extract(args: argparse.Namespace, inputs: List[str], output: str) -> Dict[str, Any]:
+    index = load_lambda('data_processing')
+    state = BackfillState(args.state)
+    progress = Progress('extract', args.progress_seconds)
+    failures = open(f"{output}.failures.jsonl", 'a', encoding='utf-8')
+
+    with open(output, 'a', encoding='utf-8') as out:
+        for source in Source.expand(inputs):
+            start = state.next_line('extract', source)
+            if start is None:
+                log(f"extract: {source.uri} already done")
+                continue
+            log(f"extract: {source.uri} from line {start}")
+            lines = source.lines(start)
+            next_line = start
+            while True:
+                window = list(islice(lines, args.window))
+                if not window:
+                    break
+                processed_count = failed_count = 0
+                results = index.iter_process_items(
+                    [line for _, line in window], workers=args.workers, chunk_size=args.chunk_size
+                )
+                for processed, failure in results:
+                    if processed:
+                        out.write(processed.model_dump_json() + '\n')
+                        processed_count += 1
+                    else:
+                        failures.write(json.dumps({'source': source.uri, **failure}) + '\n')
+                        failed_count += 1
+                out.flush()
+                failures.flush()
+                # Output is on disk before the state moves past it
+                os.fsync(out.fileno())
+                next_line = window[-1][0] + 1
+                state.update('extract', source, next_line, processed=processed_count, failed=failed_count)
+                progress.add(items=len(window), processed=processed_count, failed=failed_count)
+            state.update('extract', source, next_line, done=True)
+
+    failures.close()
+    progress.add(force=True)
+    return {'stage': 'extract', **progress.counts}
+
+
+def build_idf(args: argparse.Namespace, inputs: List[str]) -> Dict[str, Any]:
+    index = load_lambda('vectorization_lambda')
+    from chunker import get_encoding
+    from sparse_encoder import IdfTable, tokenize
+
+    encoding = get_encoding()
+    body = read_location(args.output)
+    table = IdfTable.from_bytes(body) if body is not None else IdfTable.for_encoding(encoding)
+    if table.encoding_name != encoding.name:
+        raise SystemExit(f"{args.output} was built with {table.encoding_name}, not {encoding.name}")
+    state = BackfillState(args.state)
+    progress = Progress('idf', args.progress_seconds)
+
+    for source in Source.expand(inputs):
+        # Counts are only saved per input, so a partly counted one starts over
+        if state.next_line('idf', source) is None:
+            log(f"idf: {source.uri} already counted")
+            continue
+        log(f"idf: {source.uri}")
+        lines = source.lines()
+        next_line = items = chunks = failed = 0
+        while True:
+            window = list(islice(lines, args.window))
+            if not window:
+                break
+            texts = []
+            for _, line in window:
+                try:
+                    item = index.ProcessedItem.model_validate_json(line)
+                    texts.extend(chunk.text for chunk in index.chunk_item(item))
+                except Exception:
+                    failed += 1
+            table.add(tokenize(encoding, texts))
+            next_line = window[-1][0] + 1
+            items += len(window)
+            chunks += len(texts)
+            progress.add(items=len(window), chunks=len(texts))
+        write_location(args.output, table.to_bytes())
+        state.update('idf', source, next_line, done=True, items=items, chunks=chunks, failed=failed)
+
+    progress.add(force=True)
+    return {
+        'stage': 'idf',
+        **progress.counts,
+        'encoding': table.encoding_name,
+        'documents': table.documents,
+        'distinct_tokens': int((table.doc_freq > 0).sum()),
+        'average_length': round(table.average_length, 1),
+        'table_bytes': len(table.to_bytes()),
+    }
+
+
+def batch_job_client(args: argparse.Namespace, index: ModuleType, model_id: str) -> Any:
+    from batch_inference import BedrockBatchJobs, LocalBatchJobs
+    from clients import get_client
+    if args.batch.startswith('local:'):
+        runtime = get_client('bedrock-runtime', index.BEDROCK_CLIENT_CONFIG)
+        return LocalBatchJobs(args.batch[6:], runtime, model_id)
+    if args.batch.startswith('s3://'):
+        if not args.batch_role_arn:
+            raise SystemExit("--batch-role-arn (or BATCH_ROLE_ARN) is required for Bedrock batch jobs")
+        bucket, _, prefix = args.batch[5:].partition('/')
+        return BedrockBatchJobs(
+            get_client('bedrock'), get_client('s3'), bucket, prefix, args.batch_role_arn, model_id
+        )
+    raise SystemExit(f"Unknown batch location {args.batch}; use 's3://bucket/prefix' or 'local:<dir>'")
+
+
+def texts_to_embed(index: ModuleType, sources: List[Source], sink: Any) -> Iterator[str]:
+    """Distinct chunk texts of the inputs, less those already in the sink.
+
+    ``sink`` is None for full sync, where every chunk is embedded again.
+    Lines are read as the texts are consumed, and texts are told apart by
+    a 16-byte digest, so only the digests grow with the corpus.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from index_sync import list_parent_ids, stable_chunk_id, stable_parent_id
+
+    def chunks(line: str) -> List[str]:
+        try:
+            item = index.ProcessedItem.model_validate_json(line)
+            texts = [chunk.text for chunk in index.chunk_item(item)]
+        except Exception:
+            # Reported as a failed item by the vectorize pass
+            return []
+        if sink is None:
+            return texts
+        parent_id = stable_parent_id(item.url)
+        existing = list_parent_ids(sink, parent_id)
+        return [text for text in texts if stable_chunk_id(parent_id, text) not in existing]
+
+    seen: Set[bytes] = set()
+
+    def distinct(texts: List[str]) -> Iterator[str]:
+        for text in texts:
+            digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+            if digest not in seen:
+                seen.add(digest)
+                yield text
+
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+        pending = deque()
+        for source in sources:
+            for _, line in source.lines():
+                pending.append(executor.submit(chunks, line))
+                if len(pending) >= LOOKUP_WORKERS * LOOKUP_LINES_PER_WORKER:
+                    yield from distinct(pending.popleft().result())
+        while pending:
+            yield from distinct(pending.popleft().result())
+
+
+def batch_embed(
+    args: argparse.Namespace,
+    index: ModuleType,
+    inputs: List[str],
+    sink: Any,
+    state: BackfillState
+) -> Tuple[Any, Dict[str, Any]]:
+    """Embed the inputs' chunks with batch jobs into the embedding cache.
+
+    Embeddings go to the cache's durable tier, the EMBEDDING_CACHE_BUCKET
+    prefix when set and ``--cache-dir`` otherwise, while its memory tier
+    stays at ``--cache-memory-entries``. The vectorize pass then finds
+    every batch embedding in the cache and only calls Bedrock on demand
+    for records the jobs left out or failed.
+    Submitted job IDs are saved in the state file, so an interrupted run
+    waits for the same jobs instead of submitting new ones.
+    """
+    from batch_inference import SUCCEEDED, iter_embeddings, submit_jobs, wait_for_jobs
+    from clients import get_client
+    from embedding_cache import DEFAULT_MEMORY_ENTRIES, EmbeddingCache, LocalEmbeddingStore, S3EmbeddingStore
+    model_id = os.environ.get('BEDROCK_EMBEDDING_MODEL', 'amazon.titan-embed-text-v2:0')
+    dimensions = int(os.environ.get('EMBEDDING_DIMENSIONS', '512'))
+    jobs = batch_job_client(args, index, model_id)
+    sources = Source.expand(inputs)
+    versions = {source.uri: source.version for source in sources}
+
+    saved = state.data.get('batch')
+    if saved and saved['inputs'] == versions and saved['model'] == [model_id, dimensions]:
+        job_ids = saved['jobs']
+        log(f"batch: resuming {len(job_ids)} submitted jobs")
+        if not saved.get('submitted'):
+            log("batch: submission was interrupted, chunks without a job are embedded on demand")
+    else:
+        job_ids = []
+        entry = {'inputs': versions, 'model': [model_id, dimensions], 'jobs': job_ids}
+        state.data['batch'] = entry
+
+        def submitted(job_id: str) -> None:
+            job_ids.append(job_id)
+            state.save()
+            log(f"batch: submitted {job_id}")
+
+        _, left_out = submit_jobs(
+            jobs,
+            texts_to_embed(index, sources, sink),
+            dimensions,
+            f"backfill-{time.strftime('%Y%m%d-%H%M%S')}",
+            args.batch_records_per_job,
+            on_submit=submitted
+        )
+        entry['submitted'] = True
+        state.save()
+        if left_out:
+            log(f"batch: {left_out} texts too few for a job, embedding them on demand")
+
+    def polled(states: Dict[str, str]) -> None:
+        counts: Dict[str, int] = {}
+        for status in states.values():
+            counts[status] = counts.get(status, 0) + 1
+        log(f"batch: {', '.join(f'{n} {status}' for status, n in sorted(counts.items()))}")
+
+    states = wait_for_jobs(jobs, job_ids, args.batch_poll_seconds, on_poll=polled)
+    finished = [job_id for job_id, status in states.items() if status in SUCCEEDED]
+
+    bucket = os.environ.get('EMBEDDING_CACHE_BUCKET')
+    if bucket:
+        store = S3EmbeddingStore(get_client('s3'), bucket, os.environ.get('EMBEDDING_CACHE_PREFIX', 'embeddings'))
+    else:
+        store = LocalEmbeddingStore(args.cache_dir)
+    cache = EmbeddingCache(store, args.cache_memory_entries or int(
+        os.environ.get('EMBEDDING_CACHE_MEMORY_ENTRIES', DEFAULT_MEMORY_ENTRIES)
+    ))
+    report = {
+        'jobs': len(job_ids),
+        'failed_jobs': len(job_ids) - len(finished),
+        'embeddings': 0,
+        'failed_records': 0,
+    }
+    for text, embedding in iter_embeddings(jobs, finished):
+        if embedding:
+            cache.put(model_id, dimensions, text, embedding)
+            report['embeddings'] += 1
+        else:
+            report['failed_records'] += 1
+    log(f"batch: {report['embeddings']} embeddings from {len(finished)} jobs")
+    return cache, report
+
+
+def vectorize(args: argparse.Namespace, inputs: List[str]) -> Dict[str, Any]:
+    os.environ['EMBEDDING_CONCURRENCY_MAX'] = str(args.concurrency)
+    os.environ.setdefault('EMBEDDING_CONCURRENCY_INITIAL', str(min(8, args.concurrency)))
+    index = load_lambda('vectorization_lambda')
+    from clients import get_client
+    from metrics import get_metrics
+
+    if args.sink == 'upstash':
+        if os.environ.get('UPSTASH_VECTOR_REST_URL'):
+            from upstash_vector import Index
+            sink = Index.from_env()
+        else:
+            sink = index.get_index(get_client('secretsmanager'))
+    elif args.sink.startswith('file:'):
+        sink = FileSink(args.sink[5:])
+    else:
+        raise SystemExit(f"Unknown sink {args.sink}; use 'upstash' or 'file:<path>'")
+
+    state = BackfillState(args.state)
+    progress = Progress('vectorize', args.progress_seconds)
+    incremental = args.sync == 'incremental'
+    batch_report = None
+    if args.batch:
+        cache, batch_report = batch_embed(args, index, inputs, sink if incremental else None, state)
+    else:
+        cache = index.get_embedding_cache(get_client('s3'))
+    engine = index.create_embedding_engine(
+        get_client('bedrock-runtime', index.BEDROCK_CLIENT_CONFIG), cache
+    )
+    # One registry for the whole run, so duplicates are grouped across all inputs
+    from near_duplicates import DuplicateRegistry
+    duplicates = DuplicateRegistry.from_env()
+    # With PAYLOAD_LAYOUT=compact, parent records go beside a file sink
+    if isinstance(sink, FileSink) and index.payload_layout() == 'compact':
+        from parent_store import LocalParentStore
+        parents = LocalParentStore(f"{sink.path}.parents")
+    else:
+        parents = index.get_parent_store(get_client('s3'))
+
+    if args.idf:
+        from chunker import get_encoding
+        from sparse_encoder import Bm25Encoder, IdfTable
+        body = read_location(args.idf)
+        if body is None:
+            raise SystemExit(f"No IDF table at {args.idf}")
+        sparse = Bm25Encoder(IdfTable.from_bytes(body), get_encoding())
+    else:
+        sparse = index.get_sparse_encoder(get_client('s3'))
+
+    # Shared by every window, so the upsert size learned on one carries over
+    sizer = index.AdaptiveBatchSizer.from_env()
+
+    async def run_sources() -> None:
+        # One event loop for the whole run, as the engine's limiter binds to it
+        for source in Source.expand(inputs):
+            start = state.next_line('vectorize', source)
+            if start is None:
+                log(f"vectorize: {source.uri} already done")
+                continue
+            log(f"vectorize: {source.uri} from line {start}")
+            lines = source.lines(start)
+            next_line = start
+            # Full-sync IDs are positional, so they are keyed on the input
+            item_key = Path(source.uri).name
+            while True:
+                window = [(number, line, item_key) for number, line in islice(lines, args.window)]
+                if not window:
+                    break
+                result = await index.process_items(
+                    window, engine, sink,
+                    incremental=incremental,
+                    upsert_sizer=sizer,
+                    upsert_workers=args.upsert_workers,
+                    duplicates=duplicates,
+                    parents=parents,
+                    sparse=sparse
+                )
+                if isinstance(sink, FileSink):
+                    sink.flush()
+                next_line = window[-1][0] + 1
+                state.update('vectorize', source, next_line,
+                             vectors=result.successful, failed=len(result.failed),
+                             unchanged=result.unchanged, updated=result.updated, deleted=result.deleted)
+                progress.add(items=len(window), vectors=result.successful, failed=len(result.failed),
+                             unchanged=result.unchanged, updated=result.updated, duplicates=result.duplicates)
+            state.update('vectorize', source, next_line, done=True)
+
+    try:
+        asyncio.run(run_sources())
+    finally:
+        engine.close()
+        if isinstance(sink, FileSink):
+            sink.close()
+
+    progress.add(force=True)
+    return {
+        'stage': 'vectorize',
+        **progress.counts,
+        'embedding_engine': engine.report(),
+        'embedding_cache': cache.report() if cache is not None else None,
+        'batch': batch_report,
+        'near_duplicates': duplicates.report() if duplicates is not None else None,
+        'stages': get_metrics().summary(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def common(command: argparse.ArgumentParser) -> None:
+        command.add_argument('inputs', nargs='+', help='local JSONL files or s3://bucket/prefix')
+        command.add_argument('--state', default='backfill-state.json', help='progress file for resuming')
+        command.add_argument('--window', type=int, default=500, help='lines per checkpointed window')
+        command.add_argument('--progress-seconds', type=float, default=10.0)
+
+    def extraction(command: argparse.ArgumentParser) -> None:
+        command.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        command.add_argument('--chunk-size', type=int, default=8)
+
+    def vectorization(command: argparse.ArgumentParser) -> None:
+        command.add_argument('--sink', default='upstash', help="'upstash' or 'file:<path>'")
+        command.add_argument('--sync', choices=['incremental', 'full'], default='incremental')
+        command.add_argument('--concurrency', type=int, default=32, help='maximum concurrent Bedrock calls')
+        command.add_argument('--upsert-workers', type=int, default=4)
+        command.add_argument('--batch', help="embed with batch jobs staged at 's3://bucket/prefix' "
+                                             "(or 'local:<dir>' to run them here) before upserting")
+        command.add_argument('--batch-role-arn', default=os.environ.get('BATCH_ROLE_ARN'),
+                             help='service role Bedrock assumes to read and write the batch files')
+        command.add_argument('--batch-records-per-job', type=int, default=DEFAULT_RECORDS_PER_JOB)
+        command.add_argument('--batch-poll-seconds', type=float, default=60.0)
+        command.add_argument('--cache-dir', default='backfill-embeddings',
+                             help='batch embeddings are stored here without EMBEDDING_CACHE_BUCKET')
+        command.add_argument('--cache-memory-entries', type=int,
+                             help='embeddings the batch cache keeps in memory '
+                                  '(default EMBEDDING_CACHE_MEMORY_ENTRIES, as in the Lambda)')
+        command.add_argument('--idf', help='IDF table for SPARSE_ENCODER=bm25, a local path or s3:// URI, '
+                                           'instead of SPARSE_IDF_BUCKET/SPARSE_IDF_KEY')
+
+    command = commands.add_parser('extract', help='raw crawl JSONL to processed JSONL')
+    common(command)
+    extraction(command)
+    command.add_argument('--output', required=True, help='processed JSONL, appended to')
+
+    command = commands.add_parser('vectorize', help='processed JSONL to vectors')
+    common(command)
+    vectorization(command)
+
+    command = commands.add_parser('idf', help='processed JSONL to the BM25 IDF table')
+    common(command)
+    command.add_argument('--output', required=True, help='IDF table to extend, a local path or s3:// URI')
+
+    command = commands.add_parser('run', help='extract, then vectorize the result')
+    common(command)
+    extraction(command)
+    vectorization(command)
+    command.add_argument('--work-dir', default='backfill', help='directory for the processed JSONL')
+
+    args = parser.parse_args()
+    # Per-item Lambda logging is noise at this scale
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    if args.command == 'extract':
+        reports = [extract(args, args.inputs, args.output)]
+    elif args.command == 'vectorize':
+        reports = [vectorize(args, args.inputs)]
+    elif args.command == 'idf':
+        reports = [build_idf(args, args.inputs)]
+    else:
+        os.makedirs(args.work_dir, exist_ok=True)
+        processed = os.path.join(args.work_dir, 'processed.jsonl')
+        reports = [extract(args, args.inputs, processed), vectorize(args, [processed])]
+
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
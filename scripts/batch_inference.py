@@ -0,0 +1,218 @@
+"""Embed chunk texts in bulk with Bedrock batch inference jobs.
+
+Texts are written as batch-inference JSONL records (``recordId`` plus the
+same ``modelInput`` body ``invoke_model`` takes), submitted as asynchronous
+jobs and joined back to their texts from the job output. Job handling sits
+behind ``BatchJobClient``: ``BedrockBatchJobs`` stages files in S3 and runs
+real jobs, ``LocalBatchJobs`` completes them on this machine through any
+``invoke_model`` client, so the whole flow runs offline with a stand-in.
+"""
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from itertools import count, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Bedrock rejects jobs with fewer records; smaller remainders are embedded on demand
+MIN_JOB_RECORDS = 100
+DEFAULT_RECORDS_PER_JOB = 50000
+SUCCEEDED = {'Completed', 'PartiallyCompleted'}
+TERMINAL = SUCCEEDED | {'Failed', 'Stopped', 'Expired'}
+INPUT_NAME = 'records.jsonl'
+
+
+def batch_record(record_id: str, text: str, dimensions: int) -> Dict[str, Any]:
+    return {
+        'recordId': record_id,
+        'modelInput': {'inputText': text, 'dimensions': dimensions},
+    }
+
+
+def _jsonl(records: Iterable[Dict[str, Any]]) -> bytes:
+    return ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+
+
+class BatchJobClient(ABC):
+    """Submits embedding jobs and reads back their output records"""
+
+    @abstractmethod
+    def submit(self, name: str, records: List[Dict[str, Any]]) -> str:
+        """Stage the input records and start a job, returning its ID"""
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        """Current status, one of Bedrock's job states"""
+
+    @abstractmethod
+    def outputs(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """Output records of a finished job"""
+
+
+class BedrockBatchJobs(BatchJobClient):
+    """Jobs run by Bedrock, with input and output under ``s3://bucket/prefix/<name>/``"""
+
+    def __init__(self, bedrock: Any, s3: Any, bucket: str, prefix: str, role_arn: str, model_id: str):
+        self.bedrock = bedrock
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.role_arn = role_arn
+        self.model_id = model_id
+
+    def submit(self, name: str, records: List[Dict[str, Any]]) -> str:
+        base = f"{self.prefix}/{name}" if self.prefix else name
+        self.s3.put_object(Bucket=self.bucket, Key=f"{base}/input/{INPUT_NAME}", Body=_jsonl(records))
+        response = self.bedrock.create_model_invocation_job(
+            jobName=name,
+            roleArn=self.role_arn,
+            modelId=self.model_id,
+            inputDataConfig={'s3InputDataConfig': {
+                's3Uri': f"s3://{self.bucket}/{base}/input/",
+                's3InputFormat': 'JSONL',
+            }},
+            outputDataConfig={'s3OutputDataConfig': {'s3Uri': f"s3://{self.bucket}/{base}/output/"}}
+        )
+        return response['jobArn']
+
+    def status(self, job_id: str) -> str:
+        job = self.bedrock.get_model_invocation_job(jobIdentifier=job_id)
+        if job['status'] in TERMINAL - SUCCEEDED:
+            logger.error(f"Batch job {job_id} ended {job['status']}: {job.get('message', '')}")
+        return job['status']
+
+    def outputs(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        job = self.bedrock.get_model_invocation_job(jobIdentifier=job_id)
+        bucket, _, prefix = job['outputDataConfig']['s3OutputDataConfig']['s3Uri'][5:].partition('/')
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                # Output goes to <prefix><job id>/<input name>.out, next to a manifest
+                if not obj['Key'].endswith('.jsonl.out'):
+                    continue
+                body = self.s3.get_object(Bucket=bucket, Key=obj['Key'])['Body']
+                for line in body.iter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class LocalBatchJobs(BatchJobClient):
+    """Stand-in that completes jobs in a local directory through ``invoke_model``.
+
+    Files are laid out and shaped like Bedrock's, including per-record
+    errors, so the join and fallback paths behave as they would for real.
+    A job runs the first time its status is polled.
+    """
+
+    def __init__(self, directory: str, runtime: Any, model_id: str):
+        self.directory = directory
+        self.runtime = runtime
+        self.model_id = model_id
+
+    def _path(self, job_id: str, *parts: str) -> str:
+        return os.path.join(self.directory, job_id, *parts)
+
+    def submit(self, name: str, records: List[Dict[str, Any]]) -> str:
+        os.makedirs(self._path(name, 'input'), exist_ok=True)
+        with open(self._path(name, 'input', INPUT_NAME), 'wb') as f:
+            f.write(_jsonl(records))
+        return name
+
+    def status(self, job_id: str) -> str:
+        output = self._path(job_id, 'output', f"{INPUT_NAME}.out")
+        if not os.path.exists(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(self._path(job_id, 'input', INPUT_NAME), encoding='utf-8') as f, \
+                    open(f"{output}.tmp", 'w', encoding='utf-8') as out:
+                for line in f:
+                    out.write(json.dumps(self._run(json.loads(line))) + '\n')
+            os.replace(f"{output}.tmp", output)
+        return 'Completed'
+
+    def _run(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = self.runtime.invoke_model(
+                modelId=self.model_id,
+                contentType='application/json',
+                accept='application/json',
+                body=json.dumps(record['modelInput'])
+            )
+            return {**record, 'modelOutput': json.loads(response['body'].read())}
+        except Exception as error:
+            code = getattr(error, 'response', {}).get('Error', {}).get('Code', type(error).__name__)
+            return {**record, 'error': {'errorCode': code, 'errorMessage': str(error)}}
+
+    def outputs(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        with open(self._path(job_id, 'output', f"{INPUT_NAME}.out"), encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def submit_jobs(
+    jobs: BatchJobClient,
+    texts: Iterable[str],
+    dimensions: int,
+    name_prefix: str,
+    records_per_job: int = DEFAULT_RECORDS_PER_JOB,
+    on_submit: Optional[Callable[[str], None]] = None
+) -> Tuple[List[str], int]:
+    """Submit jobs for the texts and return their IDs and the texts left out.
+
+    A final group smaller than ``MIN_JOB_RECORDS`` is not submitted; those
+    texts are counted in the second value and embedded on demand later.
+    """
+    job_ids = []
+    left_out = 0
+    texts = iter(texts)
+    for number in count():
+        group = list(islice(texts, records_per_job))
+        if not group:
+            break
+        if len(group) < MIN_JOB_RECORDS:
+            left_out = len(group)
+            break
+        records = [
+            batch_record(f"{number:04d}{i:07d}", text, dimensions) for i, text in enumerate(group)
+        ]
+        job_id = jobs.submit(f"{name_prefix}-{number:04d}", records)
+        logger.info(f"Submitted batch job {job_id} with {len(records)} records")
+        job_ids.append(job_id)
+        if on_submit is not None:
+            on_submit(job_id)
+    return job_ids, left_out
+
+
+def wait_for_jobs(
+    jobs: BatchJobClient,
+    job_ids: List[str],
+    poll_seconds: float = 60.0,
+    on_poll: Optional[Callable[[Dict[str, str]], None]] = None
+) -> Dict[str, str]:
+    """Poll until every job reaches a terminal state and return the states"""
+    states: Dict[str, str] = {}
+    while True:
+        for job_id in job_ids:
+            if states.get(job_id) not in TERMINAL:
+                states[job_id] = jobs.status(job_id)
+        if on_poll is not None:
+            on_poll(states)
+        if all(state in TERMINAL for state in states.values()):
+            return states
+        time.sleep(poll_seconds)
+
+
+def iter_embeddings(
+    jobs: BatchJobClient,
+    job_ids: Iterable[str]
+) -> Iterator[Tuple[str, Optional[List[float]]]]:
+    """Yield (text, embedding) per output record; failed records give None"""
+    for job_id in job_ids:
+        for record in jobs.outputs(job_id):
+            text = record['modelInput']['inputText']
+            if 'error' in record:
+                yield text, None
+            else:
+                yield text, (record.get('modelOutput') or {}).get('embedding')
@@ -0,0 +1,20 @@
+"""Import paths for the Lambda sources, the scripts and the offline fakes.
+
+Modules are imported by name, as the Lambda runtime does. The two
+handlers both live in an ``index`` module, so tests that need one load it
+through ``load_lambda`` from ``benchmarks/common.py`` instead.
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+for path in (
+    ROOT / 'benchmarks',
+    ROOT / 'scripts',
+    ROOT / 'lambda' / 'shared' / 'python',
+    ROOT / 'lambda' / 'data_processing',
+    ROOT / 'lambda' / 'vectorization_lambda',
+):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import backfill
+from common import load_lambda
+from fakes import install_encoding
+
+
+@pytest.fixture(scope='module')
+def index():
+    module = load_lambda('vectorization_lambda')
+    install_encoding()
+    return module
+
+
+class CountingSource(backfill.Source):
+    """Local source that records how many lines have been read"""
+
+    def __init__(self, uri):
+        super().__init__(uri)
+        self.read = 0
+
+    def lines(self, start=0):
+        for number, line in super().lines(start):
+            self.read += 1
+            yield number, line
+
+
+def write_pages(path, count, repeat_every):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({'url': f"https://x/{i}", 'title': 'Page', 'markdown': f"Body {i % repeat_every}"}) + '\n')
+
+
+def test_texts_to_embed_reads_lines_as_texts_are_consumed(index, tmp_path):
+    path = tmp_path / 'processed.jsonl'
+    write_pages(path, 2000, repeat_every=2000)
+    source = CountingSource(str(path))
+
+    texts = backfill.texts_to_embed(index, [source], None)
+    next(texts)
+    window = backfill.LOOKUP_WORKERS * backfill.LOOKUP_LINES_PER_WORKER
+    assert source.read <= window + 1
+    assert len(list(texts)) == 1999
+
+
+def test_texts_to_embed_yields_each_text_once(index, tmp_path):
+    path = tmp_path / 'processed.jsonl'
+    write_pages(path, 300, repeat_every=7)
+
+    texts = list(backfill.texts_to_embed(index, [backfill.Source(str(path))], None))
+    assert len(texts) == len(set(texts)) == 7
@@ -0,0 +1,40 @@
+from checkpoint import Checkpoint, CheckpointStore, continuation_event
+from fakes import FakeS3
+
+
+def test_checkpoint_round_trips_for_the_same_version():
+    store = CheckpointStore(FakeS3(), 'state')
+    store.save(Checkpoint(source_bucket='b', source_key='k', etag='"v1"', next_line=500, successful=480))
+
+    loaded = store.load('b', 'k', '"v1"')
+    assert (loaded.next_line, loaded.successful) == (500, 480)
+
+
+def test_checkpoint_of_another_version_is_ignored():
+    store = CheckpointStore(FakeS3(), 'state')
+    store.save(Checkpoint(source_bucket='b', source_key='k', etag='"v1"', next_line=500))
+
+    assert store.load('b', 'k', '"v2"') is None
+
+
+def test_missing_and_deleted_checkpoints_load_as_none():
+    store = CheckpointStore(FakeS3(), 'state')
+    assert store.load('b', 'k', '"v1"') is None
+
+    store.save(Checkpoint(source_bucket='b', source_key='k', etag='"v1"'))
+    store.delete('b', 'k')
+    assert store.load('b', 'k', '"v1"') is None
+
+
+def test_checkpoints_are_kept_per_object():
+    store = CheckpointStore(FakeS3(), 'state')
+    store.save(Checkpoint(source_bucket='b', source_key='one', etag='e', next_line=1))
+    store.save(Checkpoint(source_bucket='b', source_key='two', etag='e', next_line=2))
+
+    assert store.load('b', 'one', 'e').next_line == 1
+    assert store.load('b', 'two', 'e').next_line == 2
+
+
+def test_continuation_event_carries_the_shard():
+    assert continuation_event('b', 'k') == {'continuation': {'bucket': 'b', 'key': 'k'}}
+    assert continuation_event('b', 'k', {'index': 3})['continuation']['shard'] == {'index': 3}
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from fakes import FakeIndex
+from index_sync import (
+    MAX_ALIAS_URLS, add_alias_urls, changed_metadata, list_parent_ids, list_parent_metadata, stable_chunk_id,
+    stable_parent_id
+)
+
+
+def fake_index():
+    return FakeIndex(latency_ms=0, jitter_ms=0, per_vector_ms=0)
+
+
+def stored(index, vector_id, metadata):
+    index.upsert([SimpleNamespace(id=vector_id, metadata=metadata)])
+
+
+def test_ids_are_stable_and_scoped_to_the_page():
+    parent = stable_parent_id(' https://2e.aonprd.com/Spells.aspx?ID=1 ')
+    assert parent == stable_parent_id('https://2e.aonprd.com/Spells.aspx?ID=1')
+    assert stable_chunk_id(parent, 'text') == stable_chunk_id(parent, 'text')
+    assert stable_chunk_id(parent, 'text') != stable_chunk_id(parent, 'other text')
+    assert stable_chunk_id(parent, 'text').startswith(parent)
+
+
+def test_changed_metadata_is_the_patch_of_differing_fields():
+    old = {'title': 'Fireball', 'content_type': 'Spells', 'extracted_at': '2024-01-01', 'alias_urls': ['https://b']}
+    new = {'title': 'Fireball', 'content_type': 'Remaster', 'extracted_at': '2025-01-01', 'source_link': 'l'}
+    # extracted_at is volatile and alias_urls belongs to the index
+    assert changed_metadata(old, new) == {'content_type': 'Remaster', 'source_link': 'l'}
+    assert changed_metadata(old, {'title': 'Fireball', 'extracted_at': '2030-01-01'}) == {}
+
+
+def test_list_parent_pages_through_the_range():
+    index = fake_index()
+    parent = stable_parent_id('https://a')
+    ids = {stable_chunk_id(parent, f"chunk {i}") for i in range(2500)}
+    for vector_id in ids:
+        stored(index, vector_id, {'parent_id': parent})
+    stored(index, stable_chunk_id(stable_parent_id('https://b'), 'chunk 0'), {})
+
+    assert list_parent_ids(index, parent) == ids
+    metadata = list_parent_metadata(index, parent)
+    assert set(metadata) == ids
+    assert all(m == {'parent_id': parent} for m in metadata.values())
+
+
+def test_alias_urls_merge_across_runs_and_cap():
+    index = fake_index()
+    stored(index, 'rep', {'title': 'Fireball'})
+
+    assert add_alias_urls(index, 'rep', {'https://c'})
+    assert add_alias_urls(index, 'rep', {'https://b', 'https://c'})
+    assert index.vectors['rep'].metadata == {
+        'title': 'Fireball', 'alias_urls': ['https://b', 'https://c'], 'alias_count': 2
+    }
+
+    assert add_alias_urls(index, 'rep', {f"https://p/{i:03d}" for i in range(MAX_ALIAS_URLS + 5)})
+    metadata = index.vectors['rep'].metadata
+    assert len(metadata['alias_urls']) == MAX_ALIAS_URLS
+    assert metadata['alias_count'] == MAX_ALIAS_URLS + 7
+
+
+def test_alias_urls_of_a_missing_vector_report_false():
+    assert add_alias_urls(fake_index(), 'missing', {'https://b'}) is False
@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from manifest import DELTAS_DIR, PACKS_DIR, ContentManifest, LocalManifestStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalManifestStore(str(tmp_path))
+
+
+def record_pages(store, run_id, pages, deferred=False):
+    manifest = ContentManifest(store, run_id)
+    for url, (html, payload) in pages.items():
+        content_hash, entry = manifest.check(url, html)
+        if entry is None:
+            manifest.record(url, content_hash, payload)
+    return manifest, manifest.commit(deferred=deferred)
+
+
+def test_check_classifies_new_unchanged_and_changed_pages(store):
+    record_pages(store, 'run-1', {'https://a': ('<p>a</p>', '{"a": 1}')})
+
+    manifest = ContentManifest(store, 'run-2')
+    _, entry = manifest.check('https://a', '<p>a</p>')
+    assert entry is not None
+    assert manifest.check('https://a', '<p>edited</p>')[1] is None
+    assert manifest.check('https://b', '<p>b</p>')[1] is None
+    assert manifest.stats == {'unchanged': 1, 'changed': 1, 'new': 1}
+
+
+def test_salt_invalidates_recorded_pages(store):
+    record_pages(store, 'run-1', {'https://a': ('<p>a</p>', '{"a": 1}')})
+
+    manifest = ContentManifest(store, 'run-2', salt='extractor-v2')
+    assert manifest.check('https://a', '<p>a</p>')[1] is None
+    assert manifest.stats['changed'] == 1
+
+
+def test_record_and_commit_make_results_loadable(store):
+    pages = {f"https://p/{i}": (f"<p>{i}</p>", json.dumps({'i': i, 'text': 'x' * i})) for i in range(20)}
+    _, delta = record_pages(store, 'run-1', pages)
+    assert delta is None
+
+    manifest = ContentManifest(store, 'run-2')
+    for url, (html, payload) in reversed(list(pages.items())):
+        _, entry = manifest.check(url, html)
+        assert json.loads(manifest.load_previous(entry)) == json.loads(payload)
+
+
+def test_load_previous_returns_none_when_the_pack_is_gone(store, tmp_path):
+    record_pages(store, 'run-1', {'https://a': ('<p>a</p>', '{"a": 1}')})
+    os.remove(tmp_path / PACKS_DIR / 'run-1.jsonl')
+
+    manifest = ContentManifest(store, 'run-2')
+    _, entry = manifest.check('https://a', '<p>a</p>')
+    assert manifest.load_previous(entry) is None
+
+
+def test_commit_without_updates_writes_nothing(store, tmp_path):
+    manifest = ContentManifest(store, 'run-1')
+    assert manifest.commit() is None
+    assert store.load_index() == {}
+    assert os.listdir(tmp_path / DELTAS_DIR) == []
+
+
+def test_deferred_commit_writes_a_delta_until_applied(store):
+    _, first = record_pages(store, 'shard-0', {'https://a': ('<p>a</p>', '{"a": 1}')}, deferred=True)
+    _, second = record_pages(store, 'shard-1', {'https://b': ('<p>b</p>', '{"b": 1}')}, deferred=True)
+    assert (first, second) == ('shard-0', 'shard-1')
+    assert store.load_index() == {}
+
+    assert store.apply_deltas([first, second, 'missing']) == 2
+    manifest = ContentManifest(store, 'run-2')
+    assert json.loads(manifest.load_previous(manifest.check('https://b', '<p>b</p>')[1])) == {'b': 1}
+
+
+def test_save_index_merges_with_the_stored_index(store):
+    record_pages(store, 'run-1', {'https://a': ('<p>a</p>', '{"a": 1}')})
+    record_pages(store, 'run-2', {'https://b': ('<p>b</p>', '{"b": 1}')})
+
+    with gzip.open(os.path.join(store.directory, 'index.json.gz'), 'rt', encoding='utf-8') as f:
+        assert set(json.load(f)['entries']) == {'https://a', 'https://b'}
+
+
+def test_discard_drops_the_pack_and_updates(store, tmp_path):
+    manifest = ContentManifest(store, 'run-1')
+    content_hash, _ = manifest.check('https://a', '<p>a</p>')
+    manifest.record('https://a', content_hash, '{"a": 1}')
+    manifest.discard()
+
+    assert manifest.updates == {}
+    assert not (tmp_path / PACKS_DIR / 'run-1.jsonl').exists()
+    assert manifest.commit() is None
+    assert store.load_index() == {}
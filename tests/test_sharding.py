@@ -0,0 +1,95 @@
+import pytest
+
+from fakes import FakeS3
+from sharding import (
+    Shard, ShardReportStore, file_chunk_reader, iter_shard_lines, merge_reports, plan_shards, s3_chunk_reader
+)
+
+
+def lines_of(size, width=7):
+    """JSONL-like body of about ``size`` bytes with lines of varied length"""
+    lines, total, i = [], 0, 0
+    while total < size:
+        line = f'{{"n": {i}, "pad": "{"x" * (i % width)}"}}'
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    return lines
+
+
+def test_plan_shards_covers_the_object_without_gaps():
+    shards = plan_shards('run', 'bucket', 'key', size=1000, shard_bytes=300)
+    assert [(s.start, s.end) for s in shards] == [(0, 250), (250, 500), (500, 750), (750, 1000)]
+    assert {s.count for s in shards} == {4}
+
+
+def test_plan_shards_respects_max_shards_and_tiny_objects():
+    assert len(plan_shards('run', 'b', 'k', size=10_000, shard_bytes=10, max_shards=8)) == 8
+    only = plan_shards('run', 'b', 'k', size=0, shard_bytes=100)
+    assert [(s.start, s.end) for s in only] == [(0, 0)]
+
+
+@pytest.mark.parametrize('shard_bytes', [1, 17, 64, 100, 4096])
+@pytest.mark.parametrize('chunk_size', [1, 5, 64])
+def test_every_line_belongs_to_exactly_one_shard(tmp_path, shard_bytes, chunk_size):
+    lines = lines_of(600)
+    path = tmp_path / 'input.jsonl'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    size = path.stat().st_size
+
+    read_from = file_chunk_reader(str(path), chunk_size)
+    seen = [
+        line
+        for shard in plan_shards('run', 'b', 'k', size, shard_bytes)
+        for line in iter_shard_lines(read_from, shard.start, shard.end)
+    ]
+    assert seen == lines
+
+
+def test_last_line_without_newline_is_kept(tmp_path):
+    path = tmp_path / 'input.jsonl'
+    path.write_bytes(b'a\nbb\nccc')
+    read_from = file_chunk_reader(str(path), 2)
+    shards = plan_shards('run', 'b', 'k', 8, 3)
+    assert [line for s in shards for line in iter_shard_lines(read_from, s.start, s.end)] == ['a', 'bb', 'ccc']
+
+
+def test_s3_reader_reads_the_same_lines_as_a_file():
+    s3 = FakeS3()
+    body = ('\n'.join(lines_of(300)) + '\n').encode('utf-8')
+    etag = s3.put_object(Bucket='b', Key='k', Body=body)['ETag']
+    read_from = s3_chunk_reader(s3, 'b', 'k', etag=etag, chunk_size=16)
+    seen = [
+        line
+        for shard in plan_shards('run', 'b', 'k', len(body), 50)
+        for line in iter_shard_lines(read_from, shard.start, shard.end)
+    ]
+    assert seen == lines_of(300)
+
+
+def test_merge_reports_adds_concatenates_and_merges():
+    merged = merge_reports([
+        {'items': 2, 'failed': ['a'], 'stages': {'upsert': 1.5}, 'mode': 'reuse', 'partial': False},
+        {'items': 3, 'failed': ['b'], 'stages': {'upsert': 0.5, 'chunk': 1}, 'mode': 'reuse', 'partial': True},
+    ])
+    assert merged == {
+        'items': 5, 'failed': ['a', 'b'], 'stages': {'upsert': 2.0, 'chunk': 1}, 'mode': 'reuse', 'partial': False
+    }
+
+
+def test_collect_waits_for_every_shard():
+    s3 = FakeS3()
+    reports = ShardReportStore(s3, 'bucket')
+    shards = plan_shards('run', 'b', 'k', 100, 50)
+    reports.save(shards[0], {'items': 1})
+    assert reports.collect(shards[0]) is None
+
+    reports.save(shards[1], {'items': 2})
+    assert reports.collect(shards[1]) == [{'items': 1}, {'items': 2}]
+    reports.save_merged('run', {'items': 3})
+    assert len(reports.collect(shards[1])) == 2
+
+
+def test_shard_names_sort_in_index_order():
+    names = [Shard(run_id='r', bucket='b', key='k', index=i, count=12, start=0, end=0).name for i in range(12)]
+    assert names == sorted(names)
@@ -0,0 +1,40 @@
+import pytest
+
+from fakes import FakeS3
+from record_format import iter_lines
+from streaming import RollingJsonlWriter
+
+
+def stored_keys(s3):
+    return sorted(key for bucket, key in s3.objects if bucket == 'processed')
+
+
+@pytest.mark.parametrize('compression', [None, 'zstd'])
+def test_parts_roll_over_and_read_back(compression):
+    s3 = FakeS3()
+    lines = [f'{{"n": {i}}}' for i in range(10)]
+    with RollingJsonlWriter(s3, 'processed', 'out/run-part-', max_part_bytes=30, compression=compression) as writer:
+        for line in lines:
+            writer.write_line(line)
+
+    assert [part['key'] for part in writer.parts] == stored_keys(s3)
+    assert [part['records'] for part in writer.parts] == [3, 3, 3, 1]
+    read_back = [
+        line
+        for part in writer.parts
+        for line in iter_lines([s3.objects[('processed', part['key'])]], compression)
+        if line
+    ]
+    assert read_back == lines
+
+
+def test_abort_deletes_parts_that_already_closed():
+    s3 = FakeS3()
+    with pytest.raises(RuntimeError):
+        with RollingJsonlWriter(s3, 'processed', 'out/run-part-', max_part_bytes=30) as writer:
+            for i in range(5):
+                writer.write_line(f'{{"n": {i}}}')
+            raise RuntimeError('extraction failed')
+
+    assert stored_keys(s3) == []
+    assert writer.parts == []
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from upsert_queue import AdaptiveBatchSizer, UpsertQueue
+
+
+def vector(i):
+    return SimpleNamespace(id=f"v{i}", vector=[0.1] * 8, sparse_vector=None, metadata={'i': i}, data=None)
+
+
+def test_sizer_moves_toward_the_target_and_stays_in_bounds():
+    sizer = AdaptiveBatchSizer(initial_bytes=100_000, min_bytes=10_000, max_bytes=1_000_000, smoothing=1.0)
+    sizer.observe(100_000, 0.5)
+    assert sizer.budget == 200_000
+    # Never more than doubles at once, however fast the request was
+    sizer.observe(100_000, 0.001)
+    assert sizer.budget == 400_000
+    sizer.observe(400_000, 4.0)
+    assert sizer.budget == 100_000
+
+    for _ in range(10):
+        sizer.on_failure()
+    assert sizer.budget == 10_000
+    assert sizer.stats['decreases'] == 10
+
+
+def test_sizer_ignores_empty_observations():
+    sizer = AdaptiveBatchSizer(initial_bytes=100_000)
+    sizer.observe(0, 1.0)
+    sizer.observe(100_000, 0.0)
+    assert sizer.budget == 100_000
+
+
+def run_queue(vectors, upsert, **kwargs):
+    failed = []
+
+    async def main():
+        queue = UpsertQueue(upsert, lambda vs, error: failed.extend(v.id for v in vs), backoff_seconds=0, **kwargs)
+        queue.start()
+        for v in vectors:
+            await queue.add(v)
+        await queue.close()
+        return queue
+
+    return asyncio.run(main()), failed
+
+
+def test_failed_batches_are_bisected_down_to_the_bad_vectors():
+    poisoned = {'v3', 'v12'}
+    stored = []
+
+    async def upsert(vectors):
+        if poisoned & {v.id for v in vectors}:
+            raise RuntimeError('invalid vector')
+        stored.extend(v.id for v in vectors)
+
+    queue, failed = run_queue([vector(i) for i in range(16)], upsert, max_vectors=16, workers=1)
+    assert sorted(failed) == sorted(poisoned)
+    assert sorted(stored) == sorted(f"v{i}" for i in range(16) if f"v{i}" not in poisoned)
+    assert queue.stats['failed_vectors'] == 2
+    assert queue.stats['bisections'] > 0
+    # Only the first, whole batch shrinks the budget; its halves do not
+    assert queue.sizer.stats['decreases'] == queue.max_attempts
+
+
+def test_transient_failures_are_retried_without_bisecting():
+    calls = []
+
+    async def upsert(vectors):
+        calls.append(len(vectors))
+        if len(calls) == 1:
+            raise RuntimeError('timeout')
+
+    queue, failed = run_queue([vector(i) for i in range(8)], upsert, max_vectors=8, workers=1)
+    assert failed == []
+    assert calls == [8, 8]
+    assert queue.stats['retries'] == 1 and queue.stats['bisections'] == 0
+
+
+@pytest.mark.parametrize('max_vectors', [1, 3, 1000])
+def test_batches_respect_max_vectors(max_vectors):
+    sizes = []
+
+    async def upsert(vectors):
+        sizes.append(len(vectors))
+
+    run_queue([vector(i) for i in range(10)], upsert, max_vectors=max_vectors)
+    assert sum(sizes) == 10
+    assert max(sizes) <= max_vectors
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import random
+import time
+
+import pytest
+from upstash_vector.errors import UpstashError
+
+from common import load_lambda
+from fakes import FakeBedrock, FakeIndex, FakeS3, install_encoding
+from index_sync import stable_parent_id
+from near_duplicates import DuplicateRegistry
+from sharding import ShardReportStore, plan_shards
+
+WORDS = 'action attack bonus creature damage effect level range save spell strike target trait turn weapon'.split()
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    module = load_lambda('vectorization_lambda')
+    install_encoding()
+    return module
+
+
+def paragraph(seed, words=300):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words)) + '.'
+
+
+def item(idx, url, markdown, **fields):
+    record = {
+        'url': url, 'title': url.rsplit('/', 1)[-1], 'markdown': markdown, 'content_type': 'Spells',
+        'source_text': 'Source', 'source_link': 'https://source', 'extracted_at': '2024-01-01T00:00:00',
+        **fields
+    }
+    return idx, json.dumps(record), 'processed/test.jsonl'
+
+
+def process(index, items, vector_index, timeout=10, **kwargs):
+    async def run():
+        engine = index.create_embedding_engine(FakeBedrock(latency_ms=1, jitter_ms=0))
+        try:
+            return await asyncio.wait_for(
+                index.process_items(items, engine, vector_index, incremental=True, **kwargs), timeout
+            )
+        finally:
+            engine.close()
+    return asyncio.run(run())
+
+
+class FailingUpdates(FakeIndex):
+    """Index whose metadata updates fail, and whose listing of one page is slow"""
+
+    def __init__(self, slow_parent):
+        super().__init__(latency_ms=0, jitter_ms=0, per_vector_ms=0)
+        self.slow_parent = slow_parent
+        self.fail_updates = False
+
+    def range(self, cursor='', limit=1, prefix='', **kwargs):
+        if prefix.startswith(self.slow_parent):
+            time.sleep(0.1)
+        return super().range(cursor, limit, prefix, **kwargs)
+
+    def update(self, id, metadata=None, **kwargs):
+        if self.fail_updates:
+            time.sleep(0.05)
+            raise UpstashError('boom')
+        return super().update(id, metadata, **kwargs)
+
+
+def test_failed_metadata_patch_does_not_strand_near_duplicates(index):
+    first, second = f"## One\n\n{paragraph(1)}", f"## Two\n\n{paragraph(2)}"
+    vector_index = FailingUpdates(stable_parent_id('https://x/copy'))
+    result = process(index, [item(0, 'https://x/page', first)], vector_index)
+    assert result.successful == 1
+
+    # The stored chunk needs a patch that fails; the new one is a
+    # representative that the page on the slow listing then matches
+    vector_index.fail_updates = True
+    result = process(index, [
+        item(0, 'https://x/page', f"{first}\n\n{second}", content_type='Remaster'),
+        item(1, 'https://x/copy', second),
+    ], vector_index, duplicates=DuplicateRegistry('reuse'))
+
+    assert [failure['error'] for failure in result.failed] == ['boom']
+    copy = stable_parent_id('https://x/copy')
+    assert result.successful == sum(1 for vector_id in vector_index.vectors if vector_id.startswith(copy)) > 0
+
+
+class FailingFetches(FakeIndex):
+    """Index whose reads by ID fail, as alias updates start with one"""
+
+    def __init__(self):
+        super().__init__(latency_ms=0, jitter_ms=0, per_vector_ms=0)
+
+    def fetch(self, ids, include_metadata=False, **kwargs):
+        raise UpstashError('fetch unavailable')
+
+
+def test_collapsed_copies_are_reported_when_linking_fails(index):
+    body = f"## Shared\n\n{paragraph(3)}"
+    result = process(index, [
+        item(0, 'https://x/original', body),
+        item(1, 'https://x/copy', body),
+    ], FailingFetches(), duplicates=DuplicateRegistry('collapse'))
+
+    assert result.duplicates > 0
+    assert {failure['id'] for failure in result.failed} == {'https://x/copy'}
+    assert 'could not be linked: fetch unavailable' in result.failed[0]['error']
+
+
+def test_failed_shard_saves_its_report_so_the_run_merges(index, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(index, 'get_client', lambda name, config=None: s3 if name == 's3' else None)
+    first, second = plan_shards('run', 'processed', 'processed/missing.jsonl', size=200, shard_bytes=100)
+    reports = ShardReportStore(s3, 'processed', 'shard-reports/vectorization')
+    reports.save(first, {'total_items': 3, 'successful_items': 3, 'failed_items': []})
+
+    response = index.vectorize_object(second.bucket, second.key, second, None)
+
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200 and body['shards'] == 2
+    assert body['result']['successful_items'] == 3
+    assert [failure['shard'] for failure in body['result']['failed_shards']] == [second.name]
+    assert ('processed', 'shard-reports/vectorization/run/report.json') in s3.objects